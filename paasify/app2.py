@@ -20,7 +20,6 @@ prj.dump()
 from pprint import pprint  # noqa: F401
 
 from cafram.utils import (
-    to_yaml,
     to_json,
 )
 from cafram.nodes import NodeMap
@@ -28,6 +27,7 @@ from cafram.nodes import NodeMap
 import paasify.errors as error
 from paasify.common import OutputFormat
 from paasify.framework import PaasifyObj
+from paasify.yaml_io import to_yaml
 from paasify.projects import PaasifyProject, PaasifyProjectConfig
 from paasify.stacks2 import PaasifyStackManager
 from paasify.sources import SourcesManager
@@ -177,3 +177,9 @@ class PaasifyApp(NodeMap, PaasifyObj):
 
         self.add_child("project", prj)
         return prj
+
+    def shutdown(self):
+        "Release resources of the loaded project"
+
+        if self.project is not None:
+            self.project.shutdown()
@@ -0,0 +1,443 @@
+# -*- coding: utf-8 -*-
+"""Paasify cache library
+
+This library provides helpers to fingerprint stack build inputs, a cache
+to reuse previously assembled `docker-compose.run.yml` files, a cache
+for jsonnet evaluations and an in-memory cache of parsed files.
+
+Caches are stored in the project private dir, under `.paasify/cache`.
+"""
+
+# pylint: disable=logging-fstring-interpolation
+
+import os
+import re
+import json
+import time
+import shutil
+import hashlib
+import threading
+from collections import OrderedDict
+
+from pprint import pprint  # noqa: F401
+
+from paasify.framework import PaasifyObj
+from paasify.yaml_io import load_yaml_file
+
+
+# =====================================================================
+# Fingerprint helpers
+# =====================================================================
+
+# Jsonnet disk cache limits: one week since last use, and entries count
+JSONNET_CACHE_MAX_AGE = 7 * 86400
+JSONNET_CACHE_MAX_ENTRIES = 4096
+
+JSONNET_IMPORT_REGEX = re.compile(r"""import(?:str)?\s+['"](?P<path>[^'"]+)['"]""")
+ENV_REF_REGEX = re.compile(r"\$\{?(?P<name>_env_[A-Za-z0-9_]+)")
+
+
+def hash_content(content) -> str:
+    "Return the hash of a string or bytes content"
+
+    if isinstance(content, str):
+        content = content.encode("utf-8")
+    return hashlib.sha256(content).hexdigest()
+
+
+def hash_file(path) -> str:
+    "Return the hash of a file content, or None if file does not exists"
+
+    try:
+        with open(path, "rb") as _file:
+            return hash_content(_file.read())
+    except FileNotFoundError:
+        return None
+
+
+def hash_payload(payload) -> str:
+    "Return the hash of any json serializable payload, keys order is ignored"
+
+    content = json.dumps(payload, sort_keys=True, default=str)
+    return hash_content(content)
+
+
+def write_atomic(path, content):
+    "Write a file atomically, readers never see a partial file"
+
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as _file:
+            _file.write(content)
+        if os.path.isfile(path):
+            shutil.copymode(path, tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def write_if_changed(path, content) -> bool:
+    "Write a file atomically only if its content changed, return True if written"
+
+    if hash_file(path) == hash_content(content):
+        return False
+    write_atomic(path, content)
+    return True
+
+
+def jsonnet_imports(file, _seen=None) -> list:
+    """Return the list of files transitively imported by a jsonnet file
+
+    Imports are resolved relatively to the importing file, as jsonnet does
+    without any library paths.
+    """
+
+    seen = _seen if _seen is not None else []
+    try:
+        with open(file, encoding="utf-8") as _file:
+            content = _file.read()
+    except FileNotFoundError:
+        return seen
+
+    for match in JSONNET_IMPORT_REGEX.finditer(content):
+        path = os.path.join(os.path.dirname(file), match.group("path"))
+        if path in seen:
+            continue
+        seen.append(path)
+        jsonnet_imports(path, _seen=seen)
+
+    return seen
+
+
+def extract_env_refs(content) -> list:
+    "Return the sorted list of environment vars referenced via `_env_` in a string"
+
+    names = {match.group("name")[5:] for match in ENV_REF_REGEX.finditer(content)}
+    return sorted(names)
+
+
+# =====================================================================
+# Assemble cache
+# =====================================================================
+
+
+class AssembleCache(PaasifyObj):
+    """
+    Store stack assemble fingerprints to skip unchanged stacks.
+
+    Each stack owns a small json file in the cache directory, which records
+    the fingerprint of the inputs used for the last build, and the hash of
+    the generated output file. A cache entry is only valid if both the
+    fingerprint and the output file are unchanged.
+
+    The hash of the last output file started with `up` is also recorded, so
+    unchanged stacks can be skipped on apply.
+    """
+
+    conf_logger = "paasify.cli.cache"
+
+    cache_dir = None
+    name = None
+
+    def __init__(self, *args, cache_dir=None, name=None, **kwargs):
+
+        self.cache_dir = cache_dir
+        self.name = name
+        super().__init__(*args, **kwargs)
+
+    @property
+    def cache_file(self):
+        "Return the path of the cache file"
+        return os.path.join(self.cache_dir, "assemble", f"{self.name}.json")
+
+    def load(self) -> dict:
+        "Load cache entry, return an empty dict if absent or corrupted"
+
+        try:
+            with open(self.cache_file, encoding="utf-8") as _file:
+                payload = json.load(_file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+        if not isinstance(payload, dict):
+            return {}
+        return payload
+
+    def is_valid(self, fingerprint, output_file) -> bool:
+        "Return true if the output file has been built from the same fingerprint"
+
+        entry = self.load()
+        if not entry or entry.get("fingerprint") != fingerprint:
+            return False
+
+        return entry.get("output_hash") == hash_file(output_file)
+
+    def save(self, fingerprint, output_file):
+        "Record the fingerprint used to build the output file"
+
+        payload = self.load()
+        payload.update(
+            {
+                "fingerprint": fingerprint,
+                "output_file": output_file,
+                "output_hash": hash_file(output_file),
+            }
+        )
+        self._write(payload)
+
+    def is_applied(self, output_file) -> bool:
+        "Return true if the output file is the same as the last applied one"
+
+        applied_hash = self.load().get("applied_hash")
+        return applied_hash is not None and applied_hash == hash_file(output_file)
+
+    def save_applied(self, output_file):
+        "Record the hash of the applied output file"
+
+        payload = self.load()
+        payload["applied_hash"] = hash_file(output_file)
+        self._write(payload)
+
+    def clear_applied(self):
+        "Forget the last applied output file"
+
+        payload = self.load()
+        if payload.pop("applied_hash", None) is not None:
+            self._write(payload)
+
+    def _write(self, payload):
+        cache_file = self.cache_file
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        write_atomic(cache_file, json.dumps(payload, indent=2))
+
+    def clear(self):
+        "Remove cache entry"
+
+        if os.path.isfile(self.cache_file):
+            os.remove(self.cache_file)
+
+
+# =====================================================================
+# Jsonnet cache
+# =====================================================================
+
+
+class JsonnetCache(PaasifyObj):
+    """
+    Cache jsonnet evaluation results.
+
+    Results are kept in a in-process LRU shared by all stacks, and optionally
+    on disk when a cache directory is provided. The key covers the content
+    of the jsonnet file and of all its transitive imports, the action and
+    a canonical hash of the passed data. Cached values are the raw json
+    output of the evaluation.
+
+    On disk entries not used since `max_age` seconds, and the least recently
+    used ones above `max_entries`, are removed by `prune`. Results computed
+    from `_env_` variables are only kept in memory, as outputs are stored
+    in plain text.
+    """
+
+    conf_logger = "paasify.cli.cache"
+
+    def __init__(
+        self,
+        *args,
+        cache_dir=None,
+        size=256,
+        max_age=JSONNET_CACHE_MAX_AGE,
+        max_entries=JSONNET_CACHE_MAX_ENTRIES,
+        **kwargs,
+    ):
+
+        self.cache_dir = cache_dir
+        self.size = size
+        self.max_age = max_age
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+        self._lru = OrderedDict()
+        self._files = {}
+        self._imports = {}
+        self._lock = threading.Lock()
+        super().__init__(*args, **kwargs)
+
+    # Keys management
+    # ===========================
+
+    def file_hash(self, path):
+        "Return file content hash, only read again files that changed on disk"
+
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+
+        sig = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        cached = self._files.get(path)
+        if cached and cached[0] == sig:
+            return cached[1]
+
+        result = hash_file(path)
+        self._files[path] = (sig, result)
+        return result
+
+    def file_deps(self, path):
+        "Return the jsonnet file and its transitive imports"
+
+        key = (path, self.file_hash(path))
+        deps = self._imports.get(key)
+        if deps is None:
+            deps = [path] + jsonnet_imports(path)
+            self._imports[key] = deps
+        return deps
+
+    def get_key(self, file, action, data) -> str:
+        "Return cache key of a jsonnet evaluation"
+
+        payload = {
+            "files": [[dep, self.file_hash(dep)] for dep in self.file_deps(file)],
+            "action": action,
+            "data": data,
+        }
+        return hash_payload(payload)
+
+    # Cache management
+    # ===========================
+
+    def _disk_path(self, key):
+        return os.path.join(self.cache_dir, "jsonnet", f"{key}.json")
+
+    def get(self, key):
+        "Return the cached json output or None"
+
+        with self._lock:
+            if key in self._lru:
+                self._lru.move_to_end(key)
+                self.hits += 1
+                return self._lru[key]
+
+        result = None
+        if self.cache_dir:
+            path = self._disk_path(key)
+            try:
+                with open(path, encoding="utf-8") as _file:
+                    result = _file.read()
+                # Entries age from their last use
+                os.utime(path)
+            except FileNotFoundError:
+                pass
+
+        with self._lock:
+            if result is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._store(key, result)
+        return result
+
+    def set(self, key, value, persist=True):
+        "Save a json output in cache, on disk only if persist is true"
+
+        with self._lock:
+            self._store(key, value)
+
+        if self.cache_dir and persist:
+            path = self._disk_path(key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            write_atomic(path, value)
+
+    def prune(self) -> int:
+        "Remove expired and least recently used disk entries, return their count"
+
+        if not self.cache_dir:
+            return 0
+
+        entries = []
+        try:
+            with os.scandir(os.path.join(self.cache_dir, "jsonnet")) as items:
+                for item in items:
+                    # Files being written are left untouched
+                    if item.name.endswith(".json") and item.is_file():
+                        entries.append((item.stat().st_mtime, item.path))
+        except FileNotFoundError:
+            return 0
+
+        entries.sort(reverse=True)
+        limit = time.time() - self.max_age
+        removed = 0
+        for idx, (mtime, path) in enumerate(entries):
+            if idx < self.max_entries and mtime >= limit:
+                continue
+            try:
+                os.remove(path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+
+        if removed:
+            self.log.debug(f"Removed {removed} jsonnet cache entries")
+        return removed
+
+    def _store(self, key, value):
+        self._lru[key] = value
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.size:
+            self._lru.popitem(last=False)
+
+    def report(self) -> str:
+        "Return a human readable summary of cache usage"
+        return f"Jsonnet cache: {self.hits} hits, {self.misses} misses"
+
+
+# =====================================================================
+# Parsed files cache
+# =====================================================================
+
+
+def load_yaml(path):
+    "Parse a yaml file"
+    return load_yaml_file(path)
+
+
+class ParsedFileCache(PaasifyObj):
+    """
+    Cache parsed files content for a whole run.
+
+    Entries are keyed by file path and loader name, and are parsed again
+    only when the file mtime or size change. Returned values are shared
+    between all callers and must not be modified.
+    """
+
+    conf_logger = "paasify.cli.cache"
+
+    def __init__(self, *args, **kwargs):
+
+        self.hits = 0
+        self.misses = 0
+
+        self._entries = {}
+        self._lock = threading.Lock()
+        super().__init__(*args, **kwargs)
+
+    def load(self, path, loader=load_yaml, name="yaml"):
+        "Return parsed file content, parse it with loader if needed"
+
+        stat = os.stat(path)
+        sig = (stat.st_mtime_ns, stat.st_size)
+        key = (name, path)
+
+        entry = self._entries.get(key)
+        if entry and entry[0] == sig:
+            with self._lock:
+                self.hits += 1
+            return entry[1]
+
+        self.log.trace(f"Parse {name} file: {path}")
+        value = loader(path)
+        with self._lock:
+            self.misses += 1
+            self._entries[key] = (sig, value)
+        return value
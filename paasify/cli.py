@@ -23,6 +23,7 @@ paasify.apply()
 
 import os
 import sys
+import logging
 
 import traceback
 
@@ -30,18 +31,16 @@ from typing import Optional
 
 
 from pprint import pprint  # noqa: F401
-import yaml
 
-import sh
 import typer
 
-from cafram.utils import get_logger
-from cafram.base import CaframException
-
 import paasify.errors as error
 from paasify.version import __version__
 from paasify.common import OutputFormat, SchemaTarget
-from paasify.app2 import PaasifyApp
+from paasify.profiler import profiler
+
+# Heavy modules (yaml, sh, cafram, paasify.app2 and their dependencies)
+# are imported by commands when needed, to keep CLI startup fast.
 
 # from rich.console import Console
 # from rich.syntax import Syntax
@@ -60,7 +59,17 @@ from paasify.app2 import PaasifyApp
 # import logging
 # log = logging.getLogger("paasify")
 
-log = get_logger(logger_name="paasify.cli")
+log = logging.getLogger("paasify.cli")
+
+
+def setup_logger():
+    "Configure CLI logger handlers, only once"
+
+    if not log.handlers:
+        # pylint: disable=import-outside-toplevel
+        from cafram.utils import get_logger
+
+        get_logger(logger_name="paasify.cli")
 
 
 cli_app = typer.Typer(
@@ -91,6 +100,41 @@ def main(
     #     help="Path of paasify collections directory.",
     #     envvar="PAASIFY_COLLECTIONS_DIR",
     # ),
+    jsonnet_cache: bool = typer.Option(
+        False,
+        "--jsonnet-cache",
+        help="Keep jsonnet evaluation results on disk between runs.",
+        envvar="PAASIFY_JSONNET_CACHE",
+    ),
+    jsonnet_workers: int = typer.Option(
+        0,
+        "--jsonnet-workers",
+        min=0,
+        help="Number of jsonnet worker processes, 0 to evaluate in-process.",
+        envvar="PAASIFY_JSONNET_WORKERS",
+    ),
+    profile: bool = typer.Option(
+        False,
+        "--profile",
+        help="Show time spent in each build phase, stack and tag.",
+    ),
+    profile_trace: str = typer.Option(
+        None,
+        "--profile-trace",
+        help="Write build phases timings as Chrome trace-event JSON file.",
+    ),
+    engine: str = typer.Option(
+        None,
+        "--engine",
+        help="Docker engine to use, like 'docker-api'. Detected if unset.",
+        envvar="PAASIFY_ENGINE",
+    ),
+    refresh_engine: bool = typer.Option(
+        False,
+        "--refresh-engine",
+        help="Ignore cached docker engine detection.",
+        envvar="PAASIFY_REFRESH_ENGINE",
+    ),
     version: bool = typer.Option(
         False,
         "--version",
@@ -111,6 +155,11 @@ def main(
     #   5: Trace
     # 0: Not set
 
+    if version:
+        print(__version__)
+        return
+
+    setup_logger()
     verbose = 30 - (verbose * 5)
     verbose = verbose if verbose > 0 else 0
     log.setLevel(level=verbose)
@@ -131,15 +180,26 @@ def main(
             "default_source": "default",
             "cwd": os.getcwd(),
             "root_hint": working_dir,
+            "jsonnet_cache": jsonnet_cache,
+            "jsonnet_workers": jsonnet_workers,
+            "engine": engine,
+            "refresh_engine": refresh_engine,
             # "collections_dir": collections_dir,
         }
     }
 
-    if version:
-        print(__version__)
-        return
+    # Enable profiling
+    if profile or profile_trace:
+        profiler.enable()
+        ctx.call_on_close(
+            lambda: profile_report(show=profile, trace_file=profile_trace)
+        )
+
+    # pylint: disable=import-outside-toplevel
+    from paasify.app2 import PaasifyApp
 
     paasify = PaasifyApp(payload=app_conf)
+    ctx.call_on_close(paasify.shutdown)
 
     ctx.obj = {
         "paasify": paasify,
@@ -277,6 +337,12 @@ def src_tree(
 @cli_app.command("build")
 def cli_assemble(
     ctx: typer.Context,
+    no_cache: bool = typer.Option(
+        False, "--no-cache", help="Rebuild stacks even if unchanged"
+    ),
+    jobs: int = typer.Option(
+        1, "--jobs", "-j", min=1, help="Number of stacks to build in parallel"
+    ),
     stack: Optional[str] = typer.Argument(
         None,
         help="Stack to target, current cirectory or all",
@@ -286,7 +352,7 @@ def cli_assemble(
 
     paasify = ctx.obj["paasify"]
     prj = paasify.load_project()
-    prj.stacks.cmd_stack_assemble(stack_names=stack)
+    prj.stacks.cmd_stack_assemble(stack_names=stack, no_cache=no_cache, jobs=jobs)
 
 
 @cli_app.command("up")
@@ -295,6 +361,13 @@ def cli_up(
     logs: bool = typer.Option(
         False, "--logs", "-l", help="Show running logs after action"
     ),
+    jobs: int = typer.Option(
+        1,
+        "--jobs",
+        "-j",
+        min=1,
+        help="Number of independent stacks to start in parallel",
+    ),
     stack: Optional[str] = typer.Argument(
         None,
         help="Stack to target, current cirectory or all",
@@ -303,7 +376,7 @@ def cli_up(
     """Start docker stack"""
     paasify = ctx.obj["paasify"]
     prj = paasify.load_project()
-    prj.stacks.cmd_stack_up(stack_names=stack)
+    prj.stacks.cmd_stack_up(stack_names=stack, jobs=jobs)
 
     if logs:
         prj.stacks.cmd_stack_logs(stack_names=stack, follow=True)
@@ -312,6 +385,13 @@ def cli_up(
 @cli_app.command("down")
 def cli_down(
     ctx: typer.Context,
+    jobs: int = typer.Option(
+        1,
+        "--jobs",
+        "-j",
+        min=1,
+        help="Number of independent stacks to stop in parallel",
+    ),
     stack: Optional[str] = typer.Argument(
         None,
         help="Stack to target, current cirectory or all",
@@ -320,12 +400,16 @@ def cli_down(
     """Stop docker stack"""
     paasify = ctx.obj["paasify"]
     prj = paasify.load_project()
-    prj.stacks.cmd_stack_down(stack_names=stack)
+    prj.stacks.cmd_stack_down(stack_names=stack, jobs=jobs)
 
 
 @cli_app.command("ps")
 def cli_ps(
     ctx: typer.Context,
+    batch: bool = typer.Option(
+        False, help="Query all stacks with a single docker command"
+    ),
+    output_json: bool = typer.Option(False, "--json", help="Output as json"),
     stack: Optional[str] = typer.Argument(
         None,
         help="Stack to target, current cirectory or all",
@@ -334,22 +418,28 @@ def cli_ps(
     """Show docker stack instances"""
     paasify = ctx.obj["paasify"]
     prj = paasify.load_project()
-    prj.stacks.cmd_stack_ps(stack_names=stack)
+    prj.stacks.cmd_stack_ps(stack_names=stack, batch=batch, output_json=output_json)
 
 
 @cli_app.command("logs")
 def cli_logs(
     ctx: typer.Context,
     follow: bool = typer.Option(False, "--follow", "-f"),
+    since: Optional[str] = typer.Option(
+        None, "--since", help="Show logs since timestamp or relative time, like 10m"
+    ),
+    tail: Optional[int] = typer.Option(
+        None, "--tail", "-n", help="Number of lines to show from the end of logs"
+    ),
     stack: Optional[str] = typer.Argument(
         None,
         help="Stack to target, current cirectory or all",
     ),
 ):
-    """Show stack logs"""
+    """Show stack logs, all stacks are followed at once"""
     paasify = ctx.obj["paasify"]
     prj = paasify.load_project()
-    prj.stacks.cmd_stack_logs(stack_names=stack, follow=follow)
+    prj.stacks.cmd_stack_logs(stack_names=stack, follow=follow, since=since, tail=tail)
 
 
 # Stack commands (Helpers)
@@ -362,6 +452,14 @@ def cli_apply(
     logs: bool = typer.Option(
         False, "--logs", "-l", help="Show running logs after action"
     ),
+    jobs: int = typer.Option(
+        1, "--jobs", "-j", min=1, help="Number of stacks to build and start in parallel"
+    ),
+    changed_only: bool = typer.Option(
+        False,
+        "--changed-only",
+        help="Only start stacks whose run file changed since last start",
+    ),
     stack: Optional[str] = typer.Argument(
         None,
         help="Stack to target, current cirectory or all",
@@ -370,7 +468,7 @@ def cli_apply(
     """Build and apply stack"""
     paasify = ctx.obj["paasify"]
     prj = paasify.load_project()
-    prj.stacks.cmd_stack_apply(stack_names=stack)
+    prj.stacks.cmd_stack_apply(stack_names=stack, jobs=jobs, changed_only=changed_only)
 
     if logs:
         prj.stacks.cmd_stack_logs(stack_names=stack, follow=True)
@@ -382,6 +480,9 @@ def cli_recreate(
     logs: bool = typer.Option(
         False, "--logs", "-l", help="Show running logs after action"
     ),
+    jobs: int = typer.Option(
+        1, "--jobs", "-j", min=1, help="Number of stacks to process in parallel"
+    ),
     stack: Optional[str] = typer.Argument(
         None,
         help="Stack to target, current cirectory or all",
@@ -390,7 +491,7 @@ def cli_recreate(
     """Stop, rebuild and create stack"""
     paasify = ctx.obj["paasify"]
     prj = paasify.load_project()
-    prj.stacks.cmd_stack_recreate(stack_names=stack)
+    prj.stacks.cmd_stack_recreate(stack_names=stack, jobs=jobs)
 
     if logs:
         prj.stacks.cmd_stack_logs(stack_names=stack, follow=True)
@@ -400,9 +501,24 @@ def cli_recreate(
 # ==============================
 
 
+def profile_report(show=True, trace_file=None):
+    "Report profiler spans"
+
+    if show:
+        print(profiler.format_summary())
+    if trace_file:
+        profiler.write_chrome_trace(trace_file)
+        log.notice(f"Profiling trace written in: {trace_file}")
+
+
 def clean_terminate(err):
     "Terminate nicely the program depending the exception"
 
+    # pylint: disable=import-outside-toplevel
+    import yaml
+    import sh
+    from cafram.base import CaframException
+
     # log.error(traceback.format_exc())
 
     oserrors = [
@@ -464,6 +580,7 @@ def clean_terminate(err):
 def app():
     "Return a Paasify App instance"
 
+    setup_logger()
     try:
         return cli_app()
 
@@ -17,6 +17,11 @@ from pprint import pprint
 
 import shlex
 import re
+import queue
+import threading
+import functools
+
+from paasify.profiler import profiler
 
 # =====================================================================
 # Init
@@ -92,27 +97,76 @@ def find_file_up(names, paths):
     return result
 
 
-def filter_existing_files(root_path, candidates):
+class DirIndex:
+    """Index of directory contents
+
+    Each directory is listed once with a single `os.scandir` call, then
+    lookups are served from memory. Missing directories are indexed as
+    empty. The index is not refreshed: it is meant to live for a single
+    run, and must be cleared if looked up files are created meanwhile.
+    """
+
+    def __init__(self):
+        self._dirs = {}
+        self._lock = threading.Lock()
+        self.scans = 0
+
+    def files(self, path) -> frozenset:
+        "Return the names of the files in a directory"
+
+        path = os.path.abspath(path)
+        names = self._dirs.get(path)
+        if names is not None:
+            return names
+
+        try:
+            with os.scandir(path) as entries:
+                names = frozenset(x.name for x in entries if x.is_file())
+        except (FileNotFoundError, NotADirectoryError):
+            names = frozenset()
+
+        with self._lock:
+            self.scans += 1
+            self._dirs[path] = names
+        return names
+
+    def isfile(self, path) -> bool:
+        "Return true if the file exists"
+
+        dir_, name = os.path.split(path)
+        return name in self.files(dir_ or ".")
+
+    def clear(self):
+        "Drop all indexed directories"
+
+        with self._lock:
+            self._dirs = {}
+
+
+def filter_existing_files(root_path, candidates, index=None):
     """Return only existing files"""
+
+    isfile = index.isfile if index else os.path.isfile
     result = [
         os.path.join(root_path, cand)
         for cand in candidates
-        if os.path.isfile(os.path.join(root_path, cand))
+        if isfile(os.path.join(root_path, cand))
     ]
     return list(set(result))
 
 
-def lookup_candidates(lookup_config):
+def lookup_candidates(lookup_config, index=None):
     "List all available candidates of files for given folders"
 
     result = []
-    for lookup in lookup_config:
-        path = lookup["path"]
-        if path:
-            cand = filter_existing_files(path, lookup["pattern"])
+    with profiler.span("lookup_candidates"):
+        for lookup in lookup_config:
+            path = lookup["path"]
+            if path:
+                cand = filter_existing_files(path, lookup["pattern"], index=index)
 
-            lookup["matches"] = cand
-            result.append(lookup)
+                lookup["matches"] = cand
+                result.append(lookup)
 
     return result
 
@@ -163,6 +217,40 @@ def get_paasify_pkg_dir():
 # =====================================================================
 
 
+def multiplex(iterables, maxsize=1024):
+    """Consume many iterables concurrently, yield `(key, item)` as they come
+
+    Each iterable of the `iterables` dict is consumed in its own thread.
+    Items go through a bounded queue, so producers pause when the consumer
+    is slower. When an iterable raises, the exception is yielded as item
+    and other iterables continue.
+    """
+
+    done = object()
+    items = queue.Queue(maxsize=maxsize)
+
+    def _worker(key, iterable):
+        # pylint: disable=broad-except
+        try:
+            for item in iterable:
+                items.put((key, item))
+        except Exception as err:
+            items.put((key, err))
+        finally:
+            items.put((key, done))
+
+    for key, iterable in iterables.items():
+        threading.Thread(target=_worker, args=(key, iterable), daemon=True).start()
+
+    remaining = len(iterables)
+    while remaining:
+        key, item = items.get()
+        if item is done:
+            remaining -= 1
+            continue
+        yield key, item
+
+
 class StringTemplate(Template):
     """
     String Template class override to support version of python below 3.11
@@ -216,6 +304,17 @@ if hasattr(Template, "get_identifiers"):
     StringTemplate = Template  # noqa: F811
 
 
+@functools.lru_cache(maxsize=4096)
+def compile_template(value):
+    """Return a parsed StringTemplate and its identifiers
+
+    Results are cached by source string, templates are then only parsed once.
+    """
+
+    tpl = StringTemplate(value)
+    return tpl, tuple(tpl.get_identifiers())
+
+
 # =====================================================================
 # Beta libs (DEPRECATED)
 # =====================================================================
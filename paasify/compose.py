@@ -0,0 +1,673 @@
+# -*- coding: utf-8 -*-
+"""Paasify compose library
+
+This library provides a pure Python implementation of `docker compose config`,
+limited to the subset of the compose specification used by paasify:
+
+* Variable interpolation (`$VAR`, `${VAR}`, `${VAR:-default}`, `${VAR-default}`,
+  `${VAR:?err}`, `${VAR?err}`, `${VAR:+alt}`, `${VAR+alt}` and `$$` escapes,
+  a `$` not followed by a name or `{` is kept as is)
+* Override rules when merging many compose files
+* Project name, default network and service networks normalization
+* Ports and volumes short syntax, `depends_on` lists and project volume names
+* Relative `volumes`, `env_file` and `build` paths, resolved from the project
+  directory, and env files loaded into the service environment
+* Fast extraction of service and network names
+
+Other compose features (extends, profiles, secrets and configs paths ...)
+are left untouched and are forwarded as is.
+"""
+
+# pylint: disable=logging-fstring-interpolation
+
+import os
+import re
+import logging
+from pprint import pprint  # noqa: F401
+
+import yaml
+
+import paasify.errors as error
+from paasify.yaml_io import YAML_LOADER, load_yaml_file
+
+
+log = logging.getLogger(__name__)
+
+
+# =====================================================================
+# Interpolation
+# =====================================================================
+
+VAR_NAME_REGEX = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+VAR_BRACED_REGEX = re.compile(
+    r"^(?P<name>[A-Za-z_][A-Za-z0-9_]*)(?:(?P<op>:?[-?+])(?P<arg>.*))?$", re.DOTALL
+)
+
+
+def _find_closing_brace(value, start):
+    "Return the index of the brace closing the one opened before start"
+
+    depth = 1
+    idx = start
+    while idx < len(value):
+        char = value[idx]
+        if char == "$" and value[idx + 1: idx + 2] == "{":
+            depth += 1
+            idx += 2
+            continue
+        if char == "}":
+            depth -= 1
+            if depth == 0:
+                return idx
+        idx += 1
+
+    raise error.DockerBuildConfig(f"Invalid interpolation format, missing '}}': {value}")
+
+
+def _resolve_braced(expr, env, hint=None):
+    "Resolve the content of a ${...} expression"
+
+    match = VAR_BRACED_REGEX.match(expr)
+    if not match:
+        raise error.DockerBuildConfig(
+            f"Invalid interpolation format for {hint}: ${{{expr}}}"
+        )
+
+    name = match.group("name")
+    oper = match.group("op")
+    arg = match.group("arg") or ""
+    value = env.get(name)
+    is_set = value is not None
+    is_empty = not value
+
+    if oper is None:
+        if not is_set:
+            log.warning(f"The '{name}' variable is not set. Defaulting to a blank string.")
+            return ""
+        return value
+
+    if oper in ["-", ":-"]:
+        unset = not is_set if oper == "-" else is_empty
+        return interpolate_string(arg, env, hint=hint) if unset else value
+
+    if oper in ["?", ":?"]:
+        unset = not is_set if oper == "?" else is_empty
+        if unset:
+            msg = interpolate_string(arg, env, hint=hint)
+            raise error.DockerBuildConfig(f"Required variable '{name}' is missing a value: {msg}")
+        return value
+
+    # Operators: + and :+
+    used = is_set if oper == "+" else not is_empty
+    return interpolate_string(arg, env, hint=hint) if used else ""
+
+
+def interpolate_string(value, env, hint=None):
+    """Interpolate variables in a string, return a string with literal '$'
+
+    A `$` not followed by a name or `{`, like in `cost $5`, is kept as is.
+    """
+
+    result = []
+    idx = 0
+    while idx < len(value):
+        char = value[idx]
+        if char != "$":
+            result.append(char)
+            idx += 1
+            continue
+
+        nxt = value[idx + 1: idx + 2]
+        if nxt == "$":
+            result.append("$")
+            idx += 2
+        elif nxt == "{":
+            end = _find_closing_brace(value, idx + 2)
+            result.append(_resolve_braced(value[idx + 2: end], env, hint=hint))
+            idx = end + 1
+        else:
+            match = VAR_NAME_REGEX.match(value, idx + 1)
+            if not match:
+                result.append("$")
+                idx += 1
+                continue
+            result.append(_resolve_braced(match.group(0), env, hint=hint))
+            idx = match.end()
+
+    return "".join(result)
+
+
+def interpolate(payload, env, hint=None):
+    "Interpolate recursively all string values of a payload"
+
+    if isinstance(payload, str):
+        return interpolate_string(payload, env, hint=hint)
+    if isinstance(payload, dict):
+        return {
+            key: interpolate(val, env, hint=f"{hint}.{key}" if hint else key)
+            for key, val in payload.items()
+        }
+    if isinstance(payload, list):
+        return [interpolate(val, env, hint=hint) for val in payload]
+    return payload
+
+
+def escape(payload):
+    "Escape back literal '$' in string values, as `docker compose config` does"
+
+    if isinstance(payload, str):
+        return payload.replace("$", "$$")
+    if isinstance(payload, dict):
+        return {key: escape(val) for key, val in payload.items()}
+    if isinstance(payload, list):
+        return [escape(val) for val in payload]
+    return payload
+
+
+def load_env_file(path) -> dict:
+    "Load a compose `.env` file"
+
+    result = {}
+    if not os.path.isfile(path):
+        return result
+
+    with open(path, encoding="utf-8") as _file:
+        for line in _file.readlines():
+            line = line.strip()
+            if not line or line.startswith("#") or "=" not in line:
+                continue
+            key, value = line.split("=", 1)
+            value = value.strip()
+            if len(value) > 1 and value[0] == value[-1] and value[0] in "\"'":
+                value = value[1:-1]
+            result[key.strip()] = value
+
+    return result
+
+
+# =====================================================================
+# Normalization
+# =====================================================================
+
+
+def _to_str(value):
+    "Cast scalar values to strings, as compose does for mappings"
+
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return str(value)
+
+
+def _list_to_mapping(value, sep="="):
+    "Transform a list of KEY=VALUE into a mapping"
+
+    if isinstance(value, dict):
+        return {key: _to_str(val) for key, val in value.items()}
+
+    result = {}
+    for item in value or []:
+        if sep in item:
+            key, val = item.split(sep, 1)
+            result[key] = val
+        else:
+            result[item] = None
+    return result
+
+
+def _networks_to_mapping(value):
+    if isinstance(value, dict):
+        return dict(value)
+    return {name: None for name in value or []}
+
+
+def _depends_to_mapping(value):
+    if isinstance(value, dict):
+        return dict(value)
+    return {name: {"condition": "service_started"} for name in value or []}
+
+
+def _volume_target(volume):
+    "Return the target path of a volume definition"
+
+    if isinstance(volume, dict):
+        return volume.get("target")
+    parts = volume.split(":")
+    return parts[1] if len(parts) > 1 else parts[0]
+
+
+def _source_key(item):
+    if isinstance(item, dict):
+        return item.get("source")
+    return item
+
+
+SERVICE_MAPPINGS = {
+    "environment": _list_to_mapping,
+    "labels": _list_to_mapping,
+    "sysctls": _list_to_mapping,
+    "extra_hosts": lambda value: _list_to_mapping(value, sep=":"),
+    "networks": _networks_to_mapping,
+    "depends_on": _depends_to_mapping,
+}
+
+SERVICE_KEYED_SEQUENCES = {
+    "volumes": _volume_target,
+    "devices": _volume_target,
+    "secrets": _source_key,
+    "configs": _source_key,
+}
+
+SERVICE_REPLACED = ["command", "entrypoint"]
+
+
+def normalize_service(service):
+    "Normalize service mappings"
+
+    result = dict(service)
+    for key, func in SERVICE_MAPPINGS.items():
+        if key in result and result[key] is not None:
+            result[key] = func(result[key])
+
+    build = result.get("build")
+    if isinstance(build, str):
+        result["build"] = {"context": build}
+
+    return result
+
+
+# =====================================================================
+# Short syntax and paths
+# =====================================================================
+
+
+def _port_range(value):
+    "Return the list of ports of a port or a port range"
+
+    if "-" not in value:
+        return [value]
+    start, end = value.split("-", 1)
+    try:
+        return [str(port) for port in range(int(start), int(end) + 1)]
+    except ValueError as err:
+        raise error.DockerBuildConfig(f"Invalid port range: {value}") from err
+
+
+def normalize_ports(ports):
+    "Transform short syntax ports into long syntax ports"
+
+    result = []
+    for port in ports or []:
+        if isinstance(port, dict):
+            result.append(port)
+            continue
+
+        value, protocol = str(port), "tcp"
+        if "/" in value:
+            value, protocol = value.rsplit("/", 1)
+
+        host_ip, published = None, None
+        parts = value.rsplit(":", 2)
+        if len(parts) == 3:
+            host_ip, published, target = parts
+            host_ip = host_ip.strip("[]")
+        elif len(parts) == 2:
+            published, target = parts
+        else:
+            target = parts[0]
+
+        targets = _port_range(target)
+        publisheds = _port_range(published) if published else []
+        if len(publisheds) != len(targets):
+            publisheds = [published] * len(targets)
+
+        for target, published in zip(targets, publisheds):
+            item = {"mode": "ingress"}
+            if host_ip:
+                item["host_ip"] = host_ip
+            try:
+                item["target"] = int(target)
+            except ValueError as err:
+                raise error.DockerBuildConfig(f"Invalid port: {port}") from err
+            if published:
+                item["published"] = published
+            item["protocol"] = protocol
+            result.append(item)
+
+    return result
+
+
+def _is_path(value):
+    return value.startswith((".", "/", "~"))
+
+
+def _abs_path(value, project_dir):
+    "Return the absolute path of value, relative to project dir"
+
+    return os.path.normpath(os.path.join(project_dir, os.path.expanduser(value)))
+
+
+def normalize_volume(volume, project_dir):
+    "Transform a short syntax volume into long syntax and resolve bind paths"
+
+    if isinstance(volume, dict):
+        volume = dict(volume)
+        source = volume.get("source")
+        if volume.get("type") == "bind" and source:
+            volume["source"] = _abs_path(source, project_dir)
+        return volume
+
+    parts = volume.split(":")
+    if len(parts) == 1:
+        return {"type": "volume", "target": parts[0], "volume": {}}
+    if len(parts) > 3:
+        raise error.DockerBuildConfig(f"Invalid volume specification: {volume}")
+
+    source, target = parts[0], parts[1]
+    options = parts[2].split(",") if len(parts) == 3 else []
+
+    if _is_path(source):
+        result = {
+            "type": "bind",
+            "source": _abs_path(source, project_dir),
+            "target": target,
+        }
+        extra = {"create_host_path": True}
+    else:
+        result = {"type": "volume", "source": source, "target": target}
+        extra = {}
+
+    for option in options:
+        if option == "ro":
+            result["read_only"] = True
+        elif option in ["z", "Z"] and result["type"] == "bind":
+            extra["selinux"] = option
+        elif option == "nocopy" and result["type"] == "volume":
+            extra["nocopy"] = True
+
+    result[result["type"]] = extra
+    return result
+
+
+def resolve_service(service, project_dir):
+    """Resolve service short syntaxes and relative paths
+
+    Relative paths are resolved from the project directory, ports and
+    volumes are converted to their long syntax and env files are loaded
+    into the service environment, explicit environment wins.
+    """
+
+    result = dict(service)
+
+    if result.get("ports"):
+        result["ports"] = normalize_ports(result["ports"])
+
+    if result.get("volumes"):
+        result["volumes"] = [
+            normalize_volume(volume, project_dir) for volume in result["volumes"]
+        ]
+
+    build = result.get("build")
+    if isinstance(build, dict) and build.get("context"):
+        context = build["context"]
+        if "://" not in context and not context.startswith("git@"):
+            result["build"] = dict(build, context=_abs_path(context, project_dir))
+
+    env_files = result.get("env_file")
+    if env_files:
+        if isinstance(env_files, str):
+            env_files = [env_files]
+        env_files = [_abs_path(path, project_dir) for path in env_files]
+
+        environment = {}
+        for path in env_files:
+            if not os.path.isfile(path):
+                raise error.DockerBuildConfig(f"Couldn't find env file: {path}")
+            environment.update(load_env_file(path))
+        environment.update(result.get("environment") or {})
+
+        result["env_file"] = env_files
+        result["environment"] = environment
+
+    return result
+
+
+# =====================================================================
+# Merge
+# =====================================================================
+
+
+def merge_mapping(base, override):
+    "Merge recursively two mappings, override values win"
+
+    result = dict(base)
+    for key, val in override.items():
+        if isinstance(val, dict) and isinstance(result.get(key), dict):
+            result[key] = merge_mapping(result[key], val)
+        else:
+            result[key] = val
+    return result
+
+
+def _merge_keyed(base, override, key_fn):
+    "Merge two sequences, items with the same key are replaced"
+
+    result = {key_fn(item): item for item in base}
+    for item in override:
+        result[key_fn(item)] = item
+    return list(result.values())
+
+
+def _merge_unique(base, override):
+    result = list(base)
+    for item in override:
+        if item not in result:
+            result.append(item)
+    return result
+
+
+def merge_service(base, override):
+    "Merge two services definition following compose override rules"
+
+    result = dict(base)
+    for key, val in override.items():
+        current = result.get(key)
+
+        if key in SERVICE_REPLACED or current is None or val is None:
+            result[key] = val
+        elif key in SERVICE_MAPPINGS:
+            result[key] = merge_mapping(current, val)
+        elif key in SERVICE_KEYED_SEQUENCES:
+            result[key] = _merge_keyed(current, val, SERVICE_KEYED_SEQUENCES[key])
+        elif isinstance(val, dict) and isinstance(current, dict):
+            result[key] = merge_mapping(current, val)
+        elif isinstance(val, list) and isinstance(current, list):
+            result[key] = _merge_unique(current, val)
+        else:
+            result[key] = val
+
+    return result
+
+
+def merge_compose(payloads):
+    "Merge a list of compose payloads, last one win"
+
+    result = {}
+    for payload in payloads:
+        for key, val in (payload or {}).items():
+
+            if key == "services":
+                services = result.setdefault("services", {})
+                for name, svc in (val or {}).items():
+                    svc = normalize_service(svc or {})
+                    if name in services:
+                        services[name] = merge_service(services[name], svc)
+                    else:
+                        services[name] = svc
+
+            elif isinstance(val, dict) and isinstance(result.get(key), dict):
+                result[key] = merge_mapping(result[key], val)
+            else:
+                result[key] = val
+
+    return result
+
+
+# =====================================================================
+# Heads extraction
+# =====================================================================
+
+NODE_START = (yaml.MappingStartEvent, yaml.SequenceStartEvent)
+NODE_END = (yaml.MappingEndEvent, yaml.SequenceEndEvent)
+
+
+def _skip_node(events, event):
+    "Consume events until the end of the node started by event"
+
+    if not isinstance(event, NODE_START):
+        return
+    depth = 1
+    while depth:
+        event = next(events)
+        if isinstance(event, NODE_START):
+            depth += 1
+        elif isinstance(event, NODE_END):
+            depth -= 1
+
+
+def _mapping_keys(events):
+    "Return the scalar keys of the current mapping, skip values"
+
+    keys = []
+    while True:
+        event = next(events)
+        if isinstance(event, yaml.MappingEndEvent):
+            return keys
+        if isinstance(event, yaml.ScalarEvent):
+            keys.append(event.value)
+        else:
+            _skip_node(events, event)
+        _skip_node(events, next(events))
+
+
+def compose_heads(path, keys=("services", "networks")) -> dict:
+    """Return the names defined under top level keys of a compose file
+
+    The file is read as a stream of yaml events, values are never
+    built, and reading stops once all keys are found. Missing keys are
+    returned as None.
+    """
+
+    result = {key: None for key in keys}
+    remaining = set(keys)
+
+    with open(path, encoding="utf-8") as _file:
+        events = yaml.parse(_file, Loader=YAML_LOADER)
+
+        # Find root mapping
+        for event in events:
+            if isinstance(event, yaml.MappingStartEvent):
+                break
+        else:
+            return result
+
+        while remaining:
+            event = next(events)
+            if isinstance(event, yaml.MappingEndEvent):
+                break
+
+            key = None
+            if isinstance(event, yaml.ScalarEvent):
+                key = event.value
+            else:
+                _skip_node(events, event)
+
+            event = next(events)
+            if key in remaining and isinstance(event, yaml.MappingStartEvent):
+                result[key] = _mapping_keys(events)
+                remaining.discard(key)
+            else:
+                _skip_node(events, event)
+
+    return result
+
+
+# =====================================================================
+# Config
+# =====================================================================
+
+PROJECT_NAME_REGEX = re.compile(r"[^-_a-z0-9]+")
+
+
+def normalize_project_name(name):
+    "Return a project name as normalized by docker compose"
+
+    return PROJECT_NAME_REGEX.sub("", name.lower()).lstrip("-_")
+
+
+def compose_config(compose_files, env=None, project_name=None):
+    """Return the merged and interpolated content of compose files
+
+    This mimics the output of `docker compose config`: each file is
+    interpolated with env vars and the `.env` of the project directory,
+    then files are merged in order. The project directory is the directory
+    of the first file.
+    """
+
+    assert len(compose_files) > 0, "At least one compose file is required"
+
+    project_dir = os.path.dirname(os.path.abspath(compose_files[0]))
+    env_vars = load_env_file(os.path.join(project_dir, ".env"))
+    env_vars.update(env or {})
+
+    # Load and interpolate each file
+    payloads = []
+    for file in compose_files:
+        log.debug(f"Merging compose file: {file}")
+        payload = load_yaml_file(file) or {}
+        payloads.append(interpolate(payload, env_vars, hint=None))
+
+    result = merge_compose(payloads)
+    result.pop("version", None)
+
+    # Set project name
+    project_name = result.get("name") or project_name or os.path.basename(project_dir)
+    result["name"] = project_name
+
+    # Resolve short syntaxes and relative paths
+    services = result.get("services") or {}
+    for name, svc in services.items():
+        services[name] = resolve_service(svc, project_dir)
+
+    # Attach services without networks to the default network
+    use_default = False
+    for svc in services.values():
+        networks = svc.get("networks")
+        if networks is None and svc.get("network_mode") is None:
+            svc["networks"] = {"default": None}
+            networks = svc["networks"]
+        if networks and "default" in networks:
+            use_default = True
+
+    # Name project networks
+    networks = result.get("networks") or {}
+    if use_default and "default" not in networks:
+        networks["default"] = None
+    for name, net in list(networks.items()):
+        net = dict(net or {})
+        if "name" not in net:
+            net["name"] = name if net.get("external") else f"{project_name}_{name}"
+        networks[name] = net
+    if networks:
+        result["networks"] = networks
+
+    # Name project volumes
+    volumes = result.get("volumes") or {}
+    for name, vol in list(volumes.items()):
+        vol = dict(vol or {})
+        if "name" not in vol:
+            vol["name"] = name if vol.get("external") else f"{project_name}_{name}"
+        volumes[name] = vol
+
+    return escape(result)
@@ -0,0 +1,298 @@
+# -*- coding: utf-8 -*-
+"""Paasify docker api library
+
+This library provides a minimal client for the Docker Engine HTTP API,
+over the docker unix socket. Connections are kept alive and reused
+between requests, so read operations do not need to spawn the docker CLI.
+
+The socket is taken from `DOCKER_HOST` when it is a `unix://` url, and
+defaults to `/var/run/docker.sock`.
+"""
+
+# pylint: disable=logging-fstring-interpolation
+
+import os
+import re
+import json
+import time
+import queue
+import socket
+import struct
+import logging
+import threading
+import http.client
+from datetime import datetime
+from urllib.parse import urlencode, quote
+from pprint import pprint  # noqa: F401
+
+import paasify.errors as error
+
+
+log = logging.getLogger(__name__)
+
+DEFAULT_SOCKET = "/var/run/docker.sock"
+DURATION_REGEX = re.compile(r"(\d+(?:\.\d+)?)(h|m|s)")
+DURATION_UNITS = {"h": 3600, "m": 60, "s": 1}
+
+
+def get_socket_path() -> str:
+    "Return the docker unix socket path"
+
+    host = os.environ.get("DOCKER_HOST", "")
+    if host.startswith("unix://"):
+        return host[len("unix://") :]
+    return DEFAULT_SOCKET
+
+
+def parse_since(value) -> str:
+    """Return the unix timestamp of a `since` value
+
+    Like the docker CLI, timestamps, RFC 3339 dates and durations relative
+    to now, like `1h30m`, are accepted.
+    """
+
+    value = str(value).strip()
+    if re.fullmatch(r"\d+(\.\d+)?", value):
+        return value
+
+    if DURATION_REGEX.sub("", value) == "" and value:
+        seconds = sum(
+            float(num) * DURATION_UNITS[unit]
+            for num, unit in DURATION_REGEX.findall(value)
+        )
+        return str(int(time.time() - seconds))
+
+    try:
+        date = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError as err:
+        raise error.DockerAPIError(f"Invalid logs since value: {value}") from err
+    return str(int(date.timestamp()))
+
+
+def demux_stream(data) -> bytes:
+    """Return the content of a multiplexed stdout/stderr stream
+
+    Each frame starts with a 8 bytes header: stream type, 3 null bytes
+    and the frame size as big endian integer.
+    """
+
+    result = []
+    pos = 0
+    while pos + 8 <= len(data):
+        _, size = struct.unpack(">BxxxL", data[pos : pos + 8])
+        result.append(data[pos + 8 : pos + 8 + size])
+        pos += 8 + size
+    return b"".join(result)
+
+
+def check_status(status, url, body):
+    "Raise DockerAPIError with the api message on error statuses"
+
+    if status >= 400:
+        try:
+            message = json.loads(body).get("message")
+        except ValueError:
+            message = body.decode("utf-8", errors="replace")
+        raise error.DockerAPIError(f"Docker API error {status} on {url}: {message}")
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    "HTTP connection over a unix socket"
+
+    def __init__(self, socket_path, timeout=60):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self.socket_path)
+        self.sock = sock
+
+
+class DockerAPIClient:
+    """Docker Engine API client
+
+    Up to `pool_size` idle connections are kept open, and are shared
+    by all threads.
+    """
+
+    def __init__(self, socket_path=None, timeout=60, pool_size=4):
+        self.socket_path = socket_path or get_socket_path()
+        self.timeout = timeout
+        self._pool = queue.LifoQueue(maxsize=pool_size)
+
+    # Connections
+    # ===========================
+
+    def _acquire(self):
+        "Return an idle connection and true if reused, or a new one"
+
+        try:
+            return self._pool.get_nowait(), True
+        except queue.Empty:
+            return UnixHTTPConnection(self.socket_path, timeout=self.timeout), False
+
+    def _release(self, conn):
+        try:
+            self._pool.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def close(self):
+        "Close idle connections"
+
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                break
+
+    # Requests
+    # ===========================
+
+    def request(self, path, params=None) -> bytes:
+        "Run a GET request and return the response body"
+
+        url = path
+        if params:
+            url = f"{path}?{urlencode(params)}"
+
+        while True:
+            conn, reused = self._acquire()
+            try:
+                conn.request("GET", url)
+                resp = conn.getresponse()
+                body = resp.read()
+            except (OSError, http.client.HTTPException) as err:
+                conn.close()
+                # Idle connections may have been closed by the server
+                if reused:
+                    continue
+                raise error.DockerAPIError(
+                    f"Docker API request failed on {self.socket_path}: {url}: {err}"
+                ) from err
+            break
+
+        if resp.will_close:
+            conn.close()
+        else:
+            self._release(conn)
+
+        check_status(resp.status, url, body)
+        return body
+
+    def stream(self, path, params=None):
+        """Run a GET request and yield the response, once headers are received
+
+        A dedicated connection is used, as the response may never end. It is
+        closed when the generator is exhausted or closed.
+        """
+
+        url = path
+        if params:
+            url = f"{path}?{urlencode(params)}"
+
+        conn = UnixHTTPConnection(self.socket_path, timeout=None)
+        try:
+            try:
+                conn.request("GET", url)
+                resp = conn.getresponse()
+            except (OSError, http.client.HTTPException) as err:
+                raise error.DockerAPIError(
+                    f"Docker API request failed on {self.socket_path}: {url}: {err}"
+                ) from err
+
+            if resp.status >= 400:
+                check_status(resp.status, url, resp.read())
+            yield resp
+        finally:
+            conn.close()
+
+    def get_json(self, path, params=None):
+        "Run a GET request and return the json response"
+        return json.loads(self.request(path, params=params))
+
+    # Endpoints
+    # ===========================
+
+    def version(self) -> dict:
+        "Return docker engine versions"
+        return self.get_json("/version")
+
+    def containers(self, labels=None, all_containers=True) -> list:
+        "Return containers, optionally filtered on labels"
+
+        params = {"all": "1" if all_containers else "0"}
+        if labels:
+            params["filters"] = json.dumps({"label": list(labels)})
+        return self.get_json("/containers/json", params=params)
+
+    def inspect(self, container) -> dict:
+        "Return container details"
+        return self.get_json(f"/containers/{quote(container)}/json")
+
+    def logs(self, container, tail=None, since=None, timestamps=False, tty=False):
+        "Return container logs as bytes, `tty` containers output is not multiplexed"
+
+        params = {"stdout": "1", "stderr": "1"}
+        if tail is not None:
+            params["tail"] = str(tail)
+        if since is not None:
+            params["since"] = str(since)
+        if timestamps:
+            params["timestamps"] = "1"
+
+        data = self.request(f"/containers/{quote(container)}/logs", params=params)
+        if tty:
+            return data
+        return demux_stream(data)
+
+    def logs_stream(self, container, follow=False, tail=None, since=None, tty=False):
+        "Yield container logs lines as they are received"
+
+        params = {"stdout": "1", "stderr": "1"}
+        if follow:
+            params["follow"] = "1"
+        if tail is not None:
+            params["tail"] = str(tail)
+        if since is not None:
+            params["since"] = parse_since(since)
+
+        for resp in self.stream(f"/containers/{quote(container)}/logs", params=params):
+            if tty:
+                for line in resp:
+                    yield line.decode("utf-8", errors="replace").rstrip("\r\n")
+                return
+
+            # Frames of stdout and stderr may interleave, keep a buffer per stream
+            pending = {}
+            while True:
+                header = resp.read(8)
+                if len(header) < 8:
+                    break
+                stream, size = struct.unpack(">BxxxL", header)
+                buffer = pending.get(stream, b"") + resp.read(size)
+                *lines, pending[stream] = buffer.split(b"\n")
+                for line in lines:
+                    yield line.decode("utf-8", errors="replace")
+            for buffer in pending.values():
+                if buffer:
+                    yield buffer.decode("utf-8", errors="replace")
+
+
+# Clients are shared by all engines using the same socket
+_CLIENTS = {}
+_CLIENTS_LOCK = threading.Lock()
+
+
+def get_client(socket_path=None) -> DockerAPIClient:
+    "Return the shared client of a docker socket"
+
+    socket_path = socket_path or get_socket_path()
+    with _CLIENTS_LOCK:
+        client = _CLIENTS.get(socket_path)
+        if client is None:
+            client = DockerAPIClient(socket_path=socket_path)
+            _CLIENTS[socket_path] = client
+    return client
@@ -9,8 +9,12 @@ This class helps to deal with docker engine versions
 
 import os
 import re
+import time
+import shutil
 import logging
+import threading
 import json
+from collections import deque
 
 from distutils.version import StrictVersion
 
@@ -27,7 +31,11 @@ from cafram.utils import _exec
 from cafram.nodes import NodeMap
 
 import paasify.errors as error
-from paasify.common import cast_docker_compose
+from paasify.common import cast_docker_compose, multiplex
+from paasify.compose import compose_config
+from paasify.cache import hash_payload
+from paasify.yaml_io import from_yaml
+from paasify.docker_api import get_client
 from paasify.framework import PaasifyObj
 
 
@@ -48,6 +56,110 @@ def bin2utf8(obj):
     return obj
 
 
+# Containers of compose projects, as json lines
+DOCKER_PS_FORMAT = (
+    '{"ID":{{json .ID}},"Name":{{json .Names}},'
+    '"Project":{{json (.Label "com.docker.compose.project")}},'
+    '"Service":{{json (.Label "com.docker.compose.service")}},'
+    '"State":{{json .State}},"Ports":{{json .Ports}}}'
+)
+# Lines kept in memory when streaming commands output
+STREAM_BUFFER_LINES = 100
+DOCKER_PORT_REGEX = re.compile(
+    r"^(?P<ip>.*):(?P<src>[0-9-]+)->(?P<dst>[0-9-]+)/(?P<prot>\w+)$"
+)
+
+
+def format_port(src_ip, src_port, dst_port, prot):
+    "Return a published port string, all interfaces are shown as `::`"
+
+    if src_ip in ["", "0.0.0.0"]:
+        src_ip = "::"
+    return f"{src_ip}:{src_port}->{dst_port}/{prot}"
+
+
+def parse_compose_ports(publishers) -> list:
+    "Return published ports from `docker compose ps` publishers"
+
+    ports = [
+        format_port(pub["URL"], pub["PublishedPort"], pub["TargetPort"], pub["Protocol"])
+        for pub in publishers or []
+        if pub.get("PublishedPort")
+    ]
+    return sorted(set(ports))
+
+
+def parse_docker_ports(ports) -> list:
+    "Return published ports from `docker ps` ports string"
+
+    result = []
+    for port in (ports or "").split(","):
+        match = DOCKER_PORT_REGEX.match(port.strip())
+        if match:
+            result.append(format_port(*match.group("ip", "src", "dst", "prot")))
+    return sorted(set(result))
+
+
+def container_to_row(container) -> dict:
+    "Return a container process from a docker api container"
+
+    labels = container.get("Labels") or {}
+    ports = [
+        format_port(
+            port.get("IP", ""), port["PublicPort"], port["PrivatePort"], port["Type"]
+        )
+        for port in container.get("Ports") or []
+        if port.get("PublicPort")
+    ]
+    return {
+        "Project": labels.get("com.docker.compose.project", ""),
+        "ID": container["Id"],
+        "Name": (container.get("Names") or [""])[0].lstrip("/"),
+        "Service": labels.get("com.docker.compose.service", ""),
+        "State": container.get("State", ""),
+        "Ports": sorted(set(ports)),
+    }
+
+
+def group_ps_projects(rows, prefix="") -> dict:
+    "Return container processes by project name, for projects starting with prefix"
+
+    projects = {}
+    for row in rows:
+        if row["Project"].startswith(prefix):
+            projects.setdefault(row["Project"], []).append(row)
+    for project_rows in projects.values():
+        project_rows.sort(key=lambda row: row["Name"])
+    return projects
+
+
+def format_ps_row(row) -> str:
+    "Return a container process as a table row"
+
+    return (
+        f"  {row['Project'] :<32} {row['ID'][:12] :<12} {row['Name'] :<40}"
+        f" {row['Service'] :<16} {row['State'] :<10} {', '.join(row['Ports'])}"
+    )
+
+
+def native_config(compose_files, env=None, project_name=None):
+    "Return the merged docker-compose content as dict, without docker"
+
+    env = EngineCompose.get_env_string(env)
+    return compose_config(compose_files, env=env, project_name=project_name)
+
+
+class StreamResult:
+    "Result of a streamed command, only the last output lines are kept"
+
+    exit_code = 0
+
+    def __init__(self, lines):
+        self.lines = list(lines)
+        self.txtout = "\n".join(self.lines)
+        self.txterr = ""
+
+
 #####################
 
 # https://www.docker.com/blog/announcing-compose-v2-general-availability/
@@ -61,6 +173,7 @@ class EngineCompose(NodeMap, PaasifyObj):
     _node_parent_kind = ["PaasifyStack"]
 
     version = None
+    compose_version = None
     docker_file_exists = False
     # docker_file_path = None
     arg_prefix = []
@@ -69,6 +182,7 @@ class EngineCompose(NodeMap, PaasifyObj):
         "stack_name": None,
         "stack_path": None,
         "docker_file": "docker-compose.yml",
+        "compose_merge": "docker",
         # "docker_file_path": None,
     }
 
@@ -130,12 +244,47 @@ class EngineCompose(NodeMap, PaasifyObj):
         "Enable cli logging"
         self.set_logger("paasify.cli.engine")
 
-    def run(self, cli_args=None, command=None, logger=None, **kwargs):
-        "Wrapper to execute commands"
+    def stream(self, cli_args=None, command=None, **kwargs):
+        """Yield output lines of a command, as they are emitted
+
+        Stderr is merged into stdout, and only the last lines are kept in
+        memory. Raise `sh.ErrorReturnCode` at the end if the command failed.
+        """
+
+        command = command or self.compose_bin
+        lines = _exec(
+            command,
+            cli_args=cli_args or [],
+            logger=self.log,
+            _iter=True,
+            _err_to_out=True,
+            _internal_bufsize=STREAM_BUFFER_LINES,
+            **kwargs,
+        )
+        for line in lines:
+            yield line.rstrip("\n")
+
+    def run(self, cli_args=None, command=None, logger=None, stream=False, **kwargs):
+        """Wrapper to execute commands
+
+        In stream mode, output lines are sent to the logger as soon as they
+        are emitted, and the result only holds the last lines. Otherwise, the
+        whole output is captured. Foreground commands are never streamed, as
+        they already write to the terminal.
+        """
 
         command = command or self.compose_bin
         cli_args = cli_args or []
 
+        if stream and not kwargs.get("_fg"):
+            kwargs.pop("_fg", None)
+            logger = logger or self.log
+            tail = deque(maxlen=STREAM_BUFFER_LINES)
+            for line in self.stream(cli_args=cli_args, command=command, **kwargs):
+                logger.notice(line)
+                tail.append(line)
+            return StreamResult(tail)
+
         # print ("RUN WRAPPER:", command, cli_args, self.log, kwargs)
         result = _exec(command, cli_args=cli_args, logger=self.log, **kwargs)
         # bin2utf8(result)
@@ -161,6 +310,36 @@ class EngineCompose(NodeMap, PaasifyObj):
             self.log.warning("Please build stack first")
             raise error.BuildStackFirstError("Docker file is not built yet !")
 
+
+    @staticmethod
+    def get_env_string(env):
+        "Return env vars as compose strings, unset vars are removed"
+
+        env = env or {}
+        return {k: cast_docker_compose(v) for k, v in env.items() if v is not None}
+
+    def config(self, compose_files, env=None):
+        """Return the merged docker-compose content as dict
+
+        Use `docker compose config`, or the native merge engine when
+        `compose_merge` is set to `native`.
+        """
+
+        if self.compose_merge == "native":
+            self.require_stack()
+            return native_config(compose_files, env=env, project_name=self.stack_name)
+
+        out = self.assemble(compose_files, env=env)
+        return from_yaml(out.stdout)
+
+    def get_compose_version(self):
+        "Return the installed docker compose version"
+
+        cls = type(self)
+        if cls.compose_version is None:
+            cls.compose_version = EngineDetect().get_docker_compose_version()
+        return cls.compose_version
+
     def assemble(self, compose_files, env_file=None, env=None):
         "Generate docker-compose file"
 
@@ -180,10 +359,7 @@ class EngineCompose(NodeMap, PaasifyObj):
             ]
         )
 
-        env_string = env or {}
-        env_string = {
-            k: cast_docker_compose(v) for k, v in env.items() if v is not None
-        }
+        env_string = self.get_env_string(env)
 
         out = self.run(cli_args=cli_args, _out=None, _env=env_string)
         return out
@@ -197,7 +373,7 @@ class EngineCompose(NodeMap, PaasifyObj):
             "up",
             "--detach",
         ]
-        out = self.run(cli_args=cli_args, **kwargs)
+        out = self.run(cli_args=cli_args, stream=True, **kwargs)
         return out
 
     def down(self, **kwargs):
@@ -212,8 +388,9 @@ class EngineCompose(NodeMap, PaasifyObj):
             "--remove-orphans",
         ]
 
+        out = None
         try:
-            out = self.run(cli_args=cli_args, **kwargs)
+            out = self.run(cli_args=cli_args, stream=True, **kwargs)
             # out = _exec("docker-compose", cli_args, **kwargs)
             # if out:
             #    bin2utf8(out)
@@ -223,32 +400,37 @@ class EngineCompose(NodeMap, PaasifyObj):
         except sh.ErrorReturnCode_1 as err:
             bin2utf8(err)
 
-            # This is U.G.L.Y
-            if "has active endpoints" not in err.txterr:
-                raise error.DockerCommandFailed(f"{err.txterr}")
+            # This is U.G.L.Y, streamed commands report errors on stdout
+            if "has active endpoints" not in f"{err.txterr}\n{err.txtout}":
+                raise error.DockerCommandFailed(f"{err.txterr or err.txtout}")
 
         return out
 
     def logs(self, follow=False):
-        "Return container logs"
+        "Show container logs, as they are emitted"
+
+        for line in self.logs_stream(follow=follow):
+            print(line, flush=True)
+
+    def logs_stream(self, follow=False, since=None, tail=None):
+        """Yield container logs lines as they are emitted
+
+        Lines are prefixed by container names, like `docker compose logs`.
+        """
 
         self.require_stack()
-        sh_options = {}
-        cli_args = self.arg_prefix + [
-            # "--project-name",
-            # self.stack_name,
-            "logs",
-        ]
+        cli_args = self.arg_prefix + ["logs", "--no-color"]
         if follow:
-            cli_args.append("-f")
-            sh_options["_fg"] = True
+            cli_args.append("--follow")
+        if since:
+            cli_args.extend(["--since", str(since)])
+        if tail is not None:
+            cli_args.extend(["--tail", str(tail)])
 
-        out = self.run(cli_args=cli_args, **sh_options)
-        print(out)
+        yield from self.stream(cli_args=cli_args)
 
-    # pylint: disable=invalid-name
-    def ps(self):
-        "Return container processes"
+    def get_ps(self) -> list:
+        "Return container processes of the stack"
 
         self.require_stack()
 
@@ -265,35 +447,51 @@ class EngineCompose(NodeMap, PaasifyObj):
         result = self.run(cli_args=cli_args, _out=None)
 
         # Report output from json
-        stdout = result.txtout
-        payload = json.loads(stdout)
-        for svc in payload:
-
-            # Get and filter interesting ports
-            published = svc["Publishers"] or []
-            published = [x for x in published if x.get("PublishedPort") > 0]
-
-            # Reduce duplicates
-            for pub in published:
-                if pub.get("URL") == "0.0.0.0":
-                    pub["URL"] = "::"
-
-            # Format port strings
-            exposed = []
-            for port in published:
-                src_ip = port["URL"]
-                src_port = port["PublishedPort"]
-                dst_port = port["TargetPort"]
-                prot = port["Protocol"]
-
-                r = f"{src_ip}:{src_port}->{dst_port}/{prot}"
-                exposed.append(r)
-
-            # Remove duplicates ports and show
-            exposed = list(set(exposed))
-            print(
-                f"  {svc['Project'] :<32} {svc['ID'][:12] :<12} {svc['Name'] :<40} {svc['Service'] :<16} {svc['State'] :<10} {', '.join(exposed)}"
-            )
+        payload = json.loads(result.txtout)
+        rows = [
+            {
+                "Project": svc["Project"],
+                "ID": svc["ID"],
+                "Name": svc["Name"],
+                "Service": svc["Service"],
+                "State": svc["State"],
+                "Ports": parse_compose_ports(svc["Publishers"]),
+            }
+            for svc in payload
+        ]
+        return sorted(rows, key=lambda row: row["Name"])
+
+    def get_ps_projects(self, prefix="") -> dict:
+        """Return container processes of compose projects, by project name
+
+        All projects starting with `prefix` are fetched with a single
+        `docker ps` query.
+        """
+
+        cli_args = [
+            "ps",
+            "--all",
+            "--filter",
+            "label=com.docker.compose.project",
+            "--format",
+            DOCKER_PS_FORMAT,
+        ]
+        result = self.run(command="docker", cli_args=cli_args, _out=None)
+
+        rows = []
+        for line in result.txtout.splitlines():
+            if line.strip():
+                svc = json.loads(line)
+                svc["Ports"] = parse_docker_ports(svc["Ports"])
+                rows.append(svc)
+        return group_ps_projects(rows, prefix=prefix)
+
+    # pylint: disable=invalid-name
+    def ps(self):
+        "Show container processes"
+
+        for row in self.get_ps():
+            print(format_ps_row(row))
 
 
 class EngineComposeV2(EngineCompose):
@@ -327,8 +525,122 @@ class EngineCompose_16(EngineCompose):
     ident = "docker-compose-1.6"
 
 
+class EngineDockerAPI(EngineComposeV2):
+    """Docker-engine: Read operations through the Docker Engine API
+
+    Processes, logs and containers details are queried over the docker
+    socket with pooled connections. Compose write operations still use the
+    docker compose CLI.
+    """
+
+    ident = "docker-api"
+
+    def get_ps(self) -> list:
+        "Return container processes of the stack"
+
+        self.require_stack()
+        containers = get_client().containers(
+            labels=[f"com.docker.compose.project={self.stack_name}"]
+        )
+        rows = [container_to_row(container) for container in containers]
+        return sorted(rows, key=lambda row: row["Name"])
+
+    def get_ps_projects(self, prefix="") -> dict:
+        "Return container processes of compose projects, by project name"
+
+        containers = get_client().containers(labels=["com.docker.compose.project"])
+        rows = [container_to_row(container) for container in containers]
+        return group_ps_projects(rows, prefix=prefix)
+
+    def inspect(self) -> list:
+        "Return details of stack containers"
+
+        client = get_client()
+        return [client.inspect(row["ID"]) for row in self.get_ps()]
+
+    def logs_stream(self, follow=False, since=None, tail=None):
+        """Yield container logs lines as they are emitted
+
+        Logs of each container are streamed on their own connection, lines
+        are prefixed by container names, like `docker compose logs`.
+        """
+
+        client = get_client()
+        streams = {}
+        for info in self.inspect():
+            name = info["Name"].lstrip("/")
+            tty = (info.get("Config") or {}).get("Tty", False)
+            streams[name] = client.logs_stream(
+                info["Id"], follow=follow, tail=tail, since=since, tty=tty
+            )
+
+        for name, line in multiplex(streams):
+            if isinstance(line, Exception):
+                raise line
+            yield f"{name}  | {line}"
+
+
+class EngineProxy:
+    """Lazy docker-engine instance
+
+    The docker engine is only detected, and the real engine created, when
+    one of its attributes is first accessed. Until then, the engine payload
+    is available and can be updated without running any docker command.
+    The native compose merge never needs docker, so it does not create the
+    real engine either.
+    """
+
+    def __init__(self, factory, payload):
+        self.__dict__["_factory"] = factory
+        self.__dict__["_payload"] = dict(payload)
+        self.__dict__["_engine"] = None
+        self.__dict__["_lock"] = threading.Lock()
+
+    @property
+    def resolved(self):
+        "Return true if the real engine has been created"
+        return self._engine is not None
+
+    def resolve(self):
+        "Return the real engine, create it if needed"
+
+        with self._lock:
+            if self._engine is None:
+                self.__dict__["_engine"] = self._factory(self._payload)
+        return self._engine
+
+    @property
+    def native(self):
+        "Return true if compose files are merged without docker"
+        return self.compose_merge == "native"
+
+    def config(self, compose_files, env=None):
+        "Return the merged docker-compose content as dict"
+
+        if self.native:
+            return native_config(compose_files, env=env, project_name=self.stack_name)
+        return self.resolve().config(compose_files, env=env)
+
+    def __getattr__(self, name):
+        if self._engine is None and name in self._payload:
+            return self._payload[name]
+        return getattr(self.resolve(), name)
+
+    def __setattr__(self, name, value):
+        if self._engine is None and name in self._payload:
+            self._payload[name] = value
+        else:
+            setattr(self.resolve(), name, value)
+
+
 class EngineDetect:
-    "Class helper to retrieve the appropriate docker-engine class"
+    """Class helper to retrieve the appropriate docker-engine class
+
+    Detection result can be cached in `cache_file`. The cache is keyed on
+    the resolved path, mtime and inode of docker binaries, so any docker
+    upgrade invalidates it. Entries older than `ttl` seconds are ignored,
+    and `refresh` forces a new detection.
+    """
 
     versions = {
         "docker": {
@@ -341,11 +653,82 @@ class EngineDetect:
             # "1.29.0": EngineCompose_129,
             # "1.6.3": EngineCompose_16,
         },
+        "docker-api": {
+            "1.41": EngineDockerAPI,
+        },
         "podman-compose": {},
     }
 
-    def detect_docker_compose(self):
-        "Detect current version of docker compose. Return a docker-engine class."
+    binaries = ["docker", "docker-compose"]
+
+    def __init__(self, cache_file=None, ttl=86400, refresh=False):
+        self.cache_file = cache_file
+        self.ttl = ttl
+        self.refresh = refresh
+
+    # Cache management
+    # ===========================
+
+    def get_cache_key(self):
+        "Return a key identifying installed docker binaries"
+
+        payload = []
+        for name in self.binaries:
+            path = shutil.which(name)
+            if path:
+                path = os.path.realpath(path)
+                stat = os.stat(path)
+                payload.append([name, path, stat.st_mtime_ns, stat.st_ino])
+            else:
+                payload.append([name, None])
+        return hash_payload(payload)
+
+    def load_cache(self, key):
+        "Return cached version match and version, or None if absent or expired"
+
+        if not self.cache_file or self.refresh:
+            return None
+
+        try:
+            with open(self.cache_file, encoding="utf-8") as _file:
+                payload = json.load(_file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+        if not isinstance(payload, dict) or payload.get("key") != key:
+            return None
+        if time.time() - payload.get("time", 0) > self.ttl:
+            return None
+
+        match = payload.get("match")
+        if match not in self.versions["docker-compose"]:
+            return None
+        return match, payload.get("version")
+
+    def save_cache(self, key, match, version):
+        "Save version match in cache"
+
+        if not self.cache_file:
+            return
+
+        payload = {
+            "key": key,
+            "time": time.time(),
+            "match": match,
+            "version": version,
+        }
+        try:
+            os.makedirs(os.path.dirname(self.cache_file), exist_ok=True)
+            with open(self.cache_file, "w", encoding="utf-8") as _file:
+                json.dump(payload, _file, indent=2)
+        except OSError as err:
+            log.debug(f"Can't write engine cache: {err}")
+
+    # Detection
+    # ===========================
+
+    def get_docker_compose_version(self):
+        "Return current version string of docker compose"
 
         # pylint: disable=no-member
 
@@ -386,7 +769,10 @@ class EngineDetect:
         else:
             msg = f"Output format of docker-compose is not recognised: {out.txtout}"
             raise error.DockerUnsupportedVersion(msg)
-        curr_ver = version["version"]
+        return version["version"]
+
+    def match_docker_compose(self, curr_ver):
+        "Return the best supported version key for a docker compose version"
 
         # Scan available versions
         versions = list(self.versions["docker-compose"].keys())
@@ -403,19 +789,60 @@ class EngineDetect:
             raise error.DockerUnsupportedVersion(
                 f"Version of docker-compose is not supported: {curr_ver}"
             )
+        return match
+
+    def detect_docker_compose(self):
+        "Detect current version of docker compose. Return a docker-engine class."
+
+        key = self.get_cache_key()
+        cached = self.load_cache(key)
+        if cached:
+            log.debug(f"Docker engine detection from cache: {self.cache_file}")
+            match, curr_ver = cached
+        else:
+            curr_ver = self.get_docker_compose_version()
+            match = self.match_docker_compose(curr_ver)
+            self.save_cache(key, match, curr_ver)
 
         cls = self.versions["docker-compose"][match]
         cls.version = match
+        cls.compose_version = curr_ver
         cls.name = "docker-compose"
         cls.ident = match
         return cls
 
+    def detect_docker_api(self):
+        "Check docker engine api version. Return a docker-engine class."
+
+        api_version = get_client().version().get("ApiVersion", "0")
+        curr = tuple(int(x) for x in api_version.split("."))
+
+        versions = list(self.versions["docker-api"].keys())
+        versions.sort(key=lambda x: tuple(int(y) for y in x.split(".")), reverse=True)
+        match = None
+        for version in versions:
+            if curr >= tuple(int(x) for x in version.split(".")):
+                match = version
+                break
+
+        if not match:
+            raise error.DockerUnsupportedVersion(
+                f"Version of docker engine api is not supported: {api_version}"
+            )
+
+        cls = self.versions["docker-api"][match]
+        cls.version = match
+        cls.name = "docker-api"
+        return cls
+
     def detect(self, engine=None):
         "Return the Engine class that match engine string"
 
         if not engine:
             log.info("Guessing best docker engine ...")
             obj = self.detect_docker_compose()
+        elif engine == "docker-api":
+            obj = self.detect_docker_api()
         else:
 
             if engine not in self.versions["docker-compose"]:
@@ -130,3 +130,33 @@ class InvalidSourceConfig(PaasifyError):
     """Raised when a source is not configured properly"""
 
     rc = 46
+
+
+class StackAssembleFailed(PaasifyError):
+    """Raised when one or more stacks failed to assemble"""
+
+    rc = 47
+
+
+class VarCircularReference(PaasifyError):
+    """Raised when variables reference each others in a loop"""
+
+    rc = 48
+
+
+class StackCircularDependency(PaasifyError):
+    """Raised when stacks depend on each others in a loop"""
+
+    rc = 49
+
+
+class StackCommandFailed(PaasifyError):
+    """Raised when one or more stacks failed to start or stop"""
+
+    rc = 50
+
+
+class DockerAPIError(PaasifyError):
+    """Raised when the docker engine API can't be reached or returns an error"""
+
+    rc = 51
@@ -6,6 +6,8 @@
 
 import os
 import logging
+import threading
+from contextlib import contextmanager
 
 
 from pprint import pprint  # noqa: F401
@@ -15,6 +17,7 @@ from cafram.nodes import NodeList, NodeMap, NodeDict
 from cafram.base import MixInLog, Base
 
 from cafram.utils import (
+    addLoggingLevel,
     # to_domain,
     # to_yaml,
     merge_dicts,
@@ -36,6 +39,11 @@ import paasify.errors as error
 
 _log = logging.getLogger()
 
+# Add logging levels for the whole apps
+addLoggingLevel("NOTICE", logging.INFO + 5)
+addLoggingLevel("EXEC", logging.DEBUG + 5)
+addLoggingLevel("TRACE", logging.DEBUG - 5)
+
 
 class PaasifyObj(Base, MixInLog):
     "Default Paasify base object"
@@ -59,6 +67,72 @@ class PaasifyObj(Base, MixInLog):
         #     print (self.get_parents())
 
 
+class LogBuffer(logging.Filter):
+    """
+    Capture log records emitted from worker threads to replay them later.
+
+    When used as a context manager, the buffer is installed as a filter on
+    all existing log handlers. Records emitted from a thread which entered
+    `capture()` are held back instead of being displayed, so the caller
+    can replay them in a deterministic order with `replay()`.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._local = threading.local()
+        self._handlers = []
+
+    def __enter__(self):
+
+        loggers = [logging.getLogger()] + [
+            logger
+            for logger in logging.Logger.manager.loggerDict.values()
+            if isinstance(logger, logging.Logger)
+        ]
+        for logger in loggers:
+            for handler in logger.handlers:
+                if handler not in self._handlers:
+                    handler.addFilter(self)
+                    self._handlers.append(handler)
+        return self
+
+    def __exit__(self, *exc):
+
+        for handler in self._handlers:
+            handler.removeFilter(self)
+        self._handlers = []
+
+    def filter(self, record):
+        "Hold back records emitted by capturing threads"
+
+        buffer = getattr(self._local, "buffer", None)
+        if buffer is None:
+            return True
+
+        # The same record is filtered once per handler
+        if not buffer or buffer[-1] is not record:
+            buffer.append(record)
+        return False
+
+    @contextmanager
+    def capture(self):
+        "Capture records of the current thread, yield the buffer list"
+
+        buffer = []
+        self._local.buffer = buffer
+        try:
+            yield buffer
+        finally:
+            self._local.buffer = None
+
+    @staticmethod
+    def replay(records):
+        "Send back captured records to their loggers"
+
+        for record in records:
+            logging.getLogger(record.name).handle(record)
+
+
 class PaasifySimpleDict(NodeMap, PaasifyObj):
     "Simple Paaisfy Configuration Dict"
 
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+"""Paasify entrypoint
+
+This module must stay light: `paasify --version` is answered before
+any other module is imported. Other commands are forwarded to the
+full CLI in `paasify.cli`.
+"""
+
+import sys
+
+
+def app():
+    "Run paasify command line"
+
+    if sys.argv[1:] == ["--version"]:
+        # pylint: disable=import-outside-toplevel
+        from paasify.version import __version__
+
+        print(__version__)
+        return
+
+    # pylint: disable=import-outside-toplevel
+    from paasify.cli import app as cli
+
+    cli()
+
+
+if __name__ == "__main__":
+    app()
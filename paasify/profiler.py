@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+"""Paasify profiler library
+
+This library provides lightweight timing spans around build phases. The
+profiler is disabled by default and spans then only cost an attribute
+check. When enabled, spans are aggregated per phase, per stack and per
+tag, and can be exported as Chrome trace-event JSON, which can be
+opened in `chrome://tracing` or Perfetto.
+
+Stack and tag of a span are inherited by its children spans, in the same
+thread.
+"""
+
+import os
+import json
+import time
+import threading
+import functools
+from contextlib import contextmanager
+from pprint import pprint  # noqa: F401
+
+
+class Profiler:
+    "Collect timing spans of build phases"
+
+    def __init__(self):
+        self.enabled = False
+        self.events = []
+        self._origin = time.perf_counter()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def enable(self):
+        "Start recording spans, previous records are dropped"
+
+        with self._lock:
+            self.events = []
+        self._origin = time.perf_counter()
+        self.enabled = True
+
+    def disable(self):
+        "Stop recording spans"
+        self.enabled = False
+
+    @contextmanager
+    def span(self, name, stack=None, tag=None, **args):
+        "Measure the duration of a block of code"
+
+        if not self.enabled:
+            yield
+            return
+
+        parent = getattr(self._local, "ctx", None) or {}
+        ctx = {
+            "stack": stack or parent.get("stack"),
+            "tag": tag or parent.get("tag"),
+        }
+        self._local.ctx = ctx
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start
+            self._local.ctx = parent
+            event = {
+                "name": name,
+                "stack": ctx["stack"],
+                "tag": ctx["tag"],
+                "start": start - self._origin,
+                "duration": duration,
+                "tid": threading.get_ident(),
+                "root_stack": ctx["stack"] != parent.get("stack"),
+                "root_tag": ctx["tag"] != parent.get("tag"),
+                "args": args,
+            }
+            with self._lock:
+                self.events.append(event)
+
+    def method(self, name):
+        "Decorator to measure a method, stack is taken from `self.stack_name`"
+
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(obj, *args, **kwargs):
+                if not self.enabled:
+                    return func(obj, *args, **kwargs)
+                with self.span(name, stack=getattr(obj, "stack_name", None)):
+                    return func(obj, *args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    # Reports
+    # ===========================
+
+    def summary(self, group="name") -> list:
+        """Return aggregated spans, sorted by total time
+
+        Group can be `name`, `stack` or `tag`. Stacks and tags only account
+        their outermost spans, so nested phases are not counted twice.
+        """
+
+        rows = {}
+        for event in self.events:
+            key = event[group]
+            if key is None:
+                continue
+            if group != "name" and not event[f"root_{group}"]:
+                continue
+
+            row = rows.setdefault(
+                key, {group: key, "count": 0, "total": 0.0, "max": 0.0}
+            )
+            row["count"] += 1
+            row["total"] += event["duration"]
+            row["max"] = max(row["max"], event["duration"])
+
+        return sorted(rows.values(), key=lambda row: row["total"], reverse=True)
+
+    def format_summary(self) -> str:
+        "Return a printable summary table"
+
+        lines = []
+        for group, title in [("name", "Phase"), ("stack", "Stack"), ("tag", "Tag")]:
+            rows = self.summary(group=group)
+            if not rows:
+                continue
+            lines.append(
+                f"  {title :<32} {'Count' :>7} {'Total (s)' :>10} {'Mean (ms)' :>10} {'Max (ms)' :>10}"
+            )
+            for row in rows:
+                mean = row["total"] / row["count"] * 1000
+                lines.append(
+                    f"  {str(row[group]) :<32} {row['count'] :>7} {row['total'] :>10.3f}"
+                    f" {mean :>10.2f} {row['max'] * 1000 :>10.2f}"
+                )
+            lines.append("")
+        return "\n".join(lines)
+
+    def to_chrome_trace(self) -> dict:
+        "Return spans in Chrome trace-event format"
+
+        pid = os.getpid()
+        events = []
+        for event in self.events:
+            args = dict(event["args"])
+            args.update({"stack": event["stack"], "tag": event["tag"]})
+            events.append(
+                {
+                    "name": event["name"],
+                    "cat": "paasify",
+                    "ph": "X",
+                    "ts": round(event["start"] * 1e6, 3),
+                    "dur": round(event["duration"] * 1e6, 3),
+                    "pid": pid,
+                    "tid": event["tid"],
+                    "args": args,
+                }
+            )
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def write_chrome_trace(self, path):
+        "Write spans as Chrome trace-event JSON file"
+
+        with open(path, "w", encoding="utf-8") as _file:
+            json.dump(self.to_chrome_trace(), _file)
+
+
+# Shared instance for the whole app
+profiler = Profiler()
@@ -23,20 +23,28 @@ prj.dump()
 
 
 import os
+import threading
 
 from pprint import pprint  # noqa: F401
-import anyconfig
 
 from cafram.nodes import NodeMap
 
 import paasify.errors as error
 from paasify.engines import EngineDetect
+from paasify.cache import JsonnetCache, ParsedFileCache
+from paasify.yaml_io import load_yaml_file
+from paasify.workers import JsonnetWorkerPool
 from paasify.sources import SourcesManager
 from paasify.framework import (
     PaasifyObj,
     PaasifyConfigVars,
 )
-from paasify.common import list_parent_dirs, find_file_up, get_paasify_pkg_dir
+from paasify.common import (
+    list_parent_dirs,
+    find_file_up,
+    get_paasify_pkg_dir,
+    DirIndex,
+)
 
 from paasify.stacks2 import PaasifyStackTagManager, PaasifyStackManager
 
@@ -49,6 +57,7 @@ class PaasifyProjectConfig(NodeMap, PaasifyObj):
 
     conf_default = {
         "namespace": None,
+        "compose_merge": "docker",
         "vars": {},
         "tags": [],
         "tags_suffix": [],
@@ -117,6 +126,18 @@ class PaasifyProjectConfig(NodeMap, PaasifyObj):
                             },
                         ],
                     },
+                    "compose_merge": {
+                        "title": "Compose merge engine",
+                        "description": (
+                            "Engine used to merge and interpolate docker-compose files."
+                            " `docker` use `docker compose config`, while `native` use"
+                            " a built-in engine which does not require docker and is"
+                            " much faster, but only support a subset of compose features."
+                        ),
+                        "type": "string",
+                        "enum": ["docker", "native"],
+                        "default": "docker",
+                    },
                     "vars": PaasifyConfigVars.conf_schema,
                     "tags": PaasifyStackTagManager.conf_schema,
                     "tags_suffix": PaasifyStackTagManager.conf_schema,
@@ -177,6 +198,33 @@ class PaasifyProjectRuntime(NodeMap, PaasifyObj):
                     {"type": "null"},
                 ],
             },
+            "jsonnet_cache": {
+                "title": "Persistent jsonnet cache",
+                "description": "Keep jsonnet evaluation results on disk between runs",
+                "type": "boolean",
+            },
+            "jsonnet_workers": {
+                "title": "Jsonnet worker processes",
+                "description": "Number of processes to evaluate jsonnet plugins, 0 to evaluate in-process",
+                "type": "integer",
+                "minimum": 0,
+            },
+            "jsonnet_timeout": {
+                "title": "Jsonnet evaluation timeout",
+                "description": "Maximum time in seconds for a jsonnet evaluation in workers",
+                "type": "integer",
+            },
+            "engine_cache_ttl": {
+                "title": "Engine detection cache TTL",
+                "description": "Time in seconds to reuse the detected docker engine, 0 to disable cache",
+                "type": "integer",
+                "minimum": 0,
+            },
+            "refresh_engine": {
+                "title": "Refresh engine detection",
+                "description": "Ignore cached docker engine and detect it again",
+                "type": "boolean",
+            },
             "engine": {
                 "title": "Docker backend engine",
                 "oneOf": [
@@ -215,6 +263,11 @@ class PaasifyProjectRuntime(NodeMap, PaasifyObj):
         # "working_dir": ".",
         "working_dir": None,
         "engine": None,
+        "engine_cache_ttl": 86400,
+        "refresh_engine": False,
+        "jsonnet_cache": False,
+        "jsonnet_workers": 0,
+        "jsonnet_timeout": 120,
         "filenames": ["paasify.yml", "paasify.yaml"],
         "relative": None,
     }
@@ -250,6 +303,7 @@ class PaasifyProjectRuntime(NodeMap, PaasifyObj):
         private_dir = os.path.join(root_path, ".paasify")
         collection_dir = os.path.join(private_dir, "collections")
         jsonnet_dir = os.path.join(private_dir, "plugins")
+        cache_dir = os.path.join(private_dir, "cache")
 
         _payload2 = {
             "paasify_source_dir": paasify_source_dir,
@@ -257,6 +311,7 @@ class PaasifyProjectRuntime(NodeMap, PaasifyObj):
             "project_private_dir": private_dir,
             "project_collection_dir": collection_dir,
             "project_jsonnet_dir": jsonnet_dir,
+            "project_cache_dir": cache_dir,
         }
         result.update(_payload2)
 
@@ -455,6 +510,10 @@ class PaasifyProject(NodeMap, PaasifyObj):
     ident = "PaasifyProject"
     engine_cls = None
     runtime = None
+    jsonnet_cache = None
+    jsonnet_pool = None
+    dir_index = None
+    file_cache = None
 
     def node_hook_transform(self, payload):
         "Init configuration Project"
@@ -468,12 +527,58 @@ class PaasifyProject(NodeMap, PaasifyObj):
         # Inject payload
         if self.runtime.load_file is not False:
             self.log.debug(f"Load file: {self.runtime.config_file_path}")
-            _payload = anyconfig.load(self.runtime.config_file_path)
+            _payload = load_yaml_file(self.runtime.config_file_path) or {}
             payload.update(_payload)
 
-        # Create engine
-        if not self.engine_cls:
-            engine_name = self.runtime.engine or None
-            self.engine_cls = EngineDetect().detect(engine=engine_name)
+        # Create directory index and parsed files cache, shared by all stacks
+        self.dir_index = DirIndex()
+        self.file_cache = ParsedFileCache(parent=self, ident="ParsedFileCache")
+
+        # Create jsonnet cache, shared by all stacks
+        cache_dir = None
+        if self.runtime.jsonnet_cache:
+            cache_dir = self.runtime.project_cache_dir
+        self.jsonnet_cache = JsonnetCache(
+            parent=self, ident="JsonnetCache", cache_dir=cache_dir
+        )
+        self.jsonnet_cache.prune()
+
+        # Create jsonnet workers pool, if enabled
+        if self.runtime.jsonnet_workers:
+            self.jsonnet_pool = JsonnetWorkerPool(
+                parent=self,
+                ident="JsonnetWorkerPool",
+                workers=self.runtime.jsonnet_workers,
+                timeout=self.runtime.jsonnet_timeout,
+            )
+
+        # Engine is detected on first use, see get_engine_cls()
+        self._engine_lock = threading.Lock()
 
         return payload
+
+    def shutdown(self):
+        "Release project resources, like jsonnet workers"
+
+        if self.jsonnet_pool:
+            self.jsonnet_pool.shutdown()
+
+    def get_engine_cls(self):
+        "Return the docker engine class, detect it on first call"
+
+        with self._engine_lock:
+            if not self.engine_cls:
+                engine_name = self.runtime.engine or None
+                cache_file = None
+                if self.runtime.engine_cache_ttl:
+                    cache_file = os.path.join(
+                        self.runtime.project_cache_dir, "engine.json"
+                    )
+                detector = EngineDetect(
+                    cache_file=cache_file,
+                    ttl=self.runtime.engine_cache_ttl,
+                    refresh=self.runtime.refresh_engine,
+                )
+                self.engine_cls = detector.detect(engine=engine_name)
+
+        return self.engine_cls
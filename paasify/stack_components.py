@@ -10,16 +10,18 @@ from pprint import pprint  # noqa: F401
 import re
 
 import json
+from collections import ChainMap
 import _jsonnet
-import anyconfig
 
 from cafram.nodes import NodeList, NodeMap
 from cafram.utils import flatten, first
 
-from paasify.common import lookup_candidates, StringTemplate
+from paasify.common import lookup_candidates, compile_template
 from paasify.framework import PaasifyObj, PaasifyConfigVar
 import paasify.errors as error
 from paasify.engines import bin2utf8
+from paasify.profiler import profiler
+from paasify.yaml_io import load_yaml_file
 
 
 # =======================================================================================
@@ -27,10 +29,32 @@ from paasify.engines import bin2utf8
 # =======================================================================================
 
 
+class VarEntry:
+    """
+    Lightweight variable, with the same `name` and `value` interface as
+    PaasifyConfigVar. Nodes are only created on demand with `to_node`.
+    """
+
+    __slots__ = ("name", "value")
+
+    def __init__(self, name, value):
+        self.name = name
+        self.value = value
+
+    def __repr__(self):
+        return f"{self.name}={self.value}"
+
+    def to_node(self, parent=None):
+        "Return the variable as PaasifyConfigVar node"
+        return PaasifyConfigVar(
+            parent=parent, ident="PaasifyStackVar", payload={self.name: self.value}
+        )
+
+
 class VarsManager(PaasifyObj):
     """
-    This class manage a list of variables (PaasifyConfigVar), but it keep
-    the adding order.
+    This class manage a list of variables (VarEntry), but it keep
+    the adding order. Last defined var win when rendered.
 
     Args:
         PaasifyObj (_type_): _description_
@@ -55,59 +79,69 @@ class VarsManager(PaasifyObj):
 
     def add_as_key(self, key, value):
         "Add a list of vars into object"
-        obj = PaasifyConfigVar(
-            parent=None, ident="PaasifyStackVar", payload={key: value}
-        )
-        self._vars.append(obj)
+        self._vars.append(VarEntry(key, value))
 
     def add_as_list(self, vars_):
         "Add a list of vars into object"
         assert isinstance(vars_, list)
-        self._vars.extend(vars_)
+        self._vars.extend(VarEntry(var.name, var.value) for var in vars_)
 
     def add_as_dict(self, vars_):
         "Add a list of vars into object"
         assert isinstance(vars_, dict)
+        self._vars.extend(VarEntry(key, value) for key, value in vars_.items())
 
-        for var_name, var_value in vars_.items():
-            self.add_as_key(var_name, var_value)
+    def get_vars_list(self):
+        "Return vars as PaasifyConfigVar nodes, in adding order"
+        return [var.to_node() for var in self._vars]
+
+    def get_entries(self):
+        "Return vars entries, in adding order"
+        return list(self._vars)
 
     def resolve_dyn_vars(self, tpl, env, hint=None):
-        "Resolver environment and secret vars"
+        """Resolver environment and secret vars
+
+        Return env unchanged if the template does not use dynamic vars,
+        or an overlay of resolved dynamic vars over env.
+        """
 
-        env = dict(env)
-        var_list = tpl.get_identifiers()
+        _, var_list = compile_template(tpl.template)
         line = tpl.template
 
+        dyn_vars = {}
         for var in var_list:
             if var.startswith("_env_"):
                 name = var[5:]
                 value = os.environ.get(name)
                 msg = f"Fetching environment value for: {hint}: {line} ({name}={value})"
                 self.log.info(msg)
-                env[var] = value
+                dyn_vars[var] = value
             elif var.startswith("_secret_"):
                 msg = f"Support for secrets is not implemented yet: {hint}: {line}"
                 self.log.warning(msg)
-                env[var] = var
+                dyn_vars[var] = var
                 # raise NotImplementedError(msg)
 
-        return env
+        if not dyn_vars:
+            return env
+        return ChainMap(dyn_vars, env)
 
     def template_value(self, value, env, hint=None):
         "Render a string with template engine"
 
-        if not isinstance(value, str):
+        # Strings without placeholders or escapes are left as is
+        if not isinstance(value, str) or "$" not in value:
             return value
 
         # Resolve dynamic vars
-        tpl = StringTemplate(value)
+        tpl, _ = compile_template(value)
         env = self.resolve_dyn_vars(tpl, env, hint=hint)
 
         # pylint: disable=broad-except
         try:
             old_value = value
-            value = tpl.substitute(**env)
+            value = tpl.substitute(env)
             if old_value != value:
                 self.log.debug(
                     f"Transformed template value: {old_value} => {value}")
@@ -124,7 +158,12 @@ class VarsManager(PaasifyObj):
         return value
 
     def render_as_dict(self, parse=False):
-        "Return a dict of the variable, last defined var win"
+        """Return a dict of the variable, last defined var win
+
+        When parsed, vars are rendered in dependency order, so a var can
+        reference vars defined after it. A var can also extend its inherited
+        value, like `name: ${name}-suffix`.
+        """
 
         # Transform var list to dict
         result = {var.name: var.value for var in self._vars}
@@ -132,25 +171,145 @@ class VarsManager(PaasifyObj):
             return result
 
         # Parse each values
-        for key, value in result.items():
-            result[key] = self.template_value(value, result, hint=key)
+        with profiler.span("render_vars"):
+            chains = self.get_self_refs()
+            for key in self.get_resolve_order(result, chains=chains):
+                if key in chains:
+                    result[key] = self.render_chain(key, chains[key], result)
+                else:
+                    result[key] = self.template_value(result[key], result, hint=key)
 
         return result
 
+    def render_chain(self, key, chain, env):
+        "Render successive definitions of a var, each one extends the previous"
+
+        # A first self reference has no inherited value
+        inherited = {name: value for name, value in env.items() if name != key}
+        for value in chain:
+            value = self.template_value(value, inherited, hint=key)
+            inherited = ChainMap({key: value}, env)
+        return value
+
+    # Vars dependencies
+    # ===========================
+
+    @staticmethod
+    def get_refs(value) -> tuple:
+        "Return the names of vars referenced by a value"
+
+        if isinstance(value, str) and "$" in value:
+            return compile_template(value)[1]
+        return ()
+
+    def get_self_refs(self) -> dict:
+        """Return definitions of vars which reference their inherited value
+
+        For each of those vars, definitions are returned in adding order,
+        starting from the inherited value.
+        """
+
+        history = {}
+        for var in self._vars:
+            history.setdefault(var.name, []).append(var.value)
+
+        chains = {}
+        for key, values in history.items():
+            idx = len(values)
+            while idx and key in self.get_refs(values[idx - 1]):
+                idx -= 1
+            if idx < len(values):
+                chains[key] = values[max(idx - 1, 0) :]
+        return chains
+
+    @classmethod
+    def get_vars_graph(cls, values, chains=None) -> dict:
+        """Return, for each var, the tuple of known vars it references
+
+        Self references are ignored, references of inherited values from
+        `chains` are included.
+        """
+
+        chains = chains or {}
+        graph = {}
+        for key, value in values.items():
+            deps = {}
+            for item in chains.get(key, [value]):
+                for ident in cls.get_refs(item):
+                    if ident != key and ident in values:
+                        deps[ident] = None
+            graph[key] = tuple(deps)
+        return graph
+
+    def get_resolve_order(self, values, chains=None) -> list:
+        """Return var names sorted by dependencies, in a single pass
+
+        Independent vars keep their definition order. Raise an error if
+        vars reference each others in a loop.
+        """
+
+        graph = self.get_vars_graph(values, chains=chains)
+        order = []
+        state = {}  # 1: In progress, 2: Done
+
+        for root in graph:
+            if root in state:
+                continue
+
+            path = [root]
+            state[root] = 1
+            stack = [iter(graph[root])]
+            while stack:
+                for dep in stack[-1]:
+                    dep_state = state.get(dep)
+                    if dep_state == 1:
+                        cycle = path[path.index(dep):] + [dep]
+                        raise error.VarCircularReference(
+                            f"Circular reference between vars: {' -> '.join(cycle)}"
+                        )
+                    if dep_state is None:
+                        state[dep] = 1
+                        path.append(dep)
+                        stack.append(iter(graph[dep]))
+                        break
+                else:
+                    stack.pop()
+                    name = path.pop()
+                    state[name] = 2
+                    order.append(name)
+
+        return order
+
+    def get_unused_vars(self, refs=None) -> list:
+        """Return the names of vars never referenced
+
+        A var is used if another var references it, or if its name
+        is part of the provided `refs`.
+        """
+
+        values = self.render_as_dict()
+        used = set(refs or [])
+        for deps in self.get_vars_graph(values).values():
+            used.update(deps)
+        return [name for name in values if name not in used]
+
     # Vars processors
     # ===========================
 
-    def process_yml_vars(self, lookup):
+    def process_yml_vars(self, lookup, index=None, file_cache=None):
         """Process yml vars from a tag_list"""
 
         self.log.info("Process yaml vars")
 
-        vars_cand = lookup_candidates(lookup)
+        vars_cand = lookup_candidates(lookup, index=index)
         vars_cand = flatten([x["matches"] for x in vars_cand])
 
         for cand in vars_cand:
             self.log.debug(f"Loading vars file: {cand}")
-            conf = anyconfig.load(cand, ac_parser="yaml")
+            if file_cache:
+                conf = file_cache.load(cand)
+            else:
+                conf = load_yaml_file(cand)
             assert isinstance(conf, dict)
             self.add_as_dict(conf)
 
@@ -160,6 +319,23 @@ class StackAssembler(PaasifyObj):
 
     conf_logger = "paasify.cli.assembler"
 
+    def __init__(
+        self,
+        *args,
+        jsonnet_cache=None,
+        jsonnet_pool=None,
+        jsonnet_persist=True,
+        **kwargs,
+    ):
+
+        # Memoized vars contexts, only valid during an assemble
+        self.vars_memo = {}
+        self.jsonnet_cache = jsonnet_cache
+        self.jsonnet_pool = jsonnet_pool
+        # Write jsonnet results in the disk cache
+        self.jsonnet_persist = jsonnet_persist
+        super().__init__(*args, **kwargs)
+
     # Internal object:
     # all_tags
     # engine
@@ -193,7 +369,10 @@ class StackAssembler(PaasifyObj):
             self.log.debug(f"  {key}: {val}")
 
         try:
-            out = engine.assemble(docker_files, env=env)
+            with profiler.span("compose_config"):
+                docker_run_payload = engine.config(docker_files, env=env)
+        except error.PaasifyError:
+            raise
         except Exception as err:
             err = bin2utf8(err)
             # pylint: disable=no-member
@@ -202,10 +381,6 @@ class StackAssembler(PaasifyObj):
                 f"Impossible to build docker-compose files: {err}"
             ) from err
 
-        # Fetch output
-        docker_run_content = out.stdout.decode("utf-8")
-        docker_run_payload = anyconfig.loads(
-            docker_run_content, ac_parser="yaml")
         return docker_run_payload
 
     # Vars processors
@@ -222,6 +397,12 @@ class StackAssembler(PaasifyObj):
     def process_jsonnet_exec(self, file, action, data):
         "Process jsonnet file"
 
+        with profiler.span("jsonnet", action=action, file=os.path.basename(file)):
+            return self._process_jsonnet_exec(file, action, data)
+
+    def _process_jsonnet_exec(self, file, action, data):
+        "Evaluate jsonnet file, or return cached result"
+
         # Developper init
         data = data or {}
         assert isinstance(data, dict), f"Data must be dict, got: {data}"
@@ -236,6 +417,15 @@ class StackAssembler(PaasifyObj):
         #     "docker_override",
         # ], f"Action not supported: {action}"
 
+        # Check cache
+        cache = self.jsonnet_cache
+        if cache:
+            cache_key = cache.get_key(file, action, data)
+            result = cache.get(cache_key)
+            if result is not None:
+                self.log.trace(f"Cached jsonnet: {file} (action={action})")
+                return json.loads(result)
+
         # Prepare input variables
         ext_vars = {
             "action": json.dumps(action),
@@ -246,15 +436,21 @@ class StackAssembler(PaasifyObj):
         # Process jsonnet tag
         self.log.trace(f"Process jsonnet: {file} (action={action})")
         try:
-            # pylint: disable=c-extension-no-member
-            result = _jsonnet.evaluate_file(
-                file,
-                ext_vars=ext_vars,
-            )
+            if self.jsonnet_pool:
+                result = self.jsonnet_pool.evaluate(file, ext_vars)
+            else:
+                # pylint: disable=c-extension-no-member
+                result = _jsonnet.evaluate_file(
+                    file,
+                    ext_vars=ext_vars,
+                )
         except RuntimeError as err:
             self.log.critical(f"Can't parse jsonnet file: {file}")
             raise error.JsonnetBuildFailed(err)
 
+        if cache:
+            cache.set(cache_key, result, persist=self.jsonnet_persist)
+
         # Return python object from json output
         return json.loads(result)
 
@@ -354,7 +550,7 @@ class PaasifyStackApp(NodeMap, PaasifyObj):
                 "pattern": ["docker-compose.yml", "docker-compose.yml"],
             }
         ]
-        return lookup_candidates(lookup)
+        return lookup_candidates(lookup, index=self.prj.dir_index)
 
     def lookup_jsonnet_files_app(self):
         """Lookup docker-compose files in app directory"""
@@ -365,7 +561,7 @@ class PaasifyStackApp(NodeMap, PaasifyObj):
                 "pattern": ["docker-compose.yml", "docker-compose.yml"],
             }
         ]
-        local_cand = lookup_candidates(lookup)
+        local_cand = lookup_candidates(lookup, index=self.prj.dir_index)
         local_cand = flatten([x["matches"] for x in local_cand])
 
         return local_cand
@@ -597,7 +793,7 @@ class PaasifyStackTag(NodeMap, PaasifyObj):
             }
             lookup.append(lookup_def)
 
-        local_cand = lookup_candidates(lookup)
+        local_cand = lookup_candidates(lookup, index=self.prj.dir_index)
         local_cand = flatten([x["matches"] for x in local_cand])
 
         return local_cand
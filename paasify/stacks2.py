@@ -16,14 +16,12 @@ import os
 import re
 from pprint import pprint  # noqa: F401
 from functools import wraps
-
-import anyconfig
+from concurrent.futures import ThreadPoolExecutor
 
 
 from cafram.nodes import NodeList, NodeMap
 from cafram.utils import (
     to_domain,
-    to_yaml,
     first,
     flatten,
     write_file,
@@ -31,10 +29,24 @@ from cafram.utils import (
 )
 
 import paasify.errors as error
-from paasify.common import lookup_candidates
+from paasify.version import __version__
+from paasify.common import lookup_candidates, multiplex
+from paasify.engines import EngineProxy, format_ps_row
+from paasify.compose import compose_heads, normalize_project_name
+from paasify.profiler import profiler
+from paasify.yaml_io import to_yaml
+from paasify.cache import (
+    AssembleCache,
+    hash_file,
+    hash_payload,
+    jsonnet_imports,
+    write_if_changed,
+    extract_env_refs,
+)
 from paasify.framework import (
     PaasifyObj,
     PaasifyConfigVars,
+    LogBuffer,
 )
 from paasify.stack_components import (
     PaasifyStackTagManager,
@@ -55,6 +67,14 @@ except ImportError:
     ENABLE_JSON_SCHEMA = False
 
 
+# Var references in docker-compose files: $VAR or ${VAR...}
+COMPOSE_VAR_REGEX = re.compile(r"\$\{?([A-Za-z_][A-Za-z0-9_]*)")
+# Var references in jsonnet files: vars.name or any 'name' string literal
+JSONNET_VAR_REGEX = re.compile(
+    r"\bvars\.([A-Za-z_][A-Za-z0-9_]*)|['\"]([A-Za-z_][A-Za-z0-9_]*)['\"]"
+)
+
+
 class PaasifyStack(NodeMap, PaasifyObj):
     "Paasify Stack Instance"
 
@@ -68,6 +88,7 @@ class PaasifyStack(NodeMap, PaasifyObj):
         "tags_suffix": [],
         "tags_prefix": [],
         "vars": [],
+        "depends_on": [],
     }
 
     conf_children = [
@@ -103,6 +124,10 @@ class PaasifyStack(NodeMap, PaasifyObj):
             "tags_prefix": PaasifyStackTagManager.conf_schema,
             "tags_suffix": PaasifyStackTagManager.conf_schema,
             "vars": PaasifyConfigVars.conf_schema,
+            "depends_on": {
+                "type": "array",
+                "items": {"type": "string"},
+            },
         },
     }
 
@@ -117,6 +142,9 @@ class PaasifyStack(NodeMap, PaasifyObj):
     prj_dir = None
     prj_ns = None
 
+    # Last assemble status, True if docker-compose.run.yml has been rewritten
+    run_file_changed = None
+
     # CaFram functions
     # ---------------------
 
@@ -207,8 +235,12 @@ class PaasifyStack(NodeMap, PaasifyObj):
             "stack_path": self.stack_path,
             # os.path.join(self.stack_dir, "docker-compose.run.yml"),
             "docker_file": "docker-compose.run.yml",
+            "compose_merge": self.prj.config.compose_merge,
         }
-        self.engine = self.prj.engine_cls(parent=self, payload=payload)
+        self.engine = EngineProxy(
+            lambda payload: self.prj.get_engine_cls()(parent=self, payload=payload),
+            payload,
+        )
 
         # Build tag list
         tag_list = ["_paasify"] + (
@@ -256,7 +288,8 @@ class PaasifyStack(NodeMap, PaasifyObj):
                 "pattern": ["docker-compose.yml", "docker-compose.yaml"],
             }
         ]
-        local_cand = flatten([x["matches"] for x in lookup_candidates(lookup)])
+        local_cand = lookup_candidates(lookup, index=self.prj.dir_index)
+        local_cand = flatten([x["matches"] for x in local_cand])
 
         # 3. Get app cand as fallback
         app_cand = []
@@ -325,9 +358,14 @@ class PaasifyStack(NodeMap, PaasifyObj):
         "Generate default core variables"
 
         # Extract stack config
-        dfile = anyconfig.load(docker_file, ac_ordered=True, ac_parser="yaml")
-        default_service = first(dfile.get("services", ["default"]))
-        default_network = first(dfile.get("networks", ["default"]))
+        with profiler.span("gen_conveniant_vars"):
+            heads = self.prj.file_cache.load(
+                docker_file, loader=compose_heads, name="compose_heads"
+            )
+        services = heads["services"]
+        networks = heads["networks"]
+        default_service = first(services if services is not None else ["default"])
+        default_network = first(networks if networks is not None else ["default"])
 
         assert isinstance(self.prj_ns, str)
         assert isinstance(self.prj_path, str)
@@ -377,6 +415,95 @@ class PaasifyStack(NodeMap, PaasifyObj):
 
         return lookups
 
+    def get_assemble_fingerprint(self, all_tags) -> str:
+        "Return a fingerprint of all inputs consumed by the assemble process"
+        return hash_payload(self.get_assemble_inputs(all_tags))
+
+    def get_assemble_inputs(self, all_tags) -> dict:
+        """
+        Return all inputs consumed by the assemble process
+
+        Inputs cover:
+
+            * Docker-compose and tags files (with jsonnet imports) content
+            * Varfiles `vars.yml` content
+            * Core, user and tag variables
+            * Referenced `_env_` environment variables
+            * Compose `.env` file of the project directory
+            * Engine, docker compose, compose merge mode and paasify versions
+        """
+
+        # 1. Collect docker-compose, tags and vars files
+        vars_lookup = lookup_candidates(
+            self.docker_vars_lookup, index=self.prj.dir_index
+        )
+        vars_files = flatten([x["matches"] for x in vars_lookup])
+        files = list(self.docker_candidates())
+        tags = []
+        for cand in all_tags:
+            tag = cand.get("tag")
+            jsonnet_file = cand.get("jsonnet_file")
+            docker_file = cand.get("docker_file")
+
+            if docker_file:
+                files.append(docker_file)
+            if jsonnet_file:
+                files.append(jsonnet_file)
+                files.extend(jsonnet_imports(jsonnet_file))
+
+            tags.append(
+                {
+                    "tag": tag.name if tag else None,
+                    "vars": tag.vars if tag else None,
+                    "jsonnet_file": jsonnet_file,
+                    "docker_file": docker_file,
+                }
+            )
+        files.extend(vars_files)
+
+        # Compose reads the `.env` file next to the first docker-compose file
+        docker_files = [x["docker_file"] for x in all_tags if x.get("docker_file")]
+        if docker_files:
+            files.append(os.path.join(os.path.dirname(docker_files[0]), ".env"))
+
+        # 2. Collect variables
+        user_vars = [
+            {var.name: var.value}
+            for var in self.prj.config.vars.get_vars_list()
+            + self.vars.get_vars_list()
+        ]
+        default_vars = self._gen_conveniant_vars(
+            docker_file=all_tags[0]["docker_file"]
+        )
+
+        # 3. Collect referenced environment variables
+        env_content = [to_json(user_vars), to_json([x["vars"] for x in tags])]
+        for file in vars_files:
+            with open(file, encoding="utf-8") as _file:
+                env_content.append(_file.read())
+        env_refs = extract_env_refs("\n".join(env_content))
+
+        # 4. Build fingerprint, native merge does not need docker
+        if self.engine.native:
+            engine = "native"
+        else:
+            engine = self.engine.resolve()
+            engine = (
+                f"{engine.__class__.__name__}:{engine.version}"
+                f":{engine.get_compose_version()}"
+            )
+        payload = {
+            "paasify_version": __version__,
+            "engine": engine,
+            "compose_merge": self.engine.compose_merge,
+            "files": {file: hash_file(file) for file in files},
+            "tags": tags,
+            "vars_default": default_vars,
+            "vars_user": user_vars,
+            "env": {name: os.environ.get(name) for name in env_refs},
+        }
+        return payload
+
     def get_stack_vars(self, sta, all_tags, extra_user_vars=None):
         """
         Build a stack's variable context
@@ -400,15 +527,26 @@ class PaasifyStack(NodeMap, PaasifyObj):
         extra_user_vars = extra_user_vars or {}
         lookups = self.docker_vars_lookup
 
-        # 1. Create Stack VarManager
-        docker_file = all_tags[0]["docker_file"]
-        vars_default = self._gen_conveniant_vars(docker_file=docker_file)
+        # Reuse already computed contexts
+        memo = sta.vars_memo
+        memo_key = ("stack_vars", hash_payload(extra_user_vars))
+        if memo_key in memo:
+            self.log.debug("    Reuse already built vars context")
+            return dict(memo[memo_key])
 
-        vars_stack = VarsManager(
-            parent=self, ident=f"VarsManager.{self.stack_name}.default"
-        )
-        vars_stack.add_as_dict(vars_default)
-        vars_stack.process_yml_vars(lookups)
+        # 1. Create Stack VarManager (does not depend on user vars)
+        if "vars_stack" not in memo:
+            docker_file = all_tags[0]["docker_file"]
+            vars_default = self._gen_conveniant_vars(docker_file=docker_file)
+
+            vars_stack = VarsManager(
+                parent=self, ident=f"VarsManager.{self.stack_name}.default"
+            )
+            vars_stack.add_as_dict(vars_default)
+            vars_stack.process_yml_vars(
+                lookups, index=self.prj.dir_index, file_cache=self.prj.file_cache
+            )
+            memo["vars_stack"] = vars_stack.get_entries()
 
         # 2. Create User VarManager
         vars_global = globvars.get_vars_list()
@@ -426,8 +564,9 @@ class PaasifyStack(NodeMap, PaasifyObj):
         vars_build = VarsManager(
             parent=self, ident=f"VarsManager.{self.stack_name}.build"
         )
-        vars_build.add_as_dict(vars_stack.render_as_dict())
-        vars_build.add_as_dict(vars_user.render_as_dict())
+        # All definitions are kept, so vars can extend their inherited value
+        vars_build.add_as_list(memo["vars_stack"])
+        vars_build.add_as_list(vars_user.get_entries())
 
         # Loop over all candidates
         for cand in all_tags:
@@ -441,45 +580,131 @@ class PaasifyStack(NodeMap, PaasifyObj):
 
             # Build Var context
             ctx = vars_build.render_as_dict()
-            ctx_keys = ctx.keys()
-
-            # Execute jsonnet scripts (Sloow)
-            self.log.info(f"    Processing vars from tag: {tag}")
-            defaults = sta.jsonnet_low_api_call(
-                jsonnet_file, "global_default", ctx)
-            defaults = {
-                key: value for key, value in defaults.items() if key not in ctx_keys
-            }
-            ctx.update(defaults)
 
-            assemble = sta.jsonnet_low_api_call(
-                jsonnet_file, "global_assemble", ctx)
-            assemble = {
-                key: value for key, value in assemble.items() if key not in ctx_keys
-            }
+            # Execute jsonnet scripts (Sloow), only if context changed
+            with profiler.span("tag_vars", tag=tag.name if tag else None):
+                result = self._get_tag_vars(sta, tag, jsonnet_file, ctx)
+            vars_build.add_as_dict(result)
+
+        result = vars_build.render_as_dict(parse=True)
+        memo[memo_key] = result
+        return dict(result)
 
-            # Build result
-            result = {}
-            result.update(defaults)
-            result.update(assemble)
+    def _get_tag_vars(self, sta, tag, jsonnet_file, ctx):
+        """
+        Return variables provided by a jsonnet tag for a given context
 
-            # print ("Vars for global tag (docker-compose):", cand.get("tag"))
-            # pprint (defaults)
-            # pprint (assemble)
+        Results are memoized on the assembler by tag file and context, so
+        tags are only evaluated again when their input context differ.
+        """
 
-            vars_build.add_as_dict(result)
+        memo = sta.vars_memo
+        memo_key = ("tag_vars", jsonnet_file, hash_payload(ctx))
+        if memo_key in memo:
+            self.log.info(f"    Reuse vars from tag: {tag}")
+            return memo[memo_key]
+
+        ctx_keys = ctx.keys()
+
+        self.log.info(f"    Processing vars from tag: {tag}")
+        defaults = sta.jsonnet_low_api_call(jsonnet_file, "global_default", ctx)
+        defaults = {
+            key: value for key, value in defaults.items() if key not in ctx_keys
+        }
+        ctx.update(defaults)
+
+        assemble = sta.jsonnet_low_api_call(jsonnet_file, "global_assemble", ctx)
+        assemble = {
+            key: value for key, value in assemble.items() if key not in ctx_keys
+        }
+
+        # Build result
+        result = {}
+        result.update(defaults)
+        result.update(assemble)
+
+        memo[memo_key] = result
+        return result
+
+    @property
+    def run_file(self):
+        "Return the path of the generated docker-compose.run.yml file"
+        return os.path.join(self.stack_path, "docker-compose.run.yml")
+
+    def get_run_networks(self):
+        """Return the names of networks provided and attached by the stack
+
+        Networks are read from the run file. External networks are attached,
+        other networks are created, and thus provided, by the stack.
+        """
+
+        provided, attached = set(), set()
+        if not os.path.isfile(self.run_file):
+            return provided, attached
+
+        payload = self.prj.file_cache.load(self.run_file) or {}
+        project = payload.get("name")
+        for key, net in (payload.get("networks") or {}).items():
+            net = net or {}
+            external = net.get("external")
+            name = net.get("name")
+            if isinstance(external, dict):
+                name = external.get("name", name)
+            if external:
+                attached.add(name or key)
+            else:
+                provided.add(name or f"{project}_{key}")
+
+        return provided, attached
+
+    def get_assemble_cache(self):
+        "Return the assemble cache of the stack"
+
+        return AssembleCache(
+            parent=self,
+            ident=f"AssembleCache.{self.stack_name}",
+            cache_dir=self.prj.runtime.project_cache_dir,
+            name=self.stack_name,
+        )
+
+    def is_applied(self) -> bool:
+        "Return true if the run file has not changed since last start"
+        return self.get_assemble_cache().is_applied(self.run_file)
+
+    @profiler.method("assemble")
+    def assemble(self, use_cache=True) -> bool:
+        """Generate docker-compose.run.yml and parse it with jsonnet
 
-        return vars_build.render_as_dict(parse=True)
+        Return False if the stack was unchanged and the build was skipped.
+        """
 
-    def assemble(self):
-        "Generate docker-compose.run.yml and parse it with jsonnet"
+        # 0. Check assemble cache
+        # -------------------
+        with profiler.span("tag_plan"):
+            all_tags = self.get_tag_plan()
+        outfile = self.run_file
+        cache = self.get_assemble_cache()
+        with profiler.span("fingerprint"):
+            inputs = self.get_assemble_inputs(all_tags)
+            fingerprint = hash_payload(inputs)
+        if use_cache and cache.is_valid(fingerprint, outfile):
+            self.log.info(f"    Cache hit, skip unchanged stack: {self.stack_name}")
+            self.run_file_changed = False
+            return False
+        self.log.info(f"    Cache miss, assemble stack: {self.stack_name}")
 
         # 1. Prepare assemble context
         # -------------------
+        # Environment values may be secrets, keep them out of the disk cache
         sta = StackAssembler(
-            parent=self, ident=f"StackAssembler.{self.stack_name}")
-        all_tags = self.get_tag_plan()
-        vars_build = self.get_stack_vars(sta, all_tags)
+            parent=self,
+            ident=f"StackAssembler.{self.stack_name}",
+            jsonnet_cache=self.prj.jsonnet_cache,
+            jsonnet_pool=self.prj.jsonnet_pool,
+            jsonnet_persist=not inputs["env"],
+        )
+        with profiler.span("stack_vars"):
+            vars_build = self.get_stack_vars(sta, all_tags)
 
         # 2. Build docker-compose
         # -------------------
@@ -517,9 +742,8 @@ class PaasifyStack(NodeMap, PaasifyObj):
             # --------------------
             result = vars_build
             if len(tag_vars) > 0:
-                # If variables has been overrided, we need to recalculate the whole var stack
-                # which is actually quite slow because
-                # we need to reprocess all jsonnet files
+                # If variables has been overrided, we need to recalculate the whole var stack,
+                # only tags with a different input context are processed again
                 result = self.get_stack_vars(
                     sta, all_tags, extra_user_vars=tag_vars)
 
@@ -530,9 +754,10 @@ class PaasifyStack(NodeMap, PaasifyObj):
                 "docker_data": docker_run_payload,
             }
             self.log.info(f"    Processing instance vars from tag: {tag}")
-            docker_run_payload = sta.process_jsonnet_exec(
-                jsonnet_file, "docker_transform", params
-            )
+            with profiler.span("docker_transform", tag=tag_name):
+                docker_run_payload = sta.process_jsonnet_exec(
+                    jsonnet_file, "docker_transform", params
+                )
 
         # 4. Write output file
         # -------------------
@@ -542,11 +767,64 @@ class PaasifyStack(NodeMap, PaasifyObj):
             self.log.info(f"Create missing directory: {self.stack_path}")
             os.mkdir(self.stack_path)
 
-        # Save the final docker-compose.run.yml file
-        outfile = os.path.join(self.stack_path, "docker-compose.run.yml")
-        self.log.info(f"Writing docker-compose file: {outfile}")
-        output = to_yaml(docker_run_payload)
-        write_file(outfile, output)
+        # Save the final docker-compose.run.yml file, only if it changed
+        with profiler.span("write"):
+            output = to_yaml(docker_run_payload)
+            self.run_file_changed = write_if_changed(outfile, output)
+        if self.run_file_changed:
+            self.log.info(f"Updated docker-compose file: {outfile}")
+        else:
+            self.log.info(f"Unchanged docker-compose file, not rewritten: {outfile}")
+        cache.save(fingerprint, outfile)
+
+        return True
+
+    def get_unused_vars(self) -> list:
+        """Return user vars which are never referenced
+
+        User vars are the project, stack and tag vars, and vars from
+        `vars.yml` files. A var is used when it is referenced by another
+        var, by a docker-compose file or by a jsonnet tag. Jsonnet detection
+        is conservative: any matching string literal counts as a reference.
+        """
+
+        all_tags = self.get_tag_plan()
+
+        # Collect user vars
+        vars_user = VarsManager(
+            parent=self, ident=f"VarsManager.{self.stack_name}.unused"
+        )
+        vars_user.add_as_list(self.prj.config.vars.get_vars_list())
+        vars_user.add_as_list(self.vars.get_vars_list())
+        vars_user.process_yml_vars(
+            self.docker_vars_lookup,
+            index=self.prj.dir_index,
+            file_cache=self.prj.file_cache,
+        )
+        for cand in all_tags:
+            tag = cand.get("tag")
+            if tag and tag.vars:
+                vars_user.add_as_dict(tag.vars)
+
+        # Collect references from files
+        files = []
+        for cand in all_tags:
+            if cand.get("docker_file"):
+                files.append((cand["docker_file"], COMPOSE_VAR_REGEX))
+            if cand.get("jsonnet_file"):
+                for file in [cand["jsonnet_file"]] + jsonnet_imports(cand["jsonnet_file"]):
+                    files.append((file, JSONNET_VAR_REGEX))
+
+        refs = set()
+        for file, regex in files:
+            with open(file, encoding="utf-8") as _file:
+                content = _file.read()
+            refs.update(
+                next(x for x in match.groups() if x)
+                for match in regex.finditer(content)
+            )
+
+        return vars_user.get_unused_vars(refs=refs)
 
     def explain_tags(self):
         "Explain hos tags are processed on stack"
@@ -620,6 +898,12 @@ class PaasifyStack(NodeMap, PaasifyObj):
         print("      Loading jsonnet:")
         list_jsonnet_files(matches)
 
+        # 3. Show unused vars
+        unused = self.get_unused_vars()
+        if unused:
+            print("\n    Unused vars:")
+            list_items(unused)
+
     def gen_doc(self, output_dir=None):
         "Generate documentation"
 
@@ -844,35 +1128,210 @@ class PaasifyStackManager(NodeList, PaasifyObj):
     # Command Base API
     # ======================
 
+    def _assemble_parallel(self, stacks, use_cache=True, jobs=2):
+        """Assemble stacks concurrently
+
+        Logs of each stack are buffered and displayed in stack order. Failures
+        do not stop other stacks, they are all reported at the end.
+        """
+
+        log_buffer = LogBuffer()
+
+        def _worker(stack):
+            with log_buffer.capture() as records:
+                # pylint: disable=broad-except
+                try:
+                    return stack.assemble(use_cache=use_cache), None, records
+                except Exception as err:
+                    return None, err, records
+
+        results = []
+        failures = []
+        with log_buffer, ThreadPoolExecutor(max_workers=jobs) as executor:
+            futures = [executor.submit(_worker, stack) for stack in stacks]
+            for stack, future in zip(stacks, futures):
+                changed, err, records = future.result()
+                self.log.notice(f"  Assemble stack: {stack}")
+                log_buffer.replay(records)
+                if err:
+                    self.log.error(f"  Failed to assemble stack: {stack.stack_name}: {err}")
+                    failures.append((stack, err))
+                results.append(changed)
+
+        if failures:
+            names = ", ".join([stack.stack_name for stack, _ in failures])
+            raise error.StackAssembleFailed(
+                f"Failed to assemble {len(failures)} stack(s): {names}"
+            ) from failures[0][1]
+
+        return results
+
+    def get_stack_deps(self, stacks) -> dict:
+        """Return the names of the stacks each stack depends on
+
+        A stack depends on the stacks listed in its `depends_on` config, and
+        on the stacks providing the external networks it attaches to, as
+        declared by `docker-net-provide` and `docker-net-attach` tags. Only
+        dependencies between the given stacks are returned.
+        """
+
+        all_names = [stack.stack_name for stack in self.get_children()]
+        names = [stack.stack_name for stack in stacks]
+
+        providers = {}
+        attached = {}
+        for stack in stacks:
+            provided, attached[stack.stack_name] = stack.get_run_networks()
+            for net in provided:
+                providers.setdefault(net, stack.stack_name)
+
+        result = {}
+        for stack in stacks:
+            wanted = set()
+            for name in stack.depends_on or []:
+                if name not in all_names:
+                    self.log.warning(
+                        f"Stack {stack.stack_name} depends on unknown stack: {name}"
+                    )
+                wanted.add(name)
+            wanted.update(
+                providers[net] for net in attached[stack.stack_name] if net in providers
+            )
+            wanted.discard(stack.stack_name)
+            result[stack.stack_name] = [name for name in names if name in wanted]
+
+        return result
+
+    def get_waves(self, stacks) -> list:
+        """Group stacks in waves, stacks only depend on stacks of previous waves
+
+        Stacks keep their list order in each wave. Raise an error if stacks
+        depend on each others in a loop.
+        """
+
+        deps = self.get_stack_deps(stacks)
+        remaining = list(stacks)
+        done = set()
+        waves = []
+        while remaining:
+            wave = [
+                stack for stack in remaining if done.issuperset(deps[stack.stack_name])
+            ]
+            if not wave:
+                names = ", ".join([stack.stack_name for stack in remaining])
+                raise error.StackCircularDependency(
+                    f"Circular dependency between stacks: {names}"
+                )
+            waves.append(wave)
+            done.update([stack.stack_name for stack in wave])
+            remaining = [stack for stack in remaining if stack.stack_name not in done]
+
+        return waves
+
+    def _run_waves(self, stacks, func, jobs=1, reverse=False):
+        """Run func on stacks, wave after wave
+
+        Stacks of the same wave run concurrently, up to `jobs` at once, and
+        their logs are displayed in stack order. A wave only starts if the
+        previous one succeeded. Waves are reversed to stop stacks, so
+        dependents are stopped first. Func receives the stack and a `fg`
+        flag, false when stacks run concurrently.
+        """
+
+        waves = self.get_waves(stacks)
+        if reverse:
+            waves = [list(reversed(wave)) for wave in reversed(waves)]
+
+        for idx, wave in enumerate(waves, start=1):
+            names = ", ".join([stack.stack_name for stack in wave])
+            self.log.info(f"  Wave {idx}/{len(waves)}: {names}")
+
+            if jobs < 2 or len(wave) < 2:
+                for stack in wave:
+                    func(stack, fg=True)
+                continue
+
+            log_buffer = LogBuffer()
+
+            def _worker(stack):
+                with log_buffer.capture() as records:
+                    # pylint: disable=broad-except
+                    try:
+                        func(stack, fg=False)
+                        return None, records
+                    except Exception as err:
+                        return err, records
+
+            failures = []
+            with log_buffer, ThreadPoolExecutor(max_workers=jobs) as executor:
+                futures = [executor.submit(_worker, stack) for stack in wave]
+                for stack, future in zip(wave, futures):
+                    err, records = future.result()
+                    log_buffer.replay(records)
+                    if err:
+                        self.log.error(f"  Failed stack: {stack.stack_name}: {err}")
+                        failures.append((stack, err))
+
+            if failures:
+                names = ", ".join([stack.stack_name for stack, _ in failures])
+                raise error.StackCommandFailed(
+                    f"Failed to process {len(failures)} stack(s): {names}"
+                ) from failures[0][1]
+
     @stack_target
-    def cmd_stack_assemble(self, stacks=None):
+    def cmd_stack_assemble(self, stacks=None, no_cache=False, jobs=1):
         "Assemble a stack"
 
         self.log.notice("Asemble stacks:")
-        for stack in stacks:
-            self.log.notice(f"  Assemble stack: {stack}")
-            stack.assemble()
+        use_cache = not no_cache
+        if jobs > 1 and len(stacks) > 1:
+            results = self._assemble_parallel(stacks, use_cache=use_cache, jobs=jobs)
+        else:
+            results = []
+            for stack in stacks:
+                self.log.notice(f"  Assemble stack: {stack}")
+                results.append(stack.assemble(use_cache=use_cache))
+
+        hits = [
+            stack.stack_name for stack, changed in zip(stacks, results) if not changed
+        ]
+        if hits:
+            self.log.notice(
+                f"Assemble cache: {len(hits)} hits, {len(stacks) - len(hits)} misses"
+                f" (unchanged: {', '.join(hits)})"
+            )
+
+        changed = [stack.stack_name for stack in stacks if stack.run_file_changed]
+        msg = f"Run files: {len(changed)} changed, {len(stacks) - len(changed)} unchanged"
+        if changed:
+            msg += f" (changed: {', '.join(changed)})"
+        self.log.notice(msg)
+
+        jsonnet_cache = self.get_parent().jsonnet_cache
+        if jsonnet_cache:
+            self.log.info(jsonnet_cache.report())
 
     @stack_target
-    def cmd_stack_up(self, stacks=None):
-        "Start a stack"
+    def cmd_stack_up(self, stacks=None, jobs=1):
+        "Start a stack, providers first"
 
-        self.log.notice("Start stacks:")
-        for stack in stacks:
+        def _up(stack, fg=True):
             self.log.notice(f"  Start stack: {stack.stack_name}")
-            stack.engine.up(_fg=True)
+            stack.engine.up(_fg=fg)
+            stack.get_assemble_cache().save_applied(stack.run_file)
+
+        self.log.notice("Start stacks:")
+        self._run_waves(stacks, _up, jobs=jobs)
 
     @stack_target
-    def cmd_stack_down(self, stacks=None, ignore_errors=False):
-        "Stop a stack"
+    def cmd_stack_down(self, stacks=None, ignore_errors=False, jobs=1):
+        "Stop a stack, dependents first"
 
-        stacks = list(stacks)
-        stacks.reverse()
-        self.log.notice("Stop stacks:")
-        for stack in stacks:
+        def _down(stack, fg=True):
             self.log.notice(f"  Stop stack: {stack.stack_name}")
+            stack.get_assemble_cache().clear_applied()
             try:
-                stack.engine.down(_fg=True)
+                stack.engine.down(_fg=fg)
             except error.DockerCommandFailed:
                 if not ignore_errors:
                     raise
@@ -880,38 +1339,86 @@ class PaasifyStackManager(NodeList, PaasifyObj):
                     f"Ignoring stop failure in case of recreate for stack: {stack.stack_name}"
                 )
 
+        self.log.notice("Stop stacks:")
+        self._run_waves(stacks, _down, jobs=jobs, reverse=True)
+
     @stack_target
-    def cmd_stack_ps(self, stacks=None):
-        "List stacks process"
+    def cmd_stack_ps(self, stacks=None, batch=False, output_json=False):
+        """List stacks process
+
+        In batch mode, processes of all stacks are fetched with a single
+        docker query on the project namespace, stacks are matched on their
+        compose project name. When no stack matches, each stack is queried.
+        Json output is a dict of processes lists, by stack name.
+        """
 
         if len(stacks) < 1:
             self.log.notice("  No process founds")
             return
 
-        # self.log.notice("List of processes:")
-        for stack in stacks:
-            # self.log.notice(f"Process of stack: {stack.stack_name}")
-            stack.engine.ps()
+        if not batch and not output_json:
+            for stack in stacks:
+                stack.engine.ps()
+            return
+
+        result = None
+        if batch:
+            projects = stacks[0].engine.get_ps_projects(
+                prefix=normalize_project_name(f"{stacks[0].prj_ns}_")
+            )
+            names = {
+                stack.stack_name: normalize_project_name(stack.engine.stack_name)
+                for stack in stacks
+            }
+            if any(name in projects for name in names.values()):
+                result = {key: projects.get(name, []) for key, name in names.items()}
+            else:
+                self.log.info("No stack found in batch query, query each stack")
+
+        if result is None:
+            result = {stack.stack_name: stack.engine.get_ps() for stack in stacks}
+
+        if output_json:
+            print(to_json(result))
+            return
+
+        for rows in result.values():
+            for row in rows:
+                print(format_ps_row(row))
 
     # Shortcuts
     # ======================
     @stack_target
-    def cmd_stack_apply(self, stacks=None):
-        "Apply a stack"
+    def cmd_stack_apply(self, stacks=None, jobs=1, changed_only=False):
+        """Apply a stack
+
+        With `changed_only`, stacks whose run file is the same as the last
+        started one are not started again.
+        """
 
         self.log.notice("Apply stacks")
-        self.cmd_stack_assemble(stacks=stacks)
-        self.cmd_stack_up(stacks=stacks)
+        self.cmd_stack_assemble(stacks=stacks, jobs=jobs)
+
+        if changed_only:
+            skipped = [stack.stack_name for stack in stacks if stack.is_applied()]
+            stacks = [stack for stack in stacks if stack.stack_name not in skipped]
+            if skipped:
+                self.log.notice(
+                    f"Skip {len(skipped)} unchanged stack(s): {', '.join(skipped)}"
+                )
+
+        if stacks:
+            self.cmd_stack_up(stacks=stacks, jobs=jobs)
         self.log.notice("Stack has been applied")
 
     @stack_target
-    def cmd_stack_recreate(self, stacks=None):
+    def cmd_stack_recreate(self, stacks=None, jobs=1):
         "Recreate a stack"
 
         self.log.notice("Recreate stacks")
-        self.cmd_stack_down(stacks=stacks, ignore_errors=True)
-        self.cmd_stack_assemble(stacks=stacks)
-        self.cmd_stack_up(stacks=stacks)
+        self.cmd_stack_down(stacks=stacks, ignore_errors=True, jobs=jobs)
+        self.cmd_stack_assemble(stacks=stacks, jobs=jobs)
+        self.cmd_stack_up(stacks=stacks, jobs=jobs)
         self.log.notice("Stack has been recreated")
 
     # Other commands
@@ -941,16 +1448,38 @@ class PaasifyStackManager(NodeList, PaasifyObj):
                 stack.explain_tags()
 
     @stack_target
-    def cmd_stack_logs(self, stacks=None, follow=False):
-        "Display stack/services logs"
+    def cmd_stack_logs(self, stacks=None, follow=False, since=None, tail=None):
+        """Display stack/services logs
+
+        Logs of all stacks are streamed concurrently, line by line, and
+        prefixed by stack and container names.
+        """
 
-        if follow and len(stacks) > 1:
-            stacks = ",".join([stack.stack_name for stack in stacks])
-            msg = (
-                f"Only one stack is allowed when follow mode is enabled, got: {stacks}"
+        streams = {
+            stack.stack_name: stack.engine.logs_stream(
+                follow=follow, since=since, tail=tail
             )
-            raise error.OnlyOneStackAllowed(msg)
+            for stack in stacks
+        }
 
-        for stack in stacks:
-            self.log.notice(f"Logs of stack: {stack.stack_name}")
-            stack.engine.logs(follow)
+        width = 0
+        failures = []
+        for stack_name, line in multiplex(streams):
+            if isinstance(line, Exception):
+                self.log.error(f"Failed to get logs of stack {stack_name}: {line}")
+                failures.append(stack_name)
+                continue
+
+            container, sep, msg = line.partition(" | ")
+            prefix = stack_name
+            if sep:
+                prefix = f"{stack_name}/{container.strip()}"
+            else:
+                msg = line
+            width = max(width, len(prefix))
+            print(f"{prefix :<{width}} | {msg}", flush=True)
+
+        if failures:
+            raise error.DockerCommandFailed(
+                f"Failed to get logs of stack(s): {', '.join(failures)}"
+            )
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""Paasify workers library
+
+This library provides a pool of long lived processes to evaluate
+jsonnet plugins outside of the main process.
+
+Workers keep the source of the jsonnet files and of their imports
+in memory, and only read them again when they change on disk.
+"""
+
+# pylint: disable=logging-fstring-interpolation
+
+import os
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import wait as futures_wait
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from pprint import pprint  # noqa: F401
+
+import _jsonnet
+
+import paasify.errors as error
+from paasify.framework import PaasifyObj
+
+
+# =====================================================================
+# Worker side
+# =====================================================================
+
+_SOURCES = {}
+
+
+def _read_source(path):
+    "Return file content, kept in memory until the file changes"
+
+    mtime = os.stat(path).st_mtime_ns
+    cached = _SOURCES.get(path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+
+    with open(path, "rb") as _file:
+        content = _file.read()
+    _SOURCES[path] = (mtime, content)
+    return content
+
+
+def _import_callback(base_dir, rel):
+    "Resolve jsonnet imports from the sources cache"
+
+    path = os.path.join(base_dir, rel)
+    if not os.path.isfile(path):
+        raise RuntimeError(f"Jsonnet import not found: {rel}")
+    return path, _read_source(path)
+
+
+def evaluate_file(file, ext_vars):
+    "Evaluate a jsonnet file, reusing already loaded sources"
+
+    try:
+        content = _read_source(file).decode("utf-8")
+    except OSError as err:
+        raise RuntimeError(f"Can't read jsonnet file: {err}") from err
+
+    # pylint: disable=c-extension-no-member
+    return _jsonnet.evaluate_snippet(
+        file,
+        content,
+        ext_vars=ext_vars,
+        import_callback=_import_callback,
+    )
+
+
+# =====================================================================
+# Pool
+# =====================================================================
+
+
+class JsonnetWorkerPool(PaasifyObj):
+    """
+    Pool of persistent jsonnet worker processes
+
+    Processes are started on first use. The number of pending evaluations is
+    bounded by `queue_size`, callers are blocked until a slot is released.
+    When the pool is disabled or broken, evaluations are run in-process.
+    """
+
+    conf_logger = "paasify.cli.workers"
+
+    def __init__(self, *args, workers=2, queue_size=None, timeout=120, **kwargs):
+
+        self.workers = workers
+        self.timeout = timeout
+        self.queue_size = queue_size or workers * 4
+        self.enabled = workers > 0
+
+        self._executor = None
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max(self.queue_size, 1))
+        super().__init__(*args, **kwargs)
+
+    def _submit(self, file, ext_vars):
+        "Submit an evaluation, start the process pool if needed"
+
+        with self._lock:
+            if self._executor is None:
+                self.log.debug(f"Start {self.workers} jsonnet workers")
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+                self._pending[self._executor] = set()
+
+            executor = self._executor
+            future = executor.submit(evaluate_file, file, ext_vars)
+            pending = self._pending[executor]
+            pending.add(future)
+            future.add_done_callback(pending.discard)
+            return executor, future
+
+    def evaluate(self, file, ext_vars):
+        "Evaluate a jsonnet file in a worker, return json output"
+
+        if not self.enabled:
+            return evaluate_file(file, ext_vars)
+
+        with self._slots:
+            try:
+                executor, future = self._submit(file, ext_vars)
+                return future.result(timeout=self.timeout)
+
+            except FutureTimeoutError as err:
+                # Stuck workers can't be recovered, other evaluations go on
+                self._retire(executor, stuck=future)
+                raise error.JsonnetBuildFailed(
+                    f"Jsonnet evaluation timed out after {self.timeout}s: {file}"
+                ) from err
+
+            except BrokenProcessPool:
+                self.log.warning(
+                    "Jsonnet workers crashed, fallback to in-process evaluation"
+                )
+                self.shutdown()
+                self.enabled = False
+
+        return evaluate_file(file, ext_vars)
+
+    def _retire(self, executor, stuck=None):
+        """Replace a process pool with a stuck worker
+
+        New evaluations go to a new pool. The retired pool is killed once its
+        other evaluations are done.
+        """
+
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+            others = [
+                future
+                for future in self._pending.get(executor, set()).copy()
+                if future is not stuck
+            ]
+
+        def _kill():
+            futures_wait(others)
+            self._kill(executor)
+
+        threading.Thread(target=_kill, daemon=True).start()
+
+    def _kill(self, executor):
+        "Terminate processes of a pool"
+
+        with self._lock:
+            self._pending.pop(executor, None)
+
+        # pylint: disable=protected-access
+        for proc in list((executor._processes or {}).values()):
+            proc.terminate()
+        executor.shutdown(wait=False)
+
+    def shutdown(self, kill=False):
+        "Stop worker processes"
+
+        with self._lock:
+            executor = self._executor
+            self._executor = None
+
+        if executor is None:
+            return
+
+        if kill:
+            self._kill(executor)
+            return
+
+        executor.shutdown(wait=True)
+        with self._lock:
+            self._pending.pop(executor, None)
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""Paasify yaml library
+
+This library provides the yaml I/O helpers used by the whole build
+pipeline. The libyaml C loader and dumper are preferred when PyYAML
+has been built with them, and the pure Python implementations are used
+as fallback. Both produce the same documents.
+
+Dumped documents keep the format of the former ruamel based `to_yaml`
+of cafram: keys are not sorted, None is written as an empty value and
+YAML 1.1 scalars are quoted. Long scalars are not folded, as libyaml and
+ruamel fold them differently, so run files with long values are rewritten
+once on a single line.
+"""
+
+import io
+import re
+from pprint import pprint  # noqa: F401
+
+import yaml
+
+
+YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+LIBYAML = YAML_LOADER is not yaml.SafeLoader
+
+YAML_STR_TAG = "tag:yaml.org,2002:str"
+YAML_WIDTH = 2**31 - 1
+YAML_DUMP_OPTIONS = {
+    "sort_keys": False,
+    "default_flow_style": False,
+    "allow_unicode": True,
+    "width": YAML_WIDTH,
+}
+
+# Only used to analyze scalars, it never writes
+YAML_ANALYZER = yaml.emitter.Emitter(io.StringIO(), allow_unicode=True)
+
+
+def represent_none(dumper, _):
+    "Represent None as an empty value"
+    return dumper.represent_scalar("tag:yaml.org,2002:null", "")
+
+
+def represent_str(dumper, value):
+    """Represent strings like ruamel
+
+    Strings that can't be plain and contain quotes or line breaks are
+    double quoted.
+    """
+
+    style = None
+    if "'" in value or "\n" in value:
+        analysis = YAML_ANALYZER.analyze_scalar(value)
+        plain = (
+            analysis.allow_block_plain
+            and dumper.resolve(yaml.ScalarNode, value, (True, False)) == YAML_STR_TAG
+        )
+        if not plain and analysis.allow_double_quoted:
+            style = '"'
+    return dumper.represent_scalar(YAML_STR_TAG, value, style=style)
+
+
+# YAML 1.1 scalars resolved by ruamel and not by PyYAML, they must be quoted
+YAML11_RESOLVERS = [
+    ("tag:yaml.org,2002:bool", r"^(?:y|Y|n|N)$", "yYnN"),
+    ("tag:yaml.org,2002:int", r"^[-+]?0?[0-7_]+$", "-+01234567"),
+    (
+        "tag:yaml.org,2002:float",
+        r"""^(?:[-+]?[0-9][0-9_]*\.[0-9_]*(?:[eE][-+]?[0-9]+)?
+        |[-+]?[0-9][0-9_]*[eE][-+]?[0-9]+
+        |\.[0-9_]+(?:[eE][-+][0-9]+)?)$""",
+        "-+0123456789.",
+    ),
+]
+
+
+def make_dumper(base):
+    "Return a dumper class based on base, with paasify representers"
+
+    dumper = type(f"Paasify{base.__name__}", (base,), {})
+    dumper.add_representer(type(None), represent_none)
+    dumper.add_representer(str, represent_str)
+
+    for tag, regex, first in YAML11_RESOLVERS:
+        dumper.add_implicit_resolver(tag, re.compile(regex, re.X), list(first))
+    return dumper
+
+
+YAML_DUMPER = make_dumper(getattr(yaml, "CSafeDumper", yaml.SafeDumper))
+YAML_PY_DUMPER = make_dumper(yaml.SafeDumper)
+
+
+def from_yaml(string, loader=None):
+    "Parse a yaml string"
+    return yaml.load(string, Loader=loader or YAML_LOADER)
+
+
+def to_yaml(obj, dumper=None) -> str:
+    "Dump obj as yaml string"
+    return yaml.dump(obj, Dumper=dumper or YAML_DUMPER, **YAML_DUMP_OPTIONS)
+
+
+def load_yaml_file(path, loader=None):
+    "Parse a yaml file"
+
+    with open(path, "rb") as _file:
+        return from_yaml(_file.read(), loader=loader)
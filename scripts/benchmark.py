@@ -0,0 +1,495 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Paasify assemble benchmark
+
+Generate synthetic projects of increasing size and measure how the
+assemble pipeline scales with stacks, tags and vars. Docker is never
+called: a stub engine merges compose files with the native merge engine.
+
+Example:
+``` sh
+python scripts/benchmark.py --sizes 1,10,100 --depths 1,3 --output bench.json
+python scripts/benchmark.py --baseline bench.json
+python scripts/benchmark.py --yaml 2000
+python scripts/benchmark.py --startup 10
+```
+
+Recorded phases, per project:
+
+  * `load`: Load project and instanciate stacks
+  * `tag_plan`: Resolve tag files (`PaasifyStackTagManager.resolve_tags_files`)
+  * `stack_vars`: Render stack vars (`PaasifyStack.get_stack_vars`)
+  * `assemble`: Full stack build (`PaasifyStack.assemble`), without cache
+
+Each phase records its duration and the peak of memory allocated during
+the phase, as reported by tracemalloc.
+
+The `--yaml` mode compares the pure Python and libyaml implementations
+used by `paasify.yaml_io` on a large generated compose output.
+
+The `--startup` mode measures CLI startup in fresh interpreters: the
+`paasify --version` fast path and the import of `paasify.cli`.
+"""
+
+# pylint: disable=logging-fstring-interpolation
+
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import platform
+import subprocess
+import tempfile
+import textwrap
+import tracemalloc
+from contextlib import contextmanager
+from pprint import pprint  # noqa: F401
+
+import yaml
+
+import paasify.errors as error
+from paasify.version import __version__
+from paasify.yaml_io import (
+    LIBYAML,
+    YAML_DUMPER,
+    YAML_PY_DUMPER,
+    from_yaml,
+    to_yaml,
+)
+from paasify.app2 import PaasifyApp
+from paasify.engines import EngineCompose
+from paasify.compose import compose_config
+from paasify.stack_components import StackAssembler
+
+
+log = logging.getLogger("paasify.benchmark")
+
+# Jsonnet tags from paasify/assets/plugins, compose tags are interleaved
+PLUGIN_TAGS = ["docker-net-provide", "traefik-svc", "docker-net-attach"]
+VARS_PER_STACK = 10
+VARS_GLOBAL = 20
+
+
+# =====================================================================
+# Stub engine
+# =====================================================================
+
+
+class EngineStub(EngineCompose):
+    "Offline docker-engine: merge compose files natively, never run docker"
+
+    ident = "stub"
+    version = "stub"
+    compose_version = "stub"
+
+    def config(self, compose_files, env=None):
+        self.require_stack()
+        return compose_config(
+            compose_files,
+            env=self.get_env_string(env),
+            project_name=self.stack_name,
+        )
+
+    def run(self, cli_args=None, command=None, logger=None, **kwargs):
+        raise error.DockerCommandFailed("Stub engine can't run docker commands")
+
+
+# =====================================================================
+# Synthetic projects
+# =====================================================================
+
+
+def gen_tags(depth):
+    "Return a list of `depth` tags, alternating jsonnet and compose tags"
+
+    tags = []
+    for idx in range(depth):
+        if idx % 2 == 0 and idx // 2 < len(PLUGIN_TAGS):
+            tags.append(PLUGIN_TAGS[idx // 2])
+        else:
+            tags.append(f"extra{idx}")
+    return tags
+
+
+def gen_project(root, stacks, depth):
+    "Generate a synthetic project with `stacks` stacks of `depth` tags"
+
+    os.makedirs(root, exist_ok=True)
+    tags = gen_tags(depth)
+
+    config_vars = {f"bench_global_{idx}": f"value_{idx}" for idx in range(VARS_GLOBAL)}
+    stack_list = []
+    for num in range(stacks):
+        name = f"stack{num:04d}"
+        stack_vars = {
+            f"bench_stack_{idx}": f"${{bench_global_{idx}}}_{name}"
+            for idx in range(VARS_PER_STACK)
+        }
+        stack_list.append({"name": name, "vars": stack_vars, "tags": tags})
+
+        # Stack compose files
+        stack_dir = os.path.join(root, name)
+        os.makedirs(stack_dir, exist_ok=True)
+        compose = {
+            "services": {
+                "app": {
+                    "image": "nginx:latest",
+                    "environment": {
+                        f"BENCH_{idx}": f"${{bench_stack_{idx}}}"
+                        for idx in range(VARS_PER_STACK)
+                    },
+                    "labels": [f"bench.stack={name}"],
+                }
+            }
+        }
+        write_yaml(os.path.join(stack_dir, "docker-compose.yml"), compose)
+
+        for tag in tags:
+            if tag in PLUGIN_TAGS:
+                continue
+            override = {
+                "services": {
+                    "app": {
+                        "environment": {f"BENCH_{tag.upper()}": "${bench_global_0}"},
+                        "labels": [f"bench.tag={tag}"],
+                    }
+                }
+            }
+            write_yaml(
+                os.path.join(stack_dir, f"docker-compose.{tag}.yml"), override
+            )
+
+        write_yaml(
+            os.path.join(stack_dir, "vars.yml"),
+            {"bench_file_var": f"from_file_{name}"},
+        )
+
+    config = {
+        "config": {"namespace": "bench", "vars": config_vars},
+        "stacks": stack_list,
+    }
+    write_yaml(os.path.join(root, "paasify.yml"), config)
+    return root
+
+
+def write_yaml(path, payload):
+    "Write payload as yaml file"
+
+    with open(path, "w", encoding="utf-8") as _file:
+        yaml.safe_dump(payload, _file, sort_keys=False)
+
+
+# =====================================================================
+# Measures
+# =====================================================================
+
+
+def reset_memory_peak():
+    "Reset traced memory peak, tracing is restarted on python < 3.9"
+
+    if hasattr(tracemalloc, "reset_peak"):
+        tracemalloc.reset_peak()
+    else:
+        tracemalloc.stop()
+        tracemalloc.start()
+
+
+class PhaseRecorder:
+    "Record duration and peak memory of named phases"
+
+    def __init__(self, memory=True):
+        self.memory = memory
+        self.phases = {}
+
+    @contextmanager
+    def phase(self, name):
+        "Measure a phase, durations of phases with the same name are added"
+
+        if self.memory:
+            reset_memory_peak()
+            start_mem = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start
+            record = self.phases.setdefault(name, {"time": 0.0, "peak_mem": 0})
+            record["time"] += duration
+            if self.memory:
+                peak = tracemalloc.get_traced_memory()[1] - start_mem
+                record["peak_mem"] = max(record["peak_mem"], peak)
+
+
+def run_project(root, memory=True):
+    "Run all phases on a project, return phase records"
+
+    rec = PhaseRecorder(memory=memory)
+
+    with rec.phase("load"):
+        psf = PaasifyApp(payload={"config": {"root_hint": root}})
+        prj = psf.load_project()
+        prj.engine_cls = EngineStub
+        stacks = prj.stacks.get_children()
+
+    for stack in stacks:
+        with rec.phase("tag_plan"):
+            all_tags = stack.get_tag_plan()
+        with rec.phase("stack_vars"):
+            sta = StackAssembler(parent=stack, ident=f"Bench.{stack.stack_name}")
+            stack.get_stack_vars(sta, all_tags)
+
+    for stack in stacks:
+        with rec.phase("assemble"):
+            stack.assemble(use_cache=False)
+
+    return rec.phases
+
+
+def run_benchmark(sizes, depths, workdir, memory=True):
+    "Run benchmark over all sizes and depths"
+
+    results = []
+    if memory:
+        tracemalloc.start()
+
+    for depth in depths:
+        for size in sizes:
+            root = os.path.join(workdir, f"prj_{size}_{depth}")
+            gen_project(root, size, depth)
+            log.info(f"Benchmark {size} stacks with {depth} tags")
+            phases = run_project(root, memory=memory)
+            results.append({"stacks": size, "depth": depth, "phases": phases})
+            print_result(results[-1])
+
+    if memory:
+        tracemalloc.stop()
+
+    return {
+        "meta": {
+            "paasify_version": __version__,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": results,
+    }
+
+
+def gen_compose(services):
+    "Return a compose payload of `services` services, as docker would output"
+
+    payload = {"name": "bench", "services": {}, "networks": {}}
+    for num in range(services):
+        name = f"svc{num:05d}"
+        payload["services"][name] = {
+            "image": "nginx:latest",
+            "environment": {f"BENCH_{idx}": f"value_{idx}" for idx in range(20)},
+            "labels": {
+                f"traefik.http.routers.{name}.rule": f"Host(`{name}.bench.local`)",
+                f"traefik.http.services.{name}.loadbalancer.server.port": "80",
+            },
+            "networks": {"default": None, f"net{num % 10}": {"aliases": [name]}},
+            "volumes": [
+                {"type": "bind", "source": f"/data/{name}", "target": "/data"}
+            ],
+        }
+    for num in range(10):
+        payload["networks"][f"net{num}"] = {"name": f"bench_net{num}"}
+    payload["networks"]["default"] = {"name": "bench_default"}
+    return payload
+
+
+def best_of(func, rounds):
+    "Return the best duration of func over rounds"
+
+    best = None
+    for _ in range(rounds):
+        start = time.perf_counter()
+        func()
+        duration = time.perf_counter() - start
+        best = duration if best is None else min(best, duration)
+    return best
+
+
+def run_yaml_benchmark(services, rounds=3):
+    "Compare yaml load and dump durations of pure Python and libyaml"
+
+    payload = gen_compose(services)
+    impls = {"python": (yaml.SafeLoader, YAML_PY_DUMPER)}
+    if LIBYAML:
+        impls["libyaml"] = (yaml.CSafeLoader, YAML_DUMPER)
+
+    text = to_yaml(payload, dumper=YAML_PY_DUMPER)
+    results = {}
+    for name, (loader, dumper) in impls.items():
+        results[name] = {
+            "load": best_of(lambda: from_yaml(text, loader=loader), rounds),
+            "dump": best_of(lambda: to_yaml(payload, dumper=dumper), rounds),
+        }
+        assert to_yaml(payload, dumper=dumper) == text
+        assert from_yaml(text, loader=loader) == payload
+
+    return {"services": services, "bytes": len(text), "results": results}
+
+
+STARTUP_CASES = {
+    "version": "sys.argv = ['paasify', '--version']\nfrom paasify.main import app\napp()",
+    "import_cli": "import paasify.cli",
+}
+
+
+def run_startup_benchmark(rounds=5):
+    "Return the best CLI startup durations, measured in fresh interpreters"
+
+    results = {}
+    for name, code in STARTUP_CASES.items():
+        script = (
+            "import sys, time\n"
+            "start = time.perf_counter()\n"
+            "try:\n"
+            f"{textwrap.indent(code, '    ')}\n"
+            "except SystemExit:\n"
+            "    pass\n"
+            "print(time.perf_counter() - start)\n"
+        )
+        durations = []
+        for _ in range(rounds):
+            out = subprocess.run(
+                [sys.executable, "-c", script], capture_output=True, check=True
+            )
+            durations.append(float(out.stdout.decode("utf-8").splitlines()[-1]))
+        results[name] = min(durations)
+    return results
+
+
+# =====================================================================
+# Reports
+# =====================================================================
+
+
+def print_result(result):
+    "Print one benchmark result"
+
+    for name, rec in result["phases"].items():
+        per_stack = rec["time"] / result["stacks"] * 1000
+        print(
+            f"  {result['stacks'] :>5} stacks {result['depth'] :>2} tags  {name :<12}"
+            f" {rec['time'] :>9.3f}s {per_stack :>9.2f}ms/stack"
+            f" {rec['peak_mem'] / 1024 / 1024 :>9.2f}MB"
+        )
+
+
+def print_yaml_result(report):
+    "Print yaml benchmark result"
+
+    ref = report["results"]["python"]
+    print(f"  {report['services']} services, {report['bytes'] / 1024 :.0f}KB of yaml")
+    for name, rec in report["results"].items():
+        print(
+            f"  {name :<8} load {rec['load'] :>8.3f}s (x{ref['load'] / rec['load'] :.1f})"
+            f"  dump {rec['dump'] :>8.3f}s (x{ref['dump'] / rec['dump'] :.1f})"
+        )
+
+
+def print_startup_result(results):
+    "Print startup benchmark result"
+
+    for name, duration in results.items():
+        print(f"  {name :<12} {duration * 1000 :>9.1f}ms")
+
+
+def compare(report, baseline, tolerance):
+    "Return the list of phases slower than baseline"
+
+    ref = {(x["stacks"], x["depth"]): x["phases"] for x in baseline["results"]}
+    regressions = []
+    for result in report["results"]:
+        phases = ref.get((result["stacks"], result["depth"]))
+        if not phases:
+            continue
+        for name, rec in result["phases"].items():
+            old = phases.get(name)
+            if not old or old["time"] <= 0:
+                continue
+            ratio = rec["time"] / old["time"]
+            if ratio > 1 + tolerance:
+                regressions.append(
+                    f"{result['stacks']} stacks, {result['depth']} tags, {name}:"
+                    f" {old['time']:.3f}s -> {rec['time']:.3f}s (x{ratio:.2f})"
+                )
+    return regressions
+
+
+def parse_ints(value):
+    "Parse a comma separated list of integers"
+    return [int(x) for x in value.split(",") if x]
+
+
+def main():
+    "Run benchmark from command line"
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--sizes", type=parse_ints, default=[1, 10, 100, 1000])
+    parser.add_argument("--depths", type=parse_ints, default=[1, 3])
+    parser.add_argument("--workdir", help="Keep generated projects in this dir")
+    parser.add_argument("--output", help="Write json report to file")
+    parser.add_argument("--baseline", help="Compare against a json report")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument(
+        "--yaml",
+        type=int,
+        metavar="SERVICES",
+        help="Only benchmark yaml I/O on a compose output of SERVICES services",
+    )
+    parser.add_argument(
+        "--startup",
+        type=int,
+        metavar="ROUNDS",
+        help="Only benchmark CLI startup, best of ROUNDS runs",
+    )
+    parser.add_argument(
+        "--no-memory",
+        action="store_true",
+        help="Disable memory tracing, which slows down measures",
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    logging.getLogger("paasify.cli").setLevel(logging.WARNING)
+
+    if args.startup:
+        print_startup_result(run_startup_benchmark(args.startup))
+        return
+
+    if args.yaml:
+        if not LIBYAML:
+            log.warning("PyYAML is not built with libyaml, only pure Python is measured")
+        print_yaml_result(run_yaml_benchmark(args.yaml))
+        return
+
+    with tempfile.TemporaryDirectory(prefix="paasify_bench_") as tmpdir:
+        workdir = args.workdir or tmpdir
+        report = run_benchmark(
+            args.sizes, args.depths, workdir, memory=not args.no_memory
+        )
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as _file:
+            json.dump(report, _file, indent=2)
+        log.info(f"Report written in: {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as _file:
+            baseline = json.load(_file)
+        regressions = compare(report, baseline, args.tolerance)
+        for line in regressions:
+            log.error(f"Regression: {line}")
+        if regressions:
+            sys.exit(1)
+        log.info("No regression found")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,64 @@
 #!/usr/bin/env pytest
 # -*- coding: utf-8 -*-
 
+import io
 import os
+import sys
+import json
+import struct
+import time
+import threading
+import subprocess
+import socketserver
+import http.server
+from urllib.parse import urlparse, parse_qs
+import importlib.util
 from pprint import pprint
 import logging
 
 import pytest
 
 import yaml
+import ruamel.yaml
 from typer.testing import CliRunner
 
 from paasify.cli import cli_app
 from paasify.app2 import PaasifyApp
 import paasify.errors as error
 
-from paasify.common import get_paasify_pkg_dir
+from paasify.common import (
+    get_paasify_pkg_dir,
+    lookup_candidates,
+    compile_template,
+    multiplex,
+    DirIndex,
+)
+from paasify.cache import (
+    JsonnetCache,
+    ParsedFileCache,
+    jsonnet_imports,
+    write_if_changed,
+    extract_env_refs,
+    hash_payload,
+)
+from paasify.stack_components import StackAssembler, VarsManager
+from paasify.workers import JsonnetWorkerPool
+from paasify.compose import (
+    compose_config,
+    compose_heads,
+    interpolate_string,
+    normalize_project_name,
+)
+from paasify.yaml_io import (
+    YAML_PY_DUMPER,
+    YAML_WIDTH,
+    from_yaml,
+    to_yaml,
+    load_yaml_file,
+)
+import paasify.engines as engines
+import paasify.docker_api as docker_api
+from paasify.profiler import Profiler, profiler
 
 
 # Test cli
@@ -41,6 +85,61 @@ def test_cli_info_with_project():
     assert result.exit_code == 0
 
 
+CLI_HEAVY_MODULES = [
+    "yaml",
+    "sh",
+    "anyconfig",
+    "_jsonnet",
+    "semver",
+    "giturlparse",
+    "json_schema_for_humans",
+    "cafram",
+    "paasify.app2",
+]
+
+
+def _import_report(code):
+    "Run code in a fresh interpreter, return its loaded modules"
+
+    script = "import sys, json\n" f"{code}\n" "print(json.dumps(sorted(sys.modules)))\n"
+    out = subprocess.run(
+        [sys.executable, "-c", script], cwd=cwd, capture_output=True, check=True
+    )
+    return json.loads(out.stdout.decode("utf-8").splitlines()[-1])
+
+
+def _imported(modules, names):
+    "Return names that are imported, with their submodules"
+
+    return [
+        name
+        for name in names
+        if any(x == name or x.startswith(f"{name}.") for x in modules)
+    ]
+
+
+def test_cli_import_budget():
+    "Ensure CLI startup does not import heavy modules"
+
+    # Version fast path only loads the version module
+    modules = _import_report(
+        "sys.argv = ['paasify', '--version']\n"
+        "from paasify.main import app\n"
+        "app()"
+    )
+    assert [x for x in modules if x.startswith("paasify")] == [
+        "paasify",
+        "paasify.main",
+        "paasify.version",
+    ]
+    assert _imported(modules, ["_jsonnet", "sh", "ruamel", "paasify.stacks2"]) == []
+
+    # CLI module defers heavy imports to commands, timings are measured by
+    # `scripts/benchmark.py --startup`
+    modules = _import_report("import paasify.cli")
+    assert _imported(modules, CLI_HEAVY_MODULES) == []
+
+
 # Test stacks basics
 # ------------------------
 
@@ -132,6 +231,9 @@ def load_yaml_file_hierarchy(dir):
     files = []
 
     for (dirpath, dirnames, filenames) in os.walk(dir):
+        # Skip build caches
+        if "cache" in dirnames and os.path.basename(dirpath) == ".paasify":
+            dirnames.remove("cache")
         for file in filenames:
             files.append(os.path.join(dirpath, file))
             # files.append([dirpath, file])
@@ -162,6 +264,1257 @@ def load_yaml_file_hierarchy(dir):
     return results
 
 
+def test_dir_index(tmp_path):
+    "Ensure directory index lists each directory once"
+
+    (tmp_path / "docker-compose.yml").write_text("")
+    (tmp_path / "vars.yml").mkdir()
+
+    index = DirIndex()
+    lookup = [
+        {"path": str(tmp_path), "pattern": ["docker-compose.yml", "vars.yml"]},
+        {"path": str(tmp_path / "missing"), "pattern": ["docker-compose.yml"]},
+    ]
+    for _ in range(3):
+        result = lookup_candidates(lookup, index=index)
+        assert result[0]["matches"] == [str(tmp_path / "docker-compose.yml")]
+        assert result[1]["matches"] == []
+    assert index.scans == 2
+
+    # Same result without index
+    assert lookup_candidates(lookup) == result
+
+
+def test_stacks_dir_index():
+    "Ensure project lookups list each directory once"
+
+    root_prj = cwd + "/tests/examples/var_merge"
+    psf = PaasifyApp(payload={"config": {"root_hint": root_prj}})
+    prj = psf.load_project()
+    for stack in prj.stacks.get_children():
+        stack.get_tag_plan()
+        stack.get_assemble_fingerprint(stack.get_tag_plan())
+
+    scans = prj.dir_index.scans
+    for stack in prj.stacks.get_children():
+        stack.get_assemble_fingerprint(stack.get_tag_plan())
+    assert prj.dir_index.scans == scans
+
+
+# Test assemble cache
+# ------------------------
+def test_cache_fingerprint_helpers(tmp_path):
+    "Ensure fingerprint helpers detect imports and env references"
+
+    lib = tmp_path / "lib.libsonnet"
+    lib.write_text("{}")
+    plugin = tmp_path / "plugin.jsonnet"
+    plugin.write_text("local lib = import 'lib.libsonnet';\nlib")
+
+    assert jsonnet_imports(str(plugin)) == [str(lib)]
+    assert extract_env_refs("a: ${_env_USER}\nb: $_env_HOME ${var}") == ["HOME", "USER"]
+    assert hash_payload({"a": 1, "b": 2}) == hash_payload({"b": 2, "a": 1})
+
+
+def test_stacks_assemble_cache():
+    "Ensure unchanged stacks are not rebuilt"
+
+    app_conf = {
+        "config": {
+            "root_hint": cwd + "/tests/examples/var_merge",
+        }
+    }
+    psf = PaasifyApp(payload=app_conf)
+    prj = psf.load_project()
+    stack = prj.stacks.get_children()[0]
+
+    assert stack.assemble(use_cache=False) is True
+    assert stack.assemble() is False
+
+    # Output file changes must invalidate cache
+    os.remove(os.path.join(stack.stack_path, "docker-compose.run.yml"))
+    assert stack.assemble() is True
+
+
+def test_stacks_assemble_fingerprint_inputs(monkeypatch):
+    "Ensure docker compose version and compose .env file change the fingerprint"
+
+    monkeypatch.setattr(
+        engines.EngineDetect, "detect", lambda self, engine=None: engines.EngineComposeV2
+    )
+    monkeypatch.setattr(engines.EngineComposeV2, "compose_version", "2.12.2")
+
+    psf = PaasifyApp(payload={"config": {"root_hint": cwd + "/tests/examples/var_merge"}})
+    prj = psf.load_project()
+    stack = [x for x in prj.stacks.get_children() if x.stack_name == "app1"][0]
+    all_tags = stack.get_tag_plan()
+    base = stack.get_assemble_fingerprint(all_tags)
+
+    monkeypatch.setattr(engines.EngineComposeV2, "compose_version", "2.20.0")
+    assert stack.get_assemble_fingerprint(all_tags) != base
+    monkeypatch.setattr(engines.EngineComposeV2, "compose_version", "2.12.2")
+    assert stack.get_assemble_fingerprint(all_tags) == base
+
+    docker_file = [x["docker_file"] for x in all_tags if x.get("docker_file")][0]
+    env_file = os.path.join(os.path.dirname(docker_file), ".env")
+    try:
+        write_file(env_file, "APP_MODE=dotenv\n")
+        assert stack.get_assemble_fingerprint(all_tags) != base
+    finally:
+        os.remove(env_file)
+
+
+def test_write_if_changed(tmp_path):
+    "Ensure files are only rewritten when content changes"
+
+    path = str(tmp_path / "docker-compose.run.yml")
+    assert write_if_changed(path, "services: {}\n") is True
+    os.chmod(path, 0o640)
+    mtime = os.stat(path).st_mtime_ns
+
+    assert write_if_changed(path, "services: {}\n") is False
+    assert os.stat(path).st_mtime_ns == mtime
+
+    assert write_if_changed(path, "services:\n  app: {}\n") is True
+    assert os.stat(path).st_mode & 0o777 == 0o640
+    assert os.listdir(tmp_path) == ["docker-compose.run.yml"]
+
+
+def test_stacks_assemble_unchanged_run_file():
+    "Ensure identical run files are not rewritten"
+
+    app_conf = {
+        "config": {
+            "root_hint": cwd + "/tests/examples/var_merge",
+        }
+    }
+    psf = PaasifyApp(payload=app_conf)
+    prj = psf.load_project()
+    stack = prj.stacks.get_children()[0]
+    outfile = os.path.join(stack.stack_path, "docker-compose.run.yml")
+
+    stack.assemble(use_cache=False)
+    mtime = os.stat(outfile).st_mtime_ns
+    assert stack.assemble(use_cache=False) is True
+    assert stack.run_file_changed is False
+    assert os.stat(outfile).st_mtime_ns == mtime
+
+    os.remove(outfile)
+    stack.assemble(use_cache=False)
+    assert stack.run_file_changed is True
+
+
+def test_stacks_run_file_applied():
+    "Ensure the run file path is usable to assemble and track applied stacks"
+
+    psf = PaasifyApp(payload={"config": {"root_hint": cwd + "/tests/examples/var_merge"}})
+    prj = psf.load_project()
+    stack = prj.stacks.get_children()[0]
+    assert stack.run_file == os.path.join(stack.stack_path, "docker-compose.run.yml")
+
+    stack.assemble(use_cache=False)
+    assert os.path.isfile(stack.run_file)
+
+    cache = stack.get_assemble_cache()
+    cache.clear_applied()
+    assert stack.is_applied() is False
+    cache.save_applied(stack.run_file)
+    assert stack.is_applied() is True
+    cache.clear_applied()
+
+
+def test_stacks_apply_changed_only(monkeypatch):
+    "Ensure apply only starts stacks whose run file changed since last start"
+
+    started = []
+    monkeypatch.setattr(
+        engines.EngineDetect, "detect", lambda self, engine=None: engines.EngineComposeV2
+    )
+    monkeypatch.setattr(
+        engines.EngineCompose, "up", lambda self, **kwargs: started.append(self.stack_name)
+    )
+    monkeypatch.setattr(engines.EngineCompose, "down", lambda self, **kwargs: None)
+
+    psf = PaasifyApp(payload={"config": {"root_hint": cwd + "/tests/examples/var_merge"}})
+    prj = psf.load_project()
+    stacks = prj.stacks.get_children()
+    for stack in stacks:
+        stack.engine.compose_merge = "native"
+    names = [stack.engine.stack_name for stack in stacks]
+
+    # Stopped stacks are always started
+    prj.stacks.cmd_stack_down()
+    prj.stacks.cmd_stack_apply(changed_only=True)
+    assert started == names
+
+    started.clear()
+    prj.stacks.cmd_stack_apply(changed_only=True)
+    assert started == []
+
+    prj.stacks.cmd_stack_down(stacks=[stacks[0]])
+    prj.stacks.cmd_stack_apply(changed_only=True)
+    assert started == names[:1]
+
+    # Default mode starts all stacks
+    started.clear()
+    prj.stacks.cmd_stack_apply()
+    assert started == names
+
+
+def gen_waves_project(root, stacks):
+    "Generate a project with stacks, as (name, depends_on, networks) tuples"
+
+    os.makedirs(root)
+    config = {"config": {"namespace": "wave"}, "stacks": []}
+    for name, depends_on, networks in stacks:
+        config["stacks"].append({"name": name, "depends_on": depends_on})
+        os.makedirs(os.path.join(root, name))
+        payload = {"name": f"wave_{name}", "networks": networks, "services": {}}
+        for file in ["docker-compose.yml", "docker-compose.run.yml"]:
+            with open(os.path.join(root, name, file), "w", encoding="utf-8") as _file:
+                yaml.safe_dump(payload, _file)
+    with open(os.path.join(root, "paasify.yml"), "w", encoding="utf-8") as _file:
+        yaml.safe_dump(config, _file)
+
+    psf = PaasifyApp(payload={"config": {"root_hint": root}})
+    return psf.load_project()
+
+
+def test_stacks_waves(tmp_path):
+    "Ensure stacks are started by dependency waves, and stopped in reverse"
+
+    traefik = {"traefik": {"name": "wave_traefik"}}
+    prj = gen_waves_project(
+        str(tmp_path / "prj"),
+        [
+            ("app", [], {"traefik": {"external": True, "name": "wave_traefik"}}),
+            ("web", ["db"], {}),
+            ("proxy", [], traefik),
+            ("db", [], {"default": None}),
+            ("misc", [], {}),
+        ],
+    )
+    stacks = prj.stacks.get_children()
+    assert prj.stacks.get_stack_deps(stacks) == {
+        "app": ["proxy"],
+        "web": ["db"],
+        "proxy": [],
+        "db": [],
+        "misc": [],
+    }
+    waves = prj.stacks.get_waves(stacks)
+    assert [[stack.stack_name for stack in wave] for wave in waves] == [
+        ["proxy", "db", "misc"],
+        ["app", "web"],
+    ]
+
+    calls = []
+    prj.stacks._run_waves(stacks, lambda stack, fg: calls.append(stack.stack_name), jobs=3)
+    assert set(calls[:3]) == {"proxy", "db", "misc"}
+    assert set(calls[3:]) == {"app", "web"}
+
+    calls.clear()
+    prj.stacks._run_waves(
+        stacks, lambda stack, fg: calls.append(stack.stack_name), reverse=True
+    )
+    assert calls == ["web", "app", "misc", "db", "proxy"]
+
+    # Loops are reported
+    prj = gen_waves_project(
+        str(tmp_path / "loop"), [("a", ["b"], {}), ("b", ["a"], {}), ("c", [], {})]
+    )
+    with pytest.raises(error.StackCircularDependency, match="a, b"):
+        prj.stacks.get_waves(prj.stacks.get_children())
+
+
+def test_stacks_assemble_parallel():
+    "Ensure stacks can be assembled concurrently"
+
+    app_conf = {
+        "config": {
+            "root_hint": cwd + "/tests/examples/var_merge",
+        }
+    }
+    psf = PaasifyApp(payload=app_conf)
+    prj = psf.load_project()
+    prj.stacks.cmd_stack_assemble(no_cache=True, jobs=4)
+
+    for stack in prj.stacks.get_children():
+        assert os.path.isfile(os.path.join(stack.stack_path, "docker-compose.run.yml"))
+
+
+def test_stacks_vars_memoized():
+    "Ensure jsonnet tag vars are only processed when their context change"
+
+    app_conf = {
+        "config": {
+            "root_hint": cwd + "/tests/examples/var_merge",
+        }
+    }
+    psf = PaasifyApp(payload=app_conf)
+    prj = psf.load_project()
+    stack = [x for x in prj.stacks.get_children() if x.stack_name == "test_devel"][0]
+
+    sta = StackAssembler(parent=stack, ident="StackAssembler.test")
+    all_tags = stack.get_tag_plan()
+    base = stack.get_stack_vars(sta, all_tags)
+    memo_size = len(sta.vars_memo)
+
+    assert stack.get_stack_vars(sta, all_tags) == base
+    assert len(sta.vars_memo) == memo_size
+
+    tagged = stack.get_stack_vars(sta, all_tags, extra_user_vars={"app_name": "other"})
+    assert tagged["app_name"] == "other"
+    assert base["app_name"] != "other"
+
+
+def test_vars_manager_store():
+    "Ensure vars keep adding order and last defined var win"
+
+    vars_ = VarsManager(parent=None, ident="VarsManager.test")
+    vars_.add_as_dict({"var1": "a", "var2": "${var1}_b"})
+    vars_.add_as_key("var3", 3)
+    vars_.add_as_dict({"var1": "c"})
+
+    assert list(vars_.render_as_dict()) == ["var1", "var2", "var3"]
+    assert vars_.render_as_dict() == {"var1": "c", "var2": "${var1}_b", "var3": 3}
+    assert vars_.render_as_dict(parse=True)["var2"] == "c_b"
+
+    # Nodes are only created on demand
+    nodes = vars_.get_vars_list()
+    assert [(x.name, x.value) for x in nodes][-1] == ("var1", "c")
+
+    # Nodes and entries can be mixed
+    other = VarsManager(parent=None, ident="VarsManager.test2")
+    other.add_as_list(nodes)
+    assert other.render_as_dict() == vars_.render_as_dict()
+
+
+def test_vars_manager_templates(monkeypatch):
+    "Ensure templates are parsed once and dynamic vars use an overlay"
+
+    monkeypatch.setenv("PAASIFY_TEST_VAR", "from_env")
+    vars_ = VarsManager(parent=None, ident="VarsManager.test")
+    env = {"var1": "a"}
+
+    tpl1, ids = compile_template("${var1}_${_env_PAASIFY_TEST_VAR}")
+    tpl2, _ = compile_template("${var1}_${_env_PAASIFY_TEST_VAR}")
+    assert tpl1 is tpl2
+    assert ids == ("var1", "_env_PAASIFY_TEST_VAR")
+
+    assert vars_.template_value(tpl1.template, env) == "a_from_env"
+    assert vars_.template_value("$$var1 ${missing}", env) == "$$var1 ${missing}"
+    assert vars_.template_value("$$var1", env) == "$var1"
+    assert vars_.template_value(42, env) == 42
+    assert env == {"var1": "a"}
+
+
+def test_vars_manager_resolve_order():
+    "Ensure vars are resolved by dependencies and cycles are detected"
+
+    vars_ = VarsManager(parent=None, ident="VarsManager.test")
+    vars_.add_as_dict(
+        {
+            "url": "${proto}://${domain}",
+            "domain": "${name}.localhost",
+            "proto": "https",
+            "name": "app",
+            "unused": "${name}",
+        }
+    )
+    result = vars_.render_as_dict(parse=True)
+    assert list(result) == ["url", "domain", "proto", "name", "unused"]
+    assert result["url"] == "https://app.localhost"
+    assert vars_.get_unused_vars() == ["url", "unused"]
+    assert vars_.get_unused_vars(refs=["url"]) == ["unused"]
+
+    # Cycles raise clear errors
+    vars_.add_as_dict({"name": "${url}"})
+    with pytest.raises(error.VarCircularReference, match="url -> domain -> name -> url"):
+        vars_.render_as_dict(parse=True)
+
+
+def test_vars_manager_self_extension():
+    "Ensure a var can extend its inherited value"
+
+    vars_ = VarsManager(parent=None, ident="VarsManager.test")
+    vars_.add_as_dict({"opts": "-v", "tag": "latest", "app": "web"})
+    vars_.add_as_dict({"opts": "${opts} --name ${app}", "tag": "${tag}-dev"})
+    vars_.add_as_dict({"opts": "${opts} -d", "app": "${prefix}api", "prefix": "x-"})
+    result = vars_.render_as_dict(parse=True)
+    assert result["opts"] == "-v --name x-api -d"
+    assert result["tag"] == "latest-dev"
+    assert "opts" in vars_.get_unused_vars()
+
+    # Without inherited value, the reference is left as is
+    vars_ = VarsManager(parent=None, ident="VarsManager.test")
+    vars_.add_as_dict({"name": "${name}-suffix"})
+    assert vars_.render_as_dict(parse=True) == {"name": "${name}-suffix"}
+
+
+def test_stacks_unused_vars():
+    "Ensure unused user vars are reported"
+
+    root_prj = cwd + "/tests/examples/var_merge"
+    psf = PaasifyApp(payload={"config": {"root_hint": root_prj}})
+    prj = psf.load_project()
+    stacks = {stack.stack_name: stack for stack in prj.stacks.get_children()}
+
+    unused = stacks["test_devel"].get_unused_vars()
+    assert "var_base1" in unused
+    assert "custom_from_var1" not in unused
+    assert "app_name" not in unused
+
+
+def test_parsed_file_cache(tmp_path):
+    "Ensure files are parsed once until they change"
+
+    path = tmp_path / "vars.yml"
+    path.write_text("var1: value1\n")
+
+    cache = ParsedFileCache(parent=None, ident="ParsedFileCache")
+    assert cache.load(str(path)) == {"var1": "value1"}
+    assert cache.load(str(path)) is cache.load(str(path))
+    assert (cache.hits, cache.misses) == (2, 1)
+
+    path.write_text("var1: value2\n")
+    os.utime(path, ns=(0, 0))
+    assert cache.load(str(path)) == {"var1": "value2"}
+    assert cache.misses == 2
+
+
+def test_stacks_vars_files_parsed_once():
+    "Ensure vars files shared by stacks are parsed once per project"
+
+    root_prj = cwd + "/tests/examples/var_merge"
+    psf = PaasifyApp(payload={"config": {"root_hint": root_prj}})
+    prj = psf.load_project()
+    prj.stacks.cmd_stack_assemble(no_cache=True)
+
+    file_cache = prj.file_cache
+    assert file_cache.hits > 0
+    assert file_cache.misses == len(file_cache._entries)
+
+
+def test_compose_heads(tmp_path):
+    "Ensure services and networks names are extracted without full parsing"
+
+    path = tmp_path / "docker-compose.yml"
+    path.write_text(
+        "x-common: &common\n"
+        "  image: nginx\n"
+        "  labels: {a: [1, {b: 2}]}\n"
+        "services:\n"
+        "  web:\n"
+        "    <<: *common\n"
+        "  db: {image: postgres}\n"
+        "volumes: {data: {}}\n"
+    )
+    assert compose_heads(str(path)) == {"services": ["web", "db"], "networks": None}
+
+    # Compare with full parsing on examples
+    for file in [
+        cwd + "/tests/examples/var_merge/app3/docker-compose.yml",
+        cwd + "/tests/examples/var_merge/test_devel/docker-compose.override.yml",
+    ]:
+        with open(file, encoding="utf-8") as _file:
+            content = yaml.safe_load(_file)
+        expected = {
+            key: list(content[key]) if isinstance(content.get(key), dict) else None
+            for key in ["services", "networks"]
+        }
+        assert compose_heads(file) == expected
+
+
+def test_compose_interpolate_string():
+    "Ensure compose interpolation handles escapes and bare '$'"
+
+    env = {"NAME": "app", "EMPTY": ""}
+    assert interpolate_string("$NAME-${NAME}", env) == "app-app"
+    assert interpolate_string("${EMPTY:-def} ${MISSING-def}", env) == "def def"
+    assert interpolate_string("$$NAME", env) == "$NAME"
+
+    # Bare '$' are kept as is
+    assert interpolate_string("cost $5", env) == "cost $5"
+    assert interpolate_string("trailing $", env) == "trailing $"
+    assert interpolate_string("$ $-$NAME", env) == "$ $-app"
+
+    with pytest.raises(error.DockerBuildConfig, match="missing '}'"):
+        interpolate_string("${NAME", env)
+
+
+def test_compose_config_normalize(tmp_path):
+    "Ensure native compose merge resolves short syntaxes and relative paths"
+
+    (tmp_path / "web.env").write_text("MODE=file\nLEVEL=file\n")
+    (tmp_path / "docker-compose.yml").write_text(
+        "services:\n"
+        "  web:\n"
+        "    build: ./src\n"
+        "    ports: ['9000-9001:8000-8001', 3000]\n"
+        "    volumes:\n"
+        "      - {type: bind, source: ./conf, target: /conf}\n"
+        "      - /cache\n"
+        "    env_file: web.env\n"
+        "    environment: {LEVEL: explicit}\n"
+    )
+    conf = compose_config([str(tmp_path / "docker-compose.yml")], project_name="prj")
+    web = conf["services"]["web"]
+
+    assert web["build"] == {"context": str(tmp_path / "src")}
+    assert [(x["published"], x["target"]) for x in web["ports"][:2]] == [
+        ("9000", 8000),
+        ("9001", 8001),
+    ]
+    assert web["ports"][2] == {"mode": "ingress", "target": 3000, "protocol": "tcp"}
+    assert web["volumes"][0]["source"] == str(tmp_path / "conf")
+    assert web["volumes"][1] == {"type": "volume", "target": "/cache", "volume": {}}
+    assert web["env_file"] == [str(tmp_path / "web.env")]
+    assert web["environment"] == {"MODE": "file", "LEVEL": "explicit"}
+
+
+def baseline_to_yaml(obj):
+    "Dump obj like the former cafram to_yaml, based on ruamel, without folding"
+
+    ryaml = ruamel.yaml.YAML()
+    ryaml.version = (1, 1)
+    ryaml.default_flow_style = False
+    ryaml.explicit_start = True
+    ryaml.width = YAML_WIDTH
+    stream = io.StringIO()
+    ryaml.dump(obj, stream)
+    return stream.getvalue().split("\n", 2)[2]
+
+
+def test_yaml_io(tmp_path):
+    "Ensure yaml helpers parse safely and dump like the former formatter"
+
+    payload = {
+        "services": {
+            "web": {
+                "image": "nginx",
+                "ports": ["80:80"],
+                "env": None,
+                "environment": {"A": "yes", "B": "n", "C": "0755", "D": "1e3"},
+                "command": ["sh", "-c", "echo 'hello'\nexit 0", "'quoted'"],
+                "labels": ["traefik.http.routers.web.rule=Host(`é.local`)"],
+            },
+            "app": {"image": "app", "volumes": [], "deploy": {}},
+        },
+        "networks": {"default": None, "ext": {"external": True, "name": "n"}},
+        "name": "demo",
+        "x-num": 1.5,
+        "x-bool": True,
+        "x-long": {
+            "word": "x" * 100,
+            "words": " ".join(["word"] * 40),
+            "rule": "Host(`" + "a" * 90 + ".local`) || Host(`b.local`)",
+            "quoted": "- it's " + "y" * 90,
+            "scalars": ["-_", "._", "1.5e3", "0o17", "'" + "z " * 50],
+        },
+    }
+    text = to_yaml(payload)
+    assert text == baseline_to_yaml(payload)
+    assert "  default:\n" in text
+    assert f"  word: {'x' * 100}\n" in text
+    assert to_yaml(payload, dumper=YAML_PY_DUMPER) == text
+    assert from_yaml(text) == payload
+    assert from_yaml(text.encode("utf-8")) == payload
+
+    path = tmp_path / "docker-compose.yml"
+    path.write_text(text, encoding="utf-8")
+    assert load_yaml_file(str(path)) == payload
+
+    # Safe loaders only
+    with pytest.raises(yaml.YAMLError):
+        from_yaml("!!python/object/apply:os.system ['true']")
+
+
+def test_jsonnet_cache(tmp_path):
+    "Ensure jsonnet evaluations are cached in memory and on disk"
+
+    plugin = os.path.join(
+        get_paasify_pkg_dir(), "assets", "plugins", "docker-net-attach.jsonnet"
+    )
+
+    cache = JsonnetCache(parent=None, ident="JsonnetCache", cache_dir=str(tmp_path))
+    sta = StackAssembler(parent=None, ident="StackAssembler.test", jsonnet_cache=cache)
+    result = sta.jsonnet_low_api_call(plugin, "global_default", {})
+    assert result == {"docker_net_external": True}
+    assert sta.jsonnet_low_api_call(plugin, "global_default", {}) == result
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    # A new cache instance must reuse on disk results
+    cache = JsonnetCache(parent=None, ident="JsonnetCache", cache_dir=str(tmp_path))
+    sta = StackAssembler(parent=None, ident="StackAssembler.test", jsonnet_cache=cache)
+    assert sta.jsonnet_low_api_call(plugin, "global_default", {}) == result
+    assert (cache.hits, cache.misses) == (1, 0)
+
+    # Environment dependent results are only cached in memory
+    sta = StackAssembler(
+        parent=None,
+        ident="StackAssembler.test",
+        jsonnet_cache=cache,
+        jsonnet_persist=False,
+    )
+    entries = os.listdir(tmp_path / "jsonnet")
+    args = {"app_network": "secret_value"}
+    assert sta.jsonnet_low_api_call(plugin, "global_default", args) == result
+    assert sta.jsonnet_low_api_call(plugin, "global_default", args) == result
+    assert (cache.hits, cache.misses) == (2, 1)
+    assert os.listdir(tmp_path / "jsonnet") == entries
+
+
+def test_jsonnet_cache_prune(tmp_path):
+    "Ensure expired and least recently used disk entries are removed"
+
+    cache = JsonnetCache(
+        parent=None,
+        ident="JsonnetCache",
+        cache_dir=str(tmp_path),
+        max_age=3600,
+        max_entries=2,
+    )
+    now = time.time()
+    for idx, age in enumerate([10, 20, 30, 7200]):
+        cache.set(f"key{idx}", "{}")
+        os.utime(cache._disk_path(f"key{idx}"), (now - age, now - age))
+
+    # Reading an entry makes it recent
+    cache._lru.clear()
+    assert cache.get("key2") == "{}"
+
+    assert cache.prune() == 2
+    assert sorted(os.listdir(tmp_path / "jsonnet")) == ["key0.json", "key2.json"]
+    assert cache.prune() == 0
+
+
+def test_jsonnet_worker_pool():
+    "Ensure jsonnet workers return the same result as in-process evaluation"
+
+    plugin = os.path.join(
+        get_paasify_pkg_dir(), "assets", "plugins", "docker-net-attach.jsonnet"
+    )
+
+    pool = JsonnetWorkerPool(parent=None, ident="JsonnetWorkerPool", workers=1)
+    sta = StackAssembler(parent=None, ident="StackAssembler.test", jsonnet_pool=pool)
+    try:
+        result = sta.jsonnet_low_api_call(plugin, "global_default", {})
+    finally:
+        pool.shutdown()
+    assert result == {"docker_net_external": True}
+
+    # Disabled pool fallback to in-process
+    pool = JsonnetWorkerPool(parent=None, ident="JsonnetWorkerPool", workers=0)
+    sta = StackAssembler(parent=None, ident="StackAssembler.test", jsonnet_pool=pool)
+    assert sta.jsonnet_low_api_call(plugin, "global_default", {}) == result
+
+
+def test_jsonnet_worker_pool_timeout(tmp_path):
+    "Ensure a stuck evaluation only fails itself, other evaluations go on"
+
+    # Evaluations of fifos are blocked until they are written
+    ok_file = str(tmp_path / "ok.jsonnet")
+    stuck_file = str(tmp_path / "stuck.jsonnet")
+    slow_file = str(tmp_path / "slow.jsonnet")
+    with open(ok_file, "w", encoding="utf-8") as _file:
+        _file.write("{ ok: true }")
+    os.mkfifo(stuck_file)
+    os.mkfifo(slow_file)
+
+    pool = JsonnetWorkerPool(
+        parent=None, ident="JsonnetWorkerPool", workers=2, timeout=3
+    )
+    results = {}
+
+    def evaluate(key, file):
+        try:
+            results[key] = pool.evaluate(file, {})
+        except error.JsonnetBuildFailed as err:
+            results[key] = err
+
+    def start(*args):
+        thread = threading.Thread(target=evaluate, args=args)
+        thread.start()
+        return thread
+
+    try:
+        # Start both workers
+        for thread in [start("warm1", ok_file), start("warm2", ok_file)]:
+            thread.join()
+
+        stuck = start("stuck", stuck_file)
+        time.sleep(1)
+        slow = start("slow", slow_file)
+
+        stuck.join()
+        assert isinstance(results["stuck"], error.JsonnetBuildFailed)
+        with open(slow_file, "w", encoding="utf-8") as _file:
+            _file.write("{ done: true }")
+        slow.join()
+
+        assert json.loads(results["slow"]) == {"done": True}
+        assert pool.enabled
+        assert json.loads(pool.evaluate(ok_file, {})) == {"ok": True}
+    finally:
+        pool.shutdown()
+
+
+def test_project_shutdown_workers(tmp_path):
+    "Ensure jsonnet workers are stopped with the app"
+
+    ok_file = str(tmp_path / "ok.jsonnet")
+    with open(ok_file, "w", encoding="utf-8") as _file:
+        _file.write("{ ok: true }")
+
+    app_conf = {
+        "config": {
+            "root_hint": cwd + "/tests/examples/var_merge",
+            "jsonnet_workers": 1,
+        }
+    }
+    psf = PaasifyApp(payload=app_conf)
+    prj = psf.load_project()
+    pool = prj.jsonnet_pool
+    assert json.loads(pool.evaluate(ok_file, {})) == {"ok": True}
+    assert pool._executor is not None
+
+    psf.shutdown()
+    assert pool._executor is None
+
+
+def test_engine_detect_cache(tmp_path, monkeypatch):
+    "Ensure docker engine detection is cached until binaries change"
+
+    # Fake docker binary and command output
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    docker_bin = bin_dir / "docker"
+    docker_bin.write_text("#!/bin/sh\n")
+    docker_bin.chmod(0o755)
+    monkeypatch.setenv("PATH", str(bin_dir))
+
+    calls = []
+
+    class FakeOutput:
+        stdout = b"Docker Compose version v2.12.2\n"
+        stderr = b""
+
+    def fake_exec(command, cli_args=None, **kwargs):
+        calls.append([command] + list(cli_args or []))
+        return FakeOutput()
+
+    monkeypatch.setattr(engines, "_exec", fake_exec)
+    cache_file = str(tmp_path / "cache" / "engine.json")
+
+    # First detection runs docker, the second one use the cache
+    cls = engines.EngineDetect(cache_file=cache_file).detect()
+    assert cls.version == "2.0.0"
+    cls.compose_version = None
+    assert engines.EngineDetect(cache_file=cache_file).detect() is cls
+    assert cls.compose_version == "2.12.2"
+    assert len(calls) == 1
+
+    # Refresh and expired TTL force detection
+    engines.EngineDetect(cache_file=cache_file, refresh=True).detect()
+    engines.EngineDetect(cache_file=cache_file, ttl=-1).detect()
+    assert len(calls) == 3
+
+    # Changed binary invalidates the cache
+    os.utime(docker_bin, ns=(0, 0))
+    engines.EngineDetect(cache_file=cache_file).detect()
+    assert len(calls) == 4
+
+
+def test_engine_lazy_detection(monkeypatch):
+    "Ensure docker engine is only detected when a stack engine is used"
+
+    calls = []
+
+    def fake_detect(self, engine=None):
+        calls.append(engine)
+        return engines.EngineComposeV2
+
+    monkeypatch.setattr(engines.EngineDetect, "detect", fake_detect)
+
+    # Read-only commands do not detect engine
+    root_prj = cwd + "/tests/examples/var_merge"
+    psf = PaasifyApp(payload={"config": {"root_hint": root_prj}})
+    prj = psf.load_project()
+    prj.stacks.cmd_stack_ls()
+    stacks = prj.stacks.get_children()
+    assert calls == []
+    assert not any(stack.engine.resolved for stack in stacks)
+    assert stacks[0].engine.stack_name.startswith("var_merge_")
+
+    # Engine is detected once, on first use
+    assert isinstance(stacks[0].engine.resolve(), engines.EngineComposeV2)
+    assert stacks[1].engine.arg_prefix[0] == "compose"
+    assert len(calls) == 1
+    assert stacks[0].engine.resolved
+
+
+def test_stacks_native_assemble_without_docker(monkeypatch):
+    "Ensure native compose merge never detects the docker engine"
+
+    def fail_detect(self, engine=None):
+        raise AssertionError("Docker engine must not be detected")
+
+    monkeypatch.setattr(engines.EngineDetect, "detect", fail_detect)
+
+    psf = PaasifyApp(payload={"config": {"root_hint": cwd + "/tests/examples/var_merge"}})
+    prj = psf.load_project()
+    stack = prj.stacks.get_children()[0]
+    stack.engine.compose_merge = "native"
+
+    assert stack.assemble(use_cache=False) is True
+    assert os.path.isfile(stack.run_file)
+    assert not stack.engine.resolved
+
+
+def test_stacks_ps_batch(monkeypatch, capsys):
+    "Ensure processes of all stacks are fetched with a single docker query"
+
+    containers = [
+        {
+            "ID": "0123456789abcdef",
+            "Name": "var_merge_app1-app1-1",
+            "Project": "var_merge_app1",
+            "Service": "app1",
+            "State": "running",
+            "Ports": "0.0.0.0:8080->80/tcp, :::8080->80/tcp, 443/tcp",
+        },
+        {
+            "ID": "fedcba9876543210",
+            "Name": "other_app-app-1",
+            "Project": "other_app",
+            "Service": "app",
+            "State": "exited",
+            "Ports": "",
+        },
+    ]
+    calls = []
+
+    class FakeOutput:
+        def __init__(self, stdout):
+            self.stdout = stdout.encode("utf-8")
+            self.stderr = b""
+
+    def fake_exec(command, cli_args=None, **kwargs):
+        cli_args = list(cli_args or [])
+        calls.append([command] + cli_args)
+        if "compose" in cli_args:
+            return FakeOutput("[]")
+        return FakeOutput("\n".join([json.dumps(x) for x in containers]))
+
+    monkeypatch.setattr(
+        engines.EngineDetect, "detect", lambda self, engine=None: engines.EngineComposeV2
+    )
+    monkeypatch.setattr(engines, "_exec", fake_exec)
+
+    psf = PaasifyApp(payload={"config": {"root_hint": cwd + "/tests/examples/var_merge"}})
+    prj = psf.load_project()
+    stacks_count = len(prj.stacks.get_children())
+    prj.stacks.cmd_stack_ps(batch=True, output_json=True)
+    assert len(calls) == 1
+    assert calls[0][:2] == ["docker", "ps"]
+
+    result = json.loads(capsys.readouterr().out)
+    assert result["app1"] == [dict(containers[0], Ports=[":::8080->80/tcp"])]
+    assert [name for name, rows in result.items() if rows] == ["app1"]
+
+    # Table output
+    prj.stacks.cmd_stack_ps(batch=True)
+    assert capsys.readouterr().out.split() == [
+        "var_merge_app1",
+        "0123456789ab",
+        "var_merge_app1-app1-1",
+        "app1",
+        "running",
+        ":::8080->80/tcp",
+    ]
+
+    # Batch mode is opt-in, each stack is queried by default
+    calls.clear()
+    prj.stacks.cmd_stack_ps(output_json=True)
+    assert len(calls) == stacks_count
+    assert all("compose" in call for call in calls)
+    capsys.readouterr()
+
+    # Each stack is queried when no project matches the batch query
+    calls.clear()
+    containers.pop(0)
+    prj.stacks.cmd_stack_ps(batch=True, output_json=True)
+    assert len(calls) == 1 + stacks_count
+    assert not any(json.loads(capsys.readouterr().out).values())
+
+    # Project names are matched as normalized by compose
+    assert normalize_project_name("_My.Prj_App-1") == "myprj_app-1"
+
+
+FAKE_CONTAINERS = [
+    {
+        "Id": "a" * 64,
+        "Names": ["/var_merge_app1-app1-1"],
+        "Labels": {
+            "com.docker.compose.project": "var_merge_app1",
+            "com.docker.compose.service": "app1",
+        },
+        "State": "running",
+        "Ports": [
+            {"IP": "0.0.0.0", "PrivatePort": 80, "PublicPort": 8080, "Type": "tcp"},
+            {"PrivatePort": 443, "Type": "tcp"},
+        ],
+    },
+    {
+        "Id": "b" * 64,
+        "Names": ["/other_app-app-1"],
+        "Labels": {
+            "com.docker.compose.project": "other_app",
+            "com.docker.compose.service": "app",
+        },
+        "State": "exited",
+        "Ports": [],
+    },
+]
+
+
+class FakeDockerHandler(http.server.BaseHTTPRequestHandler):
+    "Minimal Docker Engine API"
+
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        pass
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        "Serve docker api requests"
+
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+        parts = url.path.strip("/").split("/")
+        containers = {x["Id"]: x for x in FAKE_CONTAINERS}
+        status, body = 200, None
+
+        if parts == ["version"]:
+            body = {"ApiVersion": "1.43"}
+        elif parts == ["containers", "json"]:
+            labels = json.loads(params.get("filters", ["{}"])[0]).get("label", [])
+            body = []
+            for container in FAKE_CONTAINERS:
+                ok = True
+                for label in labels:
+                    key, _, value = label.partition("=")
+                    found = container["Labels"].get(key)
+                    ok = ok and found is not None and (not value or found == value)
+                if ok:
+                    body.append(container)
+        elif len(parts) == 3 and parts[1] in containers and parts[2] == "json":
+            container = containers[parts[1]]
+            body = {"Id": parts[1], "Name": container["Names"][0], "Config": {"Tty": False}}
+        elif len(parts) == 3 and parts[1] in containers and parts[2] == "logs":
+            self.server.logs_params.append(params)
+            frames = [(1, b"hello\n"), (2, b"oops\n")]
+            if "follow" in params:
+                # Stream chunks as they come, a frame is split across chunks
+                # and partial lines of stdout and stderr interleave
+                frames = [
+                    (1, b"hel"),
+                    (2, b"oo"),
+                    (1, b"lo\nwor"),
+                    (2, b"ps\n"),
+                    (1, b"ld\n"),
+                ]
+                self.send_response(200)
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                for stream, line in frames:
+                    frame = struct.pack(">BxxxL", stream, len(line)) + line
+                    for chunk in [frame[:5], frame[5:]]:
+                        self.wfile.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+                        self.wfile.flush()
+                self.wfile.write(b"0\r\n\r\n")
+                return
+            body = b""
+            for stream, line in frames:
+                body += struct.pack(">BxxxL", stream, len(line)) + line
+        else:
+            status, body = 404, {"message": "page not found"}
+
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def test_docker_api_engine(tmp_path, monkeypatch, capsys):
+    "Ensure read operations go through the docker api, with pooled connections"
+
+    sock = str(tmp_path / "docker.sock")
+    server = socketserver.ThreadingUnixStreamServer(sock, FakeDockerHandler)
+    server.connections = 0
+    server.logs_params = []
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setenv("DOCKER_HOST", f"unix://{sock}")
+
+    def fail_exec(*args, **kwargs):
+        raise AssertionError("Docker CLI must not be called")
+
+    monkeypatch.setattr(engines, "_exec", fail_exec)
+
+    try:
+        app_conf = {
+            "config": {
+                "root_hint": cwd + "/tests/examples/var_merge",
+                "engine": "docker-api",
+            }
+        }
+        psf = PaasifyApp(payload=app_conf)
+        prj = psf.load_project()
+        stack = prj.stacks.get_children()[0]
+        assert isinstance(stack.engine.resolve(), engines.EngineDockerAPI)
+
+        rows = stack.engine.get_ps()
+        assert [row["Name"] for row in rows] == ["var_merge_app1-app1-1"]
+        assert rows[0]["Ports"] == [":::8080->80/tcp"]
+
+        prj.stacks.cmd_stack_ps(output_json=True)
+        result = json.loads(capsys.readouterr().out)
+        assert [name for name, rows in result.items() if rows] == ["app1"]
+
+        with pytest.raises(error.DockerAPIError, match="404"):
+            docker_api.get_client().inspect("missing")
+
+        # All requests share the same keep-alive connection
+        assert server.connections == 1
+
+        # Logs are streamed on their own connection
+        stack.engine.logs()
+        assert capsys.readouterr().out.splitlines() == [
+            "var_merge_app1-app1-1  | hello",
+            "var_merge_app1-app1-1  | oops",
+        ]
+        assert server.connections == 2
+
+        prj.stacks.cmd_stack_logs(stacks=[stack], follow=True, since="10m", tail=5)
+        lines = [line.split() for line in capsys.readouterr().out.splitlines()]
+        assert lines == [
+            ["app1/var_merge_app1-app1-1", "|", "hello"],
+            ["app1/var_merge_app1-app1-1", "|", "oops"],
+            ["app1/var_merge_app1-app1-1", "|", "world"],
+        ]
+        params = server.logs_params[-1]
+        assert params["follow"] == ["1"] and params["tail"] == ["5"]
+        assert abs(int(params["since"][0]) - (time.time() - 600)) < 60
+        assert docker_api.parse_since("2023-01-01T00:00:00Z") == "1672531200"
+    finally:
+        docker_api.get_client().close()
+        server.shutdown()
+        server.server_close()
+
+
+def test_multiplex():
+    "Ensure iterables are consumed concurrently, errors are yielded"
+
+    def failing():
+        yield "before"
+        raise ValueError("boom")
+
+    items = list(multiplex({"a": iter(range(500)), "b": failing()}, maxsize=4))
+    assert [item for key, item in items if key == "a"] == list(range(500))
+    errors = [item for key, item in items if key == "b"]
+    assert errors[0] == "before"
+    assert isinstance(errors[1], ValueError)
+
+
+def test_stacks_logs_stream(monkeypatch, capsys):
+    "Ensure logs of many stacks are streamed at once, with prefixes"
+
+    calls = []
+
+    def fake_exec(command, cli_args=None, **kwargs):
+        calls.append(kwargs)
+        project = cli_args[cli_args.index("--project-name") + 1]
+        return iter([f"app-1  | hello from {project}\n", "no prefix\n"])
+
+    monkeypatch.setattr(
+        engines.EngineDetect, "detect", lambda self, engine=None: engines.EngineComposeV2
+    )
+    monkeypatch.setattr(engines, "_exec", fake_exec)
+
+    psf = PaasifyApp(payload={"config": {"root_hint": cwd + "/tests/examples/var_merge"}})
+    prj = psf.load_project()
+    stacks = prj.stacks.get_children()[:2]
+    prj.stacks.cmd_stack_logs(stacks=stacks, follow=True, tail=5)
+
+    assert len(calls) == 2
+    assert all(kwargs["_iter"] for kwargs in calls)
+    lines = [line.split() for line in capsys.readouterr().out.splitlines()]
+    assert sorted(lines) == [
+        ["app1", "|", "no", "prefix"],
+        ["app1/app-1", "|", "hello", "from", "var_merge_app1"],
+        ["app2", "|", "no", "prefix"],
+        ["app2/app-1", "|", "hello", "from", "var_merge_app2"],
+    ]
+
+
+def test_engine_run_stream(monkeypatch):
+    "Ensure streamed commands log lines as emitted and keep only the tail"
+
+    calls = []
+    logged = []
+
+    def fake_exec(command, cli_args=None, **kwargs):
+        calls.append(kwargs)
+        if not kwargs.get("_iter"):
+            return None
+
+        def lines():
+            for idx in range(engines.STREAM_BUFFER_LINES + 50):
+                # Each line is logged before the next one is produced
+                assert len(logged) == idx
+                yield f"line {idx}\n"
+
+        return lines()
+
+    class FakeLogger:
+        def notice(self, msg):
+            logged.append(msg)
+
+    monkeypatch.setattr(
+        engines.EngineDetect, "detect", lambda self, engine=None: engines.EngineComposeV2
+    )
+    monkeypatch.setattr(engines, "_exec", fake_exec)
+
+    psf = PaasifyApp(payload={"config": {"root_hint": cwd + "/tests/examples/var_merge"}})
+    prj = psf.load_project()
+    engine = prj.stacks.get_children()[0].engine
+
+    out = engine.run(cli_args=["up"], logger=FakeLogger(), stream=True, _fg=False)
+    assert calls[-1]["_iter"] and calls[-1]["_err_to_out"]
+    assert "_fg" not in calls[-1]
+    assert len(logged) == engines.STREAM_BUFFER_LINES + 50
+    assert len(out.lines) == engines.STREAM_BUFFER_LINES
+    assert out.lines[-1] == f"line {engines.STREAM_BUFFER_LINES + 49}"
+    assert out.exit_code == 0
+
+    # Foreground commands are not streamed
+    engine.run(cli_args=["up"], stream=True, _fg=True)
+    assert calls[-1] == {"_fg": True}
+
+
+def test_engine_up_stream_logs(monkeypatch, caplog):
+    "Ensure streamed compose output goes to the cli logger tree"
+
+    caplog.set_level(logging.INFO, logger="paasify.cli")
+    monkeypatch.setattr(
+        engines.EngineDetect, "detect", lambda self, engine=None: engines.EngineComposeV2
+    )
+    monkeypatch.setattr(
+        engines,
+        "_exec",
+        lambda command, cli_args=None, **kwargs: iter(["Container app-1  Started\n"]),
+    )
+
+    psf = PaasifyApp(payload={"config": {"root_hint": cwd + "/tests/examples/var_merge"}})
+    prj = psf.load_project()
+    prj.stacks.get_children()[0].engine.up(_fg=False)
+
+    records = [x for x in caplog.records if x.getMessage() == "Container app-1  Started"]
+    assert records
+    assert records[0].name.startswith("paasify.cli.")
+
+
+def test_benchmark_smoke(tmp_path):
+    "Ensure the offline benchmark runs on a small synthetic project"
+
+    spec = importlib.util.spec_from_file_location(
+        "paasify_benchmark", cwd + "/scripts/benchmark.py"
+    )
+    bench = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(bench)
+
+    report = bench.run_benchmark([2], [3], str(tmp_path))
+    result = report["results"][0]
+    assert list(result["phases"]) == ["load", "tag_plan", "stack_vars", "assemble"]
+    assert os.path.isfile(tmp_path / "prj_2_3" / "stack0001" / "docker-compose.run.yml")
+
+    # Same report is never a regression
+    assert bench.compare(report, report, 0.25) == []
+
+    # Yaml benchmark
+    report = bench.run_yaml_benchmark(5, rounds=1)
+    assert report["services"] == 5
+    assert "python" in report["results"]
+
+
+def test_profiler_spans():
+    "Ensure spans are aggregated per phase, stack and tag"
+
+    prof = Profiler()
+    with prof.span("ignored"):
+        pass
+    assert prof.events == []
+
+    prof.enable()
+    with prof.span("assemble", stack="app1"):
+        with prof.span("jsonnet", tag="traefik-svc", action="docker_transform"):
+            pass
+        with prof.span("jsonnet", tag="traefik-svc"):
+            pass
+
+    phases = {row["name"]: row["count"] for row in prof.summary()}
+    assert phases == {"assemble": 1, "jsonnet": 2}
+    assert [row["stack"] for row in prof.summary(group="stack")] == ["app1"]
+    assert prof.summary(group="stack")[0]["count"] == 1
+    assert prof.summary(group="tag")[0]["count"] == 2
+
+    trace = prof.to_chrome_trace()["traceEvents"]
+    assert {x["ph"] for x in trace} == {"X"}
+    assert trace[0]["args"] == {
+        "action": "docker_transform",
+        "stack": "app1",
+        "tag": "traefik-svc",
+    }
+
+
+def test_profiler_assemble():
+    "Ensure assemble phases are instrumented"
+
+    root_prj = cwd + "/tests/examples/var_merge"
+    psf = PaasifyApp(payload={"config": {"root_hint": root_prj}})
+    prj = psf.load_project()
+
+    profiler.enable()
+    try:
+        prj.stacks.cmd_stack_assemble(no_cache=True)
+    finally:
+        profiler.disable()
+
+    phases = {row["name"] for row in profiler.summary()}
+    for phase in [
+        "assemble",
+        "lookup_candidates",
+        "gen_conveniant_vars",
+        "render_vars",
+        "jsonnet",
+        "compose_config",
+    ]:
+        assert phase in phases
+    stacks = {row["stack"] for row in profiler.summary(group="stack")}
+    assert "test_devel" in stacks
+    assert "docker-net-attach" in {row["tag"] for row in profiler.summary(group="tag")}
+
+
 # Test stacks vars scenarios
 # ------------------------
 def test_stacks_vars(caplog, data_regression) -> None:
@@ -187,6 +1540,31 @@ def test_stacks_vars(caplog, data_regression) -> None:
     data_regression.check(results)
 
 
+def test_stacks_vars_native_compose(caplog, data_regression) -> None:
+    "Ensure native compose merge produces the same output as docker compose"
+
+    caplog.set_level(logging.INFO, logger="paasify.cli")
+
+    # Load project
+    root_prj = cwd + "/tests/examples/var_merge"
+    app_conf = {
+        "config": {
+            "root_hint": root_prj,
+        }
+    }
+    psf = PaasifyApp(payload=app_conf)
+
+    prj = psf.load_project()
+    for stack in prj.stacks.get_children():
+        stack.engine.compose_merge = "native"
+    prj.stacks.cmd_stack_assemble()
+
+    # Check results against docker compose golden files
+    recursive_replace(root_prj, root_prj, os.path.relpath(root_prj))
+    results = load_yaml_file_hierarchy(root_prj)
+    data_regression.check(results, basename="test_stacks_vars")
+
+
 # Main run
 # ------------------------
 if __name__ == "__main__":